@@ -0,0 +1,52 @@
+"""Benchmark batch cost prediction with a CostModel.
+
+Predicts the cost of a single path and of a two path signature for a growing
+number of random contexts. The single path signature is evaluated directly,
+the two path signature first maps every distinct context to its path.
+
+Usage: python benchmarks/bench_cost_model.py [n_contexts ...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from papan import CostModel
+
+
+def make_results(n_ctxs):
+    """Return analysis results of one single path and one two path sig."""
+    return {
+        "sigs": {"void mat(int, int)": "sig_0", "void sort(int)": "sig_1"},
+        "ctxs": {
+            "sig_0": {"1, 1": "path_0"},
+            "sig_1": {
+                str(n): f"path_{int(n % 2)}" for n in range(1, n_ctxs + 1)
+            },
+        },
+        "exprs": {
+            "sig_0": {"path_0": "C_1 + T_2*X0*X1 + C_3*X0"},
+            "sig_1": {"path_0": "C_1 + C_2*X0*log(X0)", "path_1": "C_1"},
+        },
+    }
+
+
+def main(sizes):
+    model = CostModel(make_results(1000), default_cost=1)
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        X = rng.integers(1, 1000, (size, 2))
+        start = time.perf_counter()
+        model.predict_batch("void mat(int, int)", X)
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        model.predict_batch("void sort(int)", X[:, 0])
+        two = time.perf_counter() - start
+        print(
+            f"{size} contexts: single path {single:.3f}s, two paths {two:.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10**4, 10**5, 10**6, 10**7])
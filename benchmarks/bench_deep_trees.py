@@ -0,0 +1,78 @@
+"""Benchmark loading and analyzing very deep recursive traces.
+
+Every traversal in papan uses an explicit stack, and trace files nested
+deeper than the JSON decoder's recursion limit are decoded without recursion,
+so traces far deeper than Python's recursion limit load and analyze without
+raising it.
+
+Usage: python benchmarks/bench_deep_trees.py [depth ...]
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from papan import analyze, utils
+
+SIG = "unsigned long long Recurse(unsigned long)"
+
+
+def write_trace(f, depth):
+    """Write the trace of a function recursing depth levels deep to f.
+
+    json.dump recurses as deep as the trace, so the nesting is written out
+    directly.
+    """
+    for n in reversed(range(depth)):
+        f.write(
+            json.dumps(
+                {
+                    "id": 1,
+                    "type": "CalleeExpr",
+                    "sig": SIG,
+                    "params": [{"name": "n", "value": str(n)}],
+                }
+            )[:-1]
+            + ', "children": [{"id": 2, "type": "IfThenStmt", "desc":'
+            ' "n > 0", "children": ['
+        )
+    f.write('{"id": 3, "type": "ReturnStmt", "desc": "return 0",')
+    f.write(' "children": []}')
+    f.write("]}]}" * depth)
+
+
+def main(depths):
+    print(f"Recursion limit: {sys.getrecursionlimit()}")
+    for depth in depths:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "paptrace.json")
+            with open(path, "w") as f:
+                f.write('{"traces": [')
+                for i in range(3):
+                    if i:
+                        f.write(", ")
+                    write_trace(f, depth - i)
+                f.write("]}")
+
+            start = time.perf_counter()
+            trees = utils.from_file(path)
+            load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = analyze.analyze({}, trees)
+        analyze_time = time.perf_counter() - start
+
+        exprs = results["exprs"]["sig_0"]
+        print(
+            f"depth={depth}: load {load_time:.2f}s, analyze"
+            f" {analyze_time:.2f}s, {len(exprs)} paths"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,45 @@
+"""Benchmark the time it takes a new interpreter to import papan.
+
+The regression backends (deap, gplearn and scikit-learn) are imported on
+first use, so importing papan should take a fraction of the time it takes
+with them. Every import runs in a new interpreter, so nothing is cached.
+
+Usage: python benchmarks/bench_import_time.py [repeats]
+"""
+
+import subprocess
+import sys
+
+
+def import_time(code):
+    """Return the time it takes a new interpreter to run code."""
+    proc = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import time\n"
+            "start = time.perf_counter()\n"
+            f"{code}\n"
+            "print(time.perf_counter() - start)\n",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(proc.stdout)
+
+
+def main(repeats):
+    papan_time = min(import_time("import papan") for _ in range(repeats))
+    backends_time = min(
+        import_time("import papan, gplearn.genetic; papan.regression._deap()")
+        for _ in range(repeats)
+    )
+    print(
+        f"import papan: {papan_time:.2f}s, with backends:"
+        f" {backends_time:.2f}s (best of {repeats})"
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,65 @@
+"""Benchmark loop iteration partitioning as the iteration count grows.
+
+Iterations are fingerprinted and counted with hashed lookups in one pass, so
+the time per iteration should stay flat from a thousand to a million
+iterations.
+
+Usage: python benchmarks/bench_loop_partition.py [iterations ...]
+"""
+
+import sys
+import time
+
+from papan import Node
+from papan.node import partition_iterations
+
+
+def stmt(id_, type_="DeclStmt", children=()):
+    return {
+        "id": id_,
+        "type": type_,
+        "desc": f"stmt {id_}",
+        "children": list(children),
+    }
+
+
+def make_loop_trace(n_iters):
+    """Return a loop trace with a pre-body check and a two statement body."""
+    children = [stmt(10, "IfThenStmt")]
+    for _ in range(n_iters):
+        children.append(stmt(11, "LoopIter"))
+        children.append(stmt(12))
+        children.append(stmt(13, "IfThenStmt", [stmt(14)]))
+        children.append(stmt(10, "IfThenStmt"))
+    # An early exit makes the final iteration differ from the others.
+    children.append(stmt(11, "LoopIter"))
+    children.append(stmt(15, "ReturnStmt"))
+    return {"id": 3, "type": "ForStmt", "desc": "for", "children": children}
+
+
+def main(sizes):
+    for n_iters in sizes:
+        trace = make_loop_trace(n_iters)
+        start = time.perf_counter()
+        loop = Node.from_trace(trace)
+        build_time = time.perf_counter() - start
+        assert loop.iter_count == n_iters
+
+        children = loop.children
+        start = time.perf_counter()
+        partition_iterations(
+            children,
+            is_iter=lambda child: child.is_iter_node(),
+            get_cf_nodes=lambda child: child.get_cf_nodes(),
+            key=lambda child: child._local_key(),
+        )
+        partition_time = time.perf_counter() - start
+        print(
+            f"iterations={n_iters}: build {build_time:.2f}s, partition"
+            f" {partition_time:.3f}s"
+            f" ({1e6 * partition_time / n_iters:.2f}us/iteration)"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 1000000])
@@ -0,0 +1,75 @@
+"""Benchmark loading a trace file with a growing number of worker processes.
+
+The worker processes scan the file for the byte spans of the traces, decode
+and build the trees and send them back as compact records. The parent
+combines the scans of the blocks and rebuilds the nodes from the records. Its
+CPU time is printed too, since it bounds the speedup.
+
+Usage: python benchmarks/bench_parallel_load.py [workers ...]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+from papan import utils
+
+
+def stmt(id_, type_="DeclStmt", children=()):
+    return {
+        "id": id_,
+        "type": type_,
+        "desc": f"stmt {id_}",
+        "children": list(children),
+    }
+
+
+def make_call_trace(n, depth):
+    """Return a call trace with 20 statements and 3 nested calls per level."""
+    children = [
+        stmt(i, "IfThenStmt" if i % 5 == 0 else "DeclStmt") for i in range(20)
+    ]
+    if depth > 0:
+        children += [make_call_trace(n, depth - 1) for _ in range(3)]
+    return {
+        "id": 100 + depth,
+        "type": "CalleeExpr",
+        "sig": f"void foo{depth}(int)",
+        "params": [{"name": "n", "value": str(n)}],
+        "children": children,
+    }
+
+
+def main(worker_counts):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "paptrace.json")
+        with open(path, "w") as f:
+            json.dump(
+                {"traces": [make_call_trace(n, 4) for n in range(400)]}, f
+            )
+
+        start = time.perf_counter()
+        expected = utils.from_file(path)
+        serial_time = time.perf_counter() - start
+        print(f"serial: {serial_time:.2f}s")
+
+        for workers in worker_counts:
+            start = time.perf_counter()
+            parent_start = time.process_time()
+            trees = utils.from_file(path, workers=workers)
+            parent_time = time.process_time() - parent_start
+            load_time = time.perf_counter() - start
+            assert [tree.root for tree in trees] == [
+                tree.root for tree in expected
+            ]
+            print(
+                f"workers={workers}: {load_time:.2f}s"
+                f" ({serial_time / load_time:.2f}x), parent CPU"
+                f" {parent_time:.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [2, 4, 8, 16, 32])
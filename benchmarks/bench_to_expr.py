@@ -0,0 +1,80 @@
+"""Benchmark building the expressions of large traces, as find_repr_exprs does.
+
+Every trace of a path is turned into an expression with tree.to_expr(known),
+so the cost of creating the per-node cost symbols and of parsing the known
+expressions is paid once per node of every trace.
+
+Usage: python benchmarks/bench_to_expr.py [n_stmts ...]
+"""
+
+import contextlib
+import io
+import sys
+import time
+
+from papan import Tree, analyze
+
+N_TRACES = 20
+
+# Known costs of the called functions and of some statements.
+KNOWN = {f"int callee{i}(int)": f"K_{i}*log(X0) + {i}" for i in range(10)}
+KNOWN.update({f"stmt {i}": f"S_{i}" for i in range(0, 1000, 7)})
+
+
+def make_trace(n, n_stmts):
+    """Return a trace with n_stmts statements, every tenth one a call."""
+    children = []
+    for i in range(n_stmts):
+        if i % 10 == 0:
+            children.append(
+                {
+                    "id": 2000 + i,
+                    "type": "CallerExpr",
+                    "sig": f"int callee{i % 100 // 10}(int)",
+                    "params": [{"name": "n", "value": str(n)}],
+                    "children": [],
+                }
+            )
+        else:
+            children.append(
+                {
+                    "id": i,
+                    "type": "DeclStmt",
+                    "desc": f"stmt {i % 1000}",
+                    "children": [],
+                }
+            )
+    return {
+        "id": 1,
+        "type": "CalleeExpr",
+        "sig": "void foo(int)",
+        "params": [{"name": "n", "value": str(n)}],
+        "children": children,
+    }
+
+
+def main(sizes):
+    for n_stmts in sizes:
+        trees = [
+            Tree.from_trace(make_trace(n, n_stmts)) for n in range(N_TRACES)
+        ]
+        path_dict = analyze.get_path_partitions(trees)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyze.find_repr_exprs(path_dict, KNOWN)
+        analyze_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for tree in trees:
+            tree.to_expr(KNOWN)
+        to_expr_time = time.perf_counter() - start
+        print(
+            f"{N_TRACES} traces of {n_stmts} statements:"
+            f" find_repr_exprs {analyze_time:.2f}s,"
+            f" to_expr with unparsed known exprs {to_expr_time:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 5000, 20000])
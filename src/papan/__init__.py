@@ -3,5 +3,12 @@ __version__ = "0.1.0"
 
 from papan.node import Node, StmtNode, CallNode
 from papan.tree import Tree
+from papan.flat import FlatTree
+from papan.intern import SubtreeInterner
+from papan.link import CallIndex
+from papan.model import CostModel
 import papan.utils
+import papan.columnar
 import papan.analyze
+import papan.pipeline
+from papan.reduce import ContextReducer
@@ -1,12 +1,21 @@
+import concurrent.futures
+import functools
 import json
 
-import anytree
 import sympy
 import numpy as np
 
-from .node import Node
+from .complexity import fit_complexity
+from .link import CallIndex
+from .node import parse_known_exprs
 from .utils import from_file
-from .regression import gplearn_symreg, deap_symreg
+from .regression import (
+    gplearn_symreg,
+    deap_symreg,
+    data_seed,
+    dataset_digest,
+    dataset_key,
+)
 
 
 def to_params_str(params):
@@ -14,63 +23,65 @@ def to_params_str(params):
     return ", ".join([f"{param['value']}" for param in params])
 
 
+def to_ctx(params):
+    """Return the numeric context of a call: one value per parameter."""
+    return [int(param["value"]) for param in params]
+
+
+def ctx_array(rows):
+    """Return the contexts array of a list of to_ctx contexts.
+
+    Traces of single parameter functions give a vector of contexts, all other
+    traces a (n_traces x n_params) matrix.
+    """
+    ctxs = np.array(rows)
+    return ctxs[:, 0] if ctxs.ndim == 2 and ctxs.shape[1] == 1 else ctxs
+
+
 def to_call_str(node):
     return f"{node.sig}: ({to_params_str(node.params)})"
 
 
-def link_recursive_nodes(trees):
-    # Let's start by putting our trace root nodes in a container that allows us
-    # to lookup the trace by context.
-    # NOTE: This does not account for complete non-root traces (e.g., RecursiveMemoImpl).
-    trace_roots = {}
-    for tree in trees:
-        call_str = to_call_str(tree.root)
-        if call_str not in trace_roots:
-            trace_roots[call_str] = tree.root
-        else:
-            if tree.root != trace_roots[call_str]:
-                raise RuntimeError(
-                    "Unhandled scenario: 2 traces with the same context have"
-                    " differing trees."
-                )
+def link_recursive_nodes(trees, index=None):
+    """Link the calls in trees whose context is the context of a trace.
 
-    # Next we walk the trees looking for child nodes that can be substituted with a
-    # trace root node.
-    for tree in trees:
-        for node in anytree.PreOrderIter(tree.root):
-            if node.is_root:
-                continue
-            replace_children = False
-            new_children = []
-            for child in node.children:
-                if child.type == "CalleeExpr":
-                    child_call_str = to_call_str(child)
-                    if child_call_str in trace_roots:
-                        replace_children = True
-                        child = anytree.SymlinkNode(child)
-                new_children.append(child)
-            if replace_children:
-                node.children = tuple(new_children)
+    index is a CallIndex (see papan.link) that all of trees were added to,
+    e.g. by the loader. Otherwise one is built from trees. Trees that were
+    linked before are left as they are, so this can be called repeatedly.
+    """
+    # NOTE: This does not account for complete non-root traces (e.g., RecursiveMemoImpl).
+    if index is None:
+        index = CallIndex(trees)
+    index.link()
 
 
 def get_path_partitions(trees):
     # Schema: {sig: {cf_tuple: {path_id: int, traces: [tree]}}}
     path_dict = {}
     for tree in trees:
-        sig_paths = path_dict.setdefault(tree.root.sig, {})
-        cf_tuple = tuple(tree.get_cf_nodes())
-        sig_paths.setdefault(
-            cf_tuple, {"path_id": len(sig_paths), "traces": []}
-        )["traces"].append(tree)
+        add_to_partitions(path_dict, tree)
     return path_dict
 
 
+def add_to_partitions(path_dict, tree):
+    """Add tree to the path of path_dict it takes and return the path entry."""
+    sig_paths = path_dict.setdefault(tree.root.sig, {})
+    cf_tuple = tree.get_cf_nodes()
+    path_entry = sig_paths.setdefault(
+        cf_tuple, {"path_id": len(sig_paths), "traces": []}
+    )
+    path_entry["traces"].append(tree)
+    return path_entry
+
+
 def is_constant(exprs):
     """Returns True if all expressions are equal."""
     return len(set(exprs)) == 1
 
 
-def find_repr_exprs(path_dict, known):
+def find_repr_exprs(
+    path_dict, known, workers=None, cache=None, symreg_options=None
+):
     # We will want to query the results with a tuple of (signature, ctx). To do
     # this we will need to map the ctx for a signature to the correct path ID.
     # Therefore, the results will need to contain two sections:
@@ -78,96 +89,232 @@ def find_repr_exprs(path_dict, known):
     # 2. A mapping from (sig_id, ctx) to path_id.
     # 3. A mapping from (sig_id, path_id) to the path expression.
     results = {"sigs": {}, "ctxs": {}, "exprs": {}}
+    paths = [
+        (sig, path_entry)
+        for sig, sig_entry in path_dict.items()
+        for path_entry in sig_entry.values()
+    ]
+    for sig, path_entry, expr in solve_paths(
+        paths, known, workers, cache, symreg_options=symreg_options
+    ):
+        add_result(
+            results, sig, path_entry["path_id"], expr, path_contexts(path_entry)
+        )
+    return results
 
-    def add_result(sig, path_id, expr, trees):
-        print(f"  Found expr.: {expr}")
-        sig_id = results["sigs"].setdefault(sig, f"sig_{len(results['sigs'])}")
-        path_id_str = f"path_{path_id}"
-        results["exprs"].setdefault(sig_id, {})[path_id_str] = str(expr)
-        result_ctxs = results["ctxs"].setdefault(sig_id, {})
-        for tree in trees:
-            result_ctxs[to_params_str(tree.root.params)] = path_id_str
 
-    for sig, sig_entry in path_dict.items():
-        for cf_tuple, path_entry in sig_entry.items():
-            path_id = path_entry["path_id"]
-            trees = path_entry["traces"]
-            print(f"\nFinding general expr. for: {sig}: ({path_id})")
-
-            # Check if there are any loops in the trees. If the loop iter counts are
-            # different, then we will need to solve for the loop expression.
-            if trees[0].has_loop():
-                ctxs = np.array(
-                    [int(to_params_str(tree.root.params)) for tree in trees]
-                )
-                loop_nodes = [tree.get_loop_nodes() for tree in trees]
-                ref_nodes = loop_nodes[0]
-                found_variable_loop = False
-                for i, ref_node in enumerate(ref_nodes):
-                    if ref_node.iter_count == 0:
-                        # This is a constant loop node. We can skip it.
-                        continue
+def path_contexts(path_entry):
+    """Return the params strings of the contexts of a path's traces."""
+    if "contexts" in path_entry:
+        # Streamed path entries (see papan.pipeline) only keep the contexts.
+        return path_entry["contexts"]
+    return [to_params_str(tree.root.params) for tree in path_entry["traces"]]
 
-                    print(f"  Solving for loop expr for node: {ref_node.name}")
-                    found_variable_loop = True
-                    iter_cnts = np.zeros((len(loop_nodes),))
-                    for j in range(0, len(loop_nodes)):
-                        iter_cnts[j] = loop_nodes[j][i].iter_count
-
-                    # Optimization: If the loop iter counts are the same, then we can
-                    # just use values from the 0th entry.
-                    loop_expr = None
-                    if iter_cnts.ptp() == 0:
-                        print(f"    Loop iteration is constant.")
-                        loop_expr = sympy.sympify(iter_cnts[0])
-                    else:
-                        # Optimization: Check for complete linear dependence.
-                        x = ctxs
-                        y = iter_cnts
-                        corr = np.corrcoef(ctxs, iter_cnts)
-                        if corr.ptp() == 0 and corr[0, 1] == 1:
-                            print(
-                                f"    Loop iteration has perfect linear"
-                                f" correlation."
-                            )
-                            m = (iter_cnts[1] - iter_cnts[0]) / (
-                                ctxs[1] - ctxs[0]
-                            )
-                            b = iter_cnts[0] - m * ctxs[0]
-                            loop_expr = sympy.sympify(f"{m} * X0 + {b}")
-                        else:
-                            print(f"    Performing symbolic regression.")
-                            # We need to regress for the relationship.
-                            # loop_expr = gplearn_symreg(data)
-                            loop_expr = deap_symreg(x, y)
-
-                    if loop_expr is None:
-                        raise RuntimeError("Failed to find loop expression.")
-                    ref_node.set_loop_expr(loop_expr)
-
-                if found_variable_loop:
-                    add_result(sig, path_id, trees[0].to_expr(known), trees)
+
+def loop_data(path_entry, trees):
+    """Return the contexts of trees and the iteration counts of their loops.
+
+    The counts are one array per loop node of trees[0], with one entry per
+    tree. Streamed path entries hold the contexts and counts of all their
+    traces already.
+    """
+    if "loop_counts" in path_entry:
+        rows, counts = path_entry["ctx_rows"], path_entry["loop_counts"]
+    else:
+        rows = [to_ctx(tree.root.params) for tree in trees]
+        loop_nodes = [tree.get_loop_nodes() for tree in trees]
+        counts = [
+            [nodes[i].iter_count for nodes in loop_nodes]
+            for i in range(len(loop_nodes[0]))
+        ]
+    return ctx_array(rows), [np.array(c, dtype=float) for c in counts]
+
+
+def add_result(results, sig, path_id, expr, contexts):
+    """Add the expression of a path and its contexts (see path_contexts)."""
+    sig_id = results["sigs"].setdefault(sig, f"sig_{len(results['sigs'])}")
+    path_id_str = f"path_{path_id}"
+    results["exprs"].setdefault(sig_id, {})[path_id_str] = str(expr)
+    result_ctxs = results["ctxs"].setdefault(sig_id, {})
+    for ctx in contexts:
+        result_ctxs[ctx] = path_id_str
+
+
+def solve_paths(
+    paths, known, workers=None, cache=None, loop_exprs=None, symreg_options=None
+):
+    """Find the general expression of each (sig, path_entry) of paths.
+
+    Returns a list of (sig, path_entry, expr) for the paths an expression was
+    found for, in the order of paths. loop_exprs maps the (sig, path_id, loop
+    index) of a loop to the dataset_digest of its (contexts, iteration counts)
+    data and its solved expression. If a dict is given, loops whose data is
+    unchanged since they were last solved are not fitted again, and the
+    newly solved loops replace their entries. symreg_options is passed on to
+    run_regressions().
+    """
+    # Every trace's expression uses the known expressions, so they are only
+    # parsed once.
+    known = parse_known_exprs(known)
+    solved = {} if loop_exprs is None else loop_exprs
+
+    # Regressions are slow and independent of each other, so they are first
+    # collected as jobs while walking the paths and run together afterwards.
+    # Adding results is deferred as well to keep the order of the results.
+    jobs = []
+    pending = []
+    for sig, path_entry in paths:
+        path_id = path_entry["path_id"]
+        # A ContextReducer may have picked the traces to solve with.
+        trees = path_entry.get("sample", path_entry["traces"])
+        print(f"\nFinding general expr. for: {sig}: ({path_id})")
+
+        # Check if there are any loops in the trees. If the loop iter counts are
+        # different, then we will need to solve for the loop expression.
+        if trees[0].has_loop():
+            ctxs, loop_counts = loop_data(path_entry, trees)
+            ref_nodes = trees[0].get_loop_nodes()
+            found_variable_loop = False
+            for i, ref_node in enumerate(ref_nodes):
+                if ref_node.iter_count == 0:
+                    # This is a constant loop node. We can skip it.
                     continue
 
-            # Get the expressions for each trace.
-            exprs = [tree.to_expr(known) for tree in trees]
+                print(f"  Solving for loop expr for node: {ref_node.name}")
+                found_variable_loop = True
+                iter_cnts = loop_counts[i]
+
+                loop = (sig, path_id, i)
+                old_digest, old_expr = solved.get(loop, (None, None))
+
+                # Optimization: If the loop iter counts are the same, then we can
+                # just use values from the 0th entry.
+                loop_expr = None
+                if np.ptp(iter_cnts) == 0:
+                    print(f"    Loop iteration is constant.")
+                    loop_expr = sympy.sympify(iter_cnts[0])
+                elif (digest := dataset_digest(ctxs, iter_cnts)) == old_digest:
+                    print(f"    Loop iteration data was solved before.")
+                    loop_expr = old_expr
+                else:
+                    # Optimization: Check for complete linear dependence.
+                    x = ctxs
+                    y = iter_cnts
+                    # Only single parameter contexts are checked,
+                    # fit_complexity covers the others.
+                    linear = False
+                    if ctxs.ndim == 1:
+                        corr = np.corrcoef(ctxs, iter_cnts)
+                        linear = np.ptp(corr) == 0 and corr[0, 1] == 1
+                    if linear:
+                        print(
+                            f"    Loop iteration has perfect linear"
+                            f" correlation."
+                        )
+                        m = (iter_cnts[1] - iter_cnts[0]) / (ctxs[1] - ctxs[0])
+                        b = iter_cnts[0] - m * ctxs[0]
+                        loop_expr = sympy.sympify(f"{m} * X0 + {b}")
+                    elif (loop_expr := fit_complexity(x, y)) is not None:
+                        print(
+                            f"    Loop iteration fits a closed form:"
+                            f" {loop_expr}."
+                        )
+                    else:
+                        print(f"    Queueing symbolic regression.")
+                        # We need to regress for the relationship.
+                        # loop_expr = gplearn_symreg(data)
+                        jobs.append((ref_node, loop, digest, x, y))
+                        continue
+                    solved[loop] = (digest, loop_expr)
+
+                ref_node.set_loop_expr(loop_expr)
 
-            if is_constant(exprs):
-                print("  Path is constant.")
-                add_result(sig, path_id, exprs[0], trees)
+            if found_variable_loop:
+                # The expression is built once the loop exprs are set.
+                pending.append((sig, path_entry, None))
                 continue
 
-            print("  No general expr. found for exprs:")
-            for expr in exprs:
-                print(f"    {expr}")
+        # Get the expressions for each trace.
+        if "exprs" in path_entry:
+            # Streamed path entries hold the distinct expressions.
+            exprs = path_entry["exprs"]
+        else:
+            exprs = [tree.to_expr(known) for tree in trees]
 
-    return results
+        if is_constant(exprs):
+            print("  Path is constant.")
+            pending.append((sig, path_entry, exprs[0]))
+            continue
+
+        print("  No general expr. found for exprs:")
+        for expr in exprs:
+            print(f"    {expr}")
+
+    regressed = run_regressions(
+        [(x, y) for *_, x, y in jobs], workers, cache, symreg_options
+    )
+    for (ref_node, loop, digest, _, _), loop_expr in zip(jobs, regressed):
+        if loop_expr is None:
+            raise RuntimeError("Failed to find loop expression.")
+        solved[loop] = (digest, loop_expr)
+        ref_node.set_loop_expr(loop_expr)
+
+    found = []
+    for sig, path_entry, expr in pending:
+        if expr is None:
+            expr = path_entry.get("sample", path_entry["traces"])[0].to_expr(
+                known
+            )
+        print(f"  Found expr.: {expr}")
+        found.append((sig, path_entry, expr))
+    return found
 
 
-def analyze(known, trees):
-    link_recursive_nodes(trees)
+def run_regressions(data, workers=None, cache=None, symreg_options=None):
+    """Run a symbolic regression for each (x, y) pair of data.
+
+    Each regression is seeded from its own data, so the results do not depend
+    on the order or the number of workers. Identical data is only regressed
+    once. With workers > 1 the regressions run on a process pool. Results are
+    looked up in and added to cache (a RegressionCache), if given.
+    symreg_options is a dict of keyword arguments of deap_symreg(), such as
+    time_budget, target_error and stall_generations.
+    """
+    symreg = functools.partial(
+        deap_symreg, cache=cache, **(symreg_options or {})
+    )
+    unique = {}
+    for x, y in data:
+        unique.setdefault(dataset_key(x, y), (x, y))
+    jobs = list(unique.values())
+    seeds = [data_seed(x, y) for x, y in jobs]
+    if workers is not None and workers > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            exprs = list(
+                pool.map(
+                    symreg, [x for x, _ in jobs], [y for _, y in jobs], seeds
+                )
+            )
+    else:
+        exprs = [symreg(x, y, seed) for (x, y), seed in zip(jobs, seeds)]
+    results = dict(zip(unique, exprs))
+    return [results[dataset_key(x, y)] for x, y in data]
+
+
+def analyze(
+    known,
+    trees,
+    workers=None,
+    cache=None,
+    index=None,
+    reducer=None,
+    symreg_options=None,
+):
+    link_recursive_nodes(trees, index)
 
     path_dict = get_path_partitions(trees)
+    if reducer is not None:
+        reducer.reduce(path_dict)
     print("Path summary:")
     for sig, sig_entry in path_dict.items():
         print(f"- {sig}: {len(sig_entry)} paths")
@@ -176,10 +323,97 @@ def analyze(known, trees):
                 f"  - [path_{path_entry['path_id']}] {cf_tuple}:"
                 f" {len(path_entry['traces'])} traces"
             )
+    if reducer is not None:
+        print_reduction(reducer.stats())
 
-    results = find_repr_exprs(path_dict, known)
+    results = find_repr_exprs(path_dict, known, workers, cache, symreg_options)
     return results
     print("\nResults:")
     print(json.dumps(results, indent=4))
     with open(args.output_file, "w") as f_out:
         f_out.write(json.dumps(results, indent=2))
+
+
+def print_reduction(stats):
+    """Print the per signature stats of a ContextReducer."""
+    print("Reduction summary:")
+    for sig, counts in stats.items():
+        print(
+            f"- {sig}: {counts['kept']} of {counts['traces']} traces kept"
+            f" ({counts['duplicates']} duplicate contexts,"
+            f" {counts['sampled_out']} sampled out)"
+        )
+
+
+class AnalysisSession:
+    """Incremental analysis of a growing set of traces.
+
+    The session keeps the call index, the path partitions, the solved loop
+    expressions and the expression of every path between calls to add().
+    Adding trees links them, partitions them and solves only the paths they
+    land in. Loops whose (contexts, iteration counts) data is unchanged are
+    not fitted again. results() returns what analyze() would return for all
+    the trees added so far. If a ContextReducer is given, the touched paths
+    are reduced before they are solved. symreg_options is passed on to
+    run_regressions().
+    """
+
+    def __init__(
+        self, known, workers=None, cache=None, reducer=None, symreg_options=None
+    ):
+        self.known = parse_known_exprs(known)
+        self.workers = workers
+        self.cache = cache
+        self.symreg_options = symreg_options
+        self.reducer = reducer
+        self.index = CallIndex()
+        self.path_dict = {}
+        # (sig, path_id) -> expression of each solved path.
+        self._exprs = {}
+        # (sig, path_id, loop index) -> (dataset_digest of the loop data, loop
+        # expression) of the latest data of each loop, see solve_paths.
+        self._loop_exprs = {}
+
+    def add(self, trees):
+        """Add a batch of trees, re-solve the paths they land in and return
+        the updated results."""
+        trees = list(trees)
+        for tree in trees:
+            self.index.add(tree)
+        self.index.link()
+        touched = {}
+        for tree in trees:
+            sig = tree.root.sig
+            path_entry = add_to_partitions(self.path_dict, tree)
+            touched[(sig, path_entry["path_id"])] = (sig, path_entry)
+        if self.reducer is not None:
+            for sig, path_entry in touched.values():
+                self.reducer.reduce_path(sig, path_entry)
+        for path in touched:
+            self._exprs.pop(path, None)
+        for sig, path_entry, expr in solve_paths(
+            touched.values(),
+            self.known,
+            self.workers,
+            self.cache,
+            self._loop_exprs,
+            self.symreg_options,
+        ):
+            self._exprs[(sig, path_entry["path_id"])] = expr
+        return self.results()
+
+    def results(self):
+        """Return the results of all the trees added so far."""
+        results = {"sigs": {}, "ctxs": {}, "exprs": {}}
+        for sig, sig_entry in self.path_dict.items():
+            for path_entry in sig_entry.values():
+                expr = self._exprs.get((sig, path_entry["path_id"]))
+                if expr is not None:
+                    add_result(
+                        results,
+                        sig,
+                        path_entry["path_id"],
+                        expr,
+                        path_contexts(path_entry),
+                    )
+        return results
@@ -0,0 +1,305 @@
+"""Compact columnar binary format for paptrace output.
+
+A paptrace JSON file can be converted once with convert() and then reopened
+any number of times with TraceFile, which memory-maps the file and builds
+trees straight from the flat arrays without re-tokenizing any text. With
+TraceFile.flat_tree() the arrays are copied into a FlatTree without creating
+any per-node objects at all.
+
+Layout (little-endian):
+
+    magic    8 bytes  b"PAPCOL\\0\\0"
+    version  uint32
+    count    uint32   number of sections
+    count x (name: 16 bytes, dtype: 8 bytes, offset: uint64, length: uint64)
+    section data, each aligned to 8 bytes
+
+Nodes of all traces are stored in pre-order in one set of columns, and the
+nodes of trace i are node_id[trace_offsets[i]:trace_offsets[i + 1]].
+"""
+
+import array
+import mmap
+import struct
+
+import numpy as np
+
+from .flat import FlatTree, StringTable
+from .node import Node, StmtNode, LoopNode, CallNode
+from .tree import Tree
+
+MAGIC = b"PAPCOL\0\0"
+VERSION = 1
+
+_HEADER = struct.Struct("<8sII")
+_SECTION = struct.Struct("<16s8sQQ")
+
+# Section name -> (array typecode used while writing, numpy dtype on disk).
+_SECTIONS = {
+    # Start of each trace in the node columns (n_traces + 1 entries).
+    "trace_offsets": ("q", "<i8"),
+    # Per node columns.
+    "node_id": ("q", "<i8"),
+    "node_type": ("B", "<u1"),
+    # Distance back to the parent node; 0 for trace roots.
+    "node_parent": ("L", "<u4"),
+    # String index of the sig/desc; -1 if the node has none.
+    "node_str": ("l", "<i4"),
+    # Start of each node's params (n_nodes + 1 entries).
+    "param_offsets": ("q", "<i8"),
+    "param_name": ("l", "<i4"),
+    "param_value": ("l", "<i4"),
+    # String index of each type code's name.
+    "type_names": ("l", "<i4"),
+    # Interned strings, stored as utf-8 bytes with n_strings + 1 offsets.
+    "str_offsets": ("q", "<i8"),
+    "str_data": ("B", "<u1"),
+}
+
+
+class _StringTable:
+    def __init__(self):
+        self.index = {}
+        self.offsets = array.array("q", [0])
+        self.data = bytearray()
+
+    def intern(self, s):
+        idx = self.index.get(s)
+        if idx is None:
+            idx = self.index[s] = len(self.index)
+            self.data += s.encode("utf-8")
+            self.offsets.append(len(self.data))
+        return idx
+
+
+def write(traces, path):
+    """Write the given paptrace trace entries to path in columnar form."""
+    cols = {name: array.array(code) for name, (code, _) in _SECTIONS.items()}
+    strings = _StringTable()
+    type_codes = {}
+    cols["trace_offsets"].append(0)
+    cols["param_offsets"].append(0)
+
+    for trace in traces:
+        if not isinstance(trace, dict):
+            raise TypeError("The JSON object is not a dict.")
+        base = len(cols["node_id"])
+        # Pre-order walk with an explicit stack of (trace, parent index).
+        stack = [(trace, -1)]
+        while stack:
+            node, parent = stack.pop()
+            idx = len(cols["node_id"])
+            type_ = node["type"]
+            code = type_codes.get(type_)
+            if code is None:
+                code = type_codes[type_] = len(type_codes)
+                cols["type_names"].append(strings.intern(type_))
+            cols["node_id"].append(node["id"])
+            cols["node_type"].append(code)
+            cols["node_parent"].append(0 if parent < 0 else idx - parent)
+            desc = node["sig"] if "sig" in node else node.get("desc")
+            cols["node_str"].append(
+                -1 if desc is None else strings.intern(desc)
+            )
+            for param in node.get("params", ()):
+                cols["param_name"].append(strings.intern(param["name"]))
+                cols["param_value"].append(strings.intern(param["value"]))
+            cols["param_offsets"].append(len(cols["param_name"]))
+            for child in reversed(node["children"]):
+                stack.append((child, idx))
+        if len(cols["node_id"]) == base:
+            raise ValueError("Empty trace entry.")
+        cols["trace_offsets"].append(len(cols["node_id"]))
+
+    cols["str_offsets"] = strings.offsets
+    cols["str_data"] = array.array("B", bytes(strings.data))
+
+    header_size = _HEADER.size + _SECTION.size * len(_SECTIONS)
+    offset = _align(header_size)
+    table = []
+    for name, (_, dtype) in _SECTIONS.items():
+        col = cols[name]
+        table.append((name, dtype, offset, len(col)))
+        offset = _align(offset + len(col) * np.dtype(dtype).itemsize)
+
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(table)))
+        for name, dtype, offset, length in table:
+            f.write(
+                _SECTION.pack(name.encode(), dtype.encode(), offset, length)
+            )
+        for name, dtype, offset, length in table:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(np.asarray(cols[name], dtype=dtype).tobytes())
+
+
+def convert(json_path, path):
+    """Convert a paptrace JSON output file into a columnar trace file."""
+    # Imported here to avoid a circular import through papan.utils.
+    from .utils import iter_traces
+
+    write(iter_traces(json_path), path)
+
+
+def from_file(path):
+    """Return a list of trees built from the given columnar trace file."""
+    with TraceFile(path) as trace_file:
+        return list(trace_file)
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+class TraceFile:
+    """Memory-mapped reader for a columnar trace file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, count = _HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError(f"'{path}' is not a columnar trace file.")
+            if version != VERSION:
+                raise ValueError(f"Unsupported trace file version {version}.")
+            self._cols = {}
+            for i in range(count):
+                name, dtype, offset, length = _SECTION.unpack_from(
+                    self._mm, _HEADER.size + i * _SECTION.size
+                )
+                self._cols[name.rstrip(b"\0").decode()] = np.frombuffer(
+                    self._mm,
+                    dtype=dtype.rstrip(b"\0").decode(),
+                    count=length,
+                    offset=offset,
+                )
+        except Exception:
+            self.close()
+            raise
+        self._strings = [None] * (len(self._cols["str_offsets"]) - 1)
+        self._string_table = None
+        self._types = [self.string(int(i)) for i in self._cols["type_names"]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Release the memory map. Trees already built stay valid."""
+        # The arrays export the map's buffer and must go before it closes.
+        self._cols = {}
+        if not self._mm.closed:
+            self._mm.close()
+
+    def __len__(self):
+        return len(self._cols["trace_offsets"]) - 1
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError("Trace index out of range.")
+        return self.tree(i % len(self))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.tree(i)
+
+    def column(self, name):
+        """Return the named column as a read-only array."""
+        return self._cols[name]
+
+    def string(self, i):
+        """Return the interned string with index i."""
+        s = self._strings[i]
+        if s is None:
+            offsets = self._cols["str_offsets"]
+            data = self._cols["str_data"]
+            s = self._strings[i] = (
+                data[offsets[i] : offsets[i + 1]].tobytes().decode("utf-8")
+            )
+        return s
+
+    def tree(self, i):
+        """Build the tree of trace i."""
+        cols = self._cols
+        start = int(cols["trace_offsets"][i])
+        end = int(cols["trace_offsets"][i + 1])
+        ids = cols["node_id"][start:end].tolist()
+        types = cols["node_type"][start:end].tolist()
+        parents = cols["node_parent"][start:end].tolist()
+        strs = cols["node_str"][start:end].tolist()
+        param_offsets = cols["param_offsets"][start : end + 1].tolist()
+        param_names = cols["param_name"]
+        param_values = cols["param_value"]
+
+        # Children have higher pre-order indices than their parent, so
+        # building in reverse order creates every node after its children.
+        children = [[] for _ in range(end - start)]
+        root = None
+        for j in range(end - start - 1, -1, -1):
+            type_ = self._types[types[j]]
+            kids = children[j]
+            kids.reverse()
+            if Node.is_call_type(type_):
+                p0, p1 = param_offsets[j], param_offsets[j + 1]
+                params = [
+                    {
+                        "name": self.string(int(param_names[k])),
+                        "value": self.string(int(param_values[k])),
+                    }
+                    for k in range(p0, p1)
+                ]
+                node = CallNode(
+                    ids[j], type_, self.string(strs[j]), params, children=kids
+                )
+            else:
+                cls = LoopNode if Node.is_loop_type(type_) else StmtNode
+                desc = None if strs[j] < 0 else self.string(strs[j])
+                node = cls(ids[j], type_, desc, children=kids)
+            children[j] = None
+            if parents[j] == 0:
+                root = node
+            else:
+                children[j - parents[j]].append(node)
+        if not isinstance(root, CallNode):
+            raise ValueError(f"Trace {i} does not start with a call node.")
+        return Tree.from_root(root)
+
+    def strings(self):
+        """Return a StringTable holding every string of the file."""
+        if self._string_table is None:
+            self._string_table = StringTable(
+                self.string(i) for i in range(len(self._strings))
+            )
+        return self._string_table
+
+    def flat_tree(self, i):
+        """Build trace i as a FlatTree sharing the file's string table."""
+        cols = self._cols
+        start = int(cols["trace_offsets"][i])
+        end = int(cols["trace_offsets"][i + 1])
+        positions = np.arange(end - start)
+        parents = cols["node_parent"][start:end].astype(np.int64)
+        parents = np.where(parents == 0, -1, positions - parents)
+        param_offsets = cols["param_offsets"][start : end + 1]
+        p0, p1 = int(param_offsets[0]), int(param_offsets[-1])
+        param_strs = np.empty(2 * (p1 - p0), dtype=np.int32)
+        param_strs[0::2] = cols["param_name"][p0:p1]
+        param_strs[1::2] = cols["param_value"][p0:p1]
+        return FlatTree(
+            cols["node_id"][start:end].tolist(),
+            cols["node_type"][start:end].tolist(),
+            parents.tolist(),
+            cols["node_str"][start:end].tolist(),
+            (param_offsets - p0).tolist(),
+            param_strs.tolist(),
+            self._types,
+            self.strings(),
+        )
+
+    def iter_flat_trees(self):
+        """Yield every trace of the file as a FlatTree."""
+        for i in range(len(self)):
+            yield self.flat_tree(i)
@@ -0,0 +1,135 @@
+"""Closed-form fitting of common complexity classes.
+
+Loop iteration counts usually follow one of a few well-known growth rates.
+fit_complexity least-squares fits a library of basis functions of the
+context, alone and in pairs, and returns the simplest exact fit, so that
+symbolic regression is only needed for data none of them explains. Contexts
+of several parameters X0, X1, ... are fitted with the basis functions of each
+parameter and the products of pairs of parameters.
+"""
+
+import itertools
+
+import numpy as np
+import sympy
+
+x = sympy.Symbol("X0")
+
+_PHI = (1 + np.sqrt(5)) / 2
+
+
+def _n_log_n(n):
+    return np.where(n > 0, n * np.log(np.where(n > 0, n, 1)), 0)
+
+
+def _log(n):
+    return np.log(np.where(n > 0, n, 1))
+
+
+# (sympy expression, vectorized function) for each basis function, simplest
+# first. The golden ratio pair fits fibonacci-like counts exactly.
+BASIS = [
+    (x, lambda n: n),
+    (sympy.log(x), _log),
+    (x * sympy.log(x), _n_log_n),
+    (x**2, lambda n: n**2),
+    (x**3, lambda n: n**3),
+    (sympy.sqrt(x), lambda n: np.sqrt(np.abs(n))),
+    (2**x, lambda n: np.power(2.0, n)),
+    (sympy.GoldenRatio**x, lambda n: np.power(_PHI, n)),
+    ((1 - sympy.GoldenRatio) ** x, lambda n: np.power(1 - _PHI, n)),
+]
+
+# Largest number of basis functions combined in one model.
+MAX_TERMS = 2
+
+
+def _candidates(ctxs):
+    """Return the (expression, column) of every term of the model search.
+
+    Linear terms come first, then the products of pairs of parameters and
+    then the remaining basis functions of each parameter.
+    """
+    params = sympy.symbols(f"X0:{ctxs.shape[1]}")
+    columns = ctxs.T
+    linear, other = BASIS[0], BASIS[1:]
+    candidates = [
+        (linear[0].subs(x, param), linear[1](col))
+        for param, col in zip(params, columns)
+    ]
+    for (i, a), (j, b) in itertools.combinations(enumerate(params), 2):
+        candidates.append((a * b, columns[i] * columns[j]))
+    for expr, func in other:
+        for param, col in zip(params, columns):
+            candidates.append((expr.subs(x, param), func(col)))
+    return candidates
+
+
+def fit_complexity(ctxs, counts, tol=1e-6, max_terms=MAX_TERMS):
+    """Return a closed-form expression of counts in terms of ctxs, or None.
+
+    ctxs is a vector of single parameter contexts, or a matrix with one row
+    per context and one column per parameter. Every combination of up to
+    max_terms terms (see _candidates) plus a constant is fitted by least
+    squares, fewest terms first. The first model whose error on each count
+    is at most tol * max(1, |count|) is returned. Models need at least two
+    more samples than coefficients, so that a fit is never accepted only
+    because it interpolates the data.
+    """
+    ctxs = np.asarray(ctxs, dtype=float)
+    if ctxs.ndim == 1:
+        ctxs = ctxs.reshape(-1, 1)
+    counts = np.asarray(counts, dtype=float)
+    # The error allowed on each count.
+    limit = tol * np.maximum(1.0, np.abs(counts))
+    with np.errstate(over="ignore", invalid="ignore"):
+        candidates = _candidates(ctxs)
+    exprs = [expr for expr, _ in candidates]
+    columns = [col for _, col in candidates]
+    usable = [i for i, col in enumerate(columns) if np.all(np.isfinite(col))]
+    ones = np.ones(len(ctxs))
+    for n_terms in range(1, max_terms + 1):
+        if len(ctxs) < n_terms + 3:
+            break
+        for terms in itertools.combinations(usable, n_terms):
+            a = np.column_stack([columns[i] for i in terms] + [ones])
+            # Weighting the rows by the limits fits the relative errors.
+            coefs, _, rank, _ = np.linalg.lstsq(
+                a / limit[:, None], counts / limit, rcond=None
+            )
+            if rank < a.shape[1]:
+                # The basis functions are dependent on these contexts.
+                continue
+            if np.all(np.abs(a @ coefs - counts) <= limit):
+                return _to_expr(
+                    [exprs[i] for i in terms], a, coefs, counts, limit
+                )
+    return None
+
+
+def _to_expr(exprs, a, coefs, counts, limit):
+    """Build the fitted expression of the model with columns a.
+
+    Terms whose contribution to every count is within its limit are dropped,
+    and coefficients are rounded to the nearest integer, but each only if
+    the model still fits the counts within limit afterwards.
+    """
+    coefs = coefs.copy()
+
+    def fits():
+        return np.all(np.abs(a @ coefs - counts) <= limit)
+
+    result = sympy.Integer(0)
+    for i, expr in enumerate(exprs + [sympy.Integer(1)]):
+        coef = coefs[i]
+        if np.all(np.abs(coef * a[:, i]) <= limit):
+            coefs[i] = 0.0
+            if fits():
+                continue
+        coefs[i] = round(coef)
+        if fits():
+            result += sympy.Integer(round(coef)) * expr
+        else:
+            coefs[i] = coef
+            result += sympy.Float(coef) * expr
+    return result
@@ -0,0 +1,411 @@
+"""Array-backed tree representation.
+
+A FlatTree stores a whole trace in parallel arrays indexed by pre-order node
+position instead of one anytree object per trace event. It exposes the same
+operations as Tree for analysis (get_cf_nodes, get_loop_nodes, has_loop and
+to_expr) at a fraction of the memory.
+"""
+
+import array
+
+import sympy
+
+from .node import Node, cost_symbol, partition_iterations
+
+
+class StringTable:
+    """Interned strings shared by the flat trees of a load."""
+
+    def __init__(self, strings=()):
+        self._strings = list(strings)
+        self._index = {s: i for i, s in enumerate(self._strings)}
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __getitem__(self, i):
+        return self._strings[i]
+
+    def intern(self, s):
+        """Return the index of s, adding it to the table if needed."""
+        i = self._index.get(s)
+        if i is None:
+            i = self._index[s] = len(self._strings)
+            self._strings.append(s)
+        return i
+
+
+class _TypeInfo:
+    __slots__ = ("name", "is_call", "is_cf", "is_loop", "is_iter")
+
+    def __init__(self, name):
+        self.name = name
+        self.is_call = Node.is_call_type(name)
+        self.is_cf = Node.is_cf_type(name)
+        self.is_loop = Node.is_loop_type(name)
+        self.is_iter = Node.is_iter_type(name)
+
+
+class FlatNode:
+    """Lightweight view of a single node of a FlatTree."""
+
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def __repr__(self):
+        return f"FlatNode(name={self.name!r}, type={self.type!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, FlatNode):
+            return NotImplemented
+        return self.tree._subtree_key(self.index) == other.tree._subtree_key(
+            other.index
+        )
+
+    @property
+    def name(self):
+        return self.tree._ids[self.index]
+
+    @property
+    def type(self):
+        return self.tree._type_info(self.index).name
+
+    @property
+    def desc(self):
+        return self.tree._str(self.index)
+
+    @property
+    def sig(self):
+        return self.tree._str(self.index)
+
+    @property
+    def params(self):
+        return self.tree._params(self.index)
+
+    @property
+    def parent(self):
+        parent = self.tree._parents[self.index]
+        return None if parent < 0 else FlatNode(self.tree, parent)
+
+    @property
+    def is_root(self):
+        return self.index == 0
+
+    @property
+    def children(self):
+        return tuple(
+            FlatNode(self.tree, i) for i in self.tree._children(self.index)
+        )
+
+    @property
+    def iter_count(self):
+        return self.tree._loops[self.index][1]
+
+    def set_loop_expr(self, loop_expr):
+        """Set the loop expression."""
+        print(f"    Setting loop expr for node {self.name} to {loop_expr}")
+        self.tree._loop_exprs[self.index] = loop_expr
+
+    def get_cf_nodes(self):
+        """Return a tuple of control flow nodes."""
+        return self.tree._get_cf_nodes(self.index)
+
+    def get_loop_nodes(self):
+        """Returns a list of loop nodes."""
+        return self.tree._get_loop_nodes(self.index)
+
+    def to_expr(self, known_exprs):
+        """Returns a symbolic expression of the subtree."""
+        return self.tree._to_expr(self.index, known_exprs)
+
+
+class FlatTree:
+    """A trace tree stored in parallel arrays.
+
+    Nodes are stored in pre-order. Each node has a type code (an index into
+    types), a parent index, first-child/next-sibling indices and an index
+    into the string table for its sig or desc (-1 if it has none). The params
+    of node i are the (name, value) string index pairs
+    param_strs[2 * param_offsets[i]:2 * param_offsets[i + 1]].
+    """
+
+    def __init__(
+        self,
+        ids,
+        types,
+        parents,
+        strs,
+        param_offsets,
+        param_strs,
+        type_names,
+        strings,
+    ):
+        self._ids = array.array("q", ids)
+        self._types = array.array("B", types)
+        self._parents = array.array("i", parents)
+        self._strs = array.array("i", strs)
+        self._param_offsets = array.array("i", param_offsets)
+        self._param_strs = array.array("i", param_strs)
+        self._type_infos = [_TypeInfo(name) for name in type_names]
+        self._strings = strings
+        if len(self._ids) == 0 or not self._type_info(0).is_call:
+            raise ValueError("The root of a flat tree must be a call node.")
+
+        n = len(self._ids)
+        self._first_child = array.array("i", [-1]) * n
+        self._next_sibling = array.array("i", [-1]) * n
+        # Link siblings back to front so each child is prepended in order.
+        for i in range(n - 1, 0, -1):
+            parent = self._parents[i]
+            self._next_sibling[i] = self._first_child[parent]
+            self._first_child[parent] = i
+
+        # Loop index -> (iter_block, iter_count, trailing_iter_block). Inner
+        # loops come later in pre-order, so partitioning back to front sees
+        # them before the loops that contain them.
+        self._loops = {}
+        self._loop_exprs = {}
+        self._cf_cache = {}
+        for i in range(n - 1, -1, -1):
+            if self._type_info(i).is_loop:
+                self._loops[i] = partition_iterations(
+                    list(self._children(i)),
+                    is_iter=lambda j: self._type_info(j).is_iter,
+                    get_cf_nodes=self._get_cf_nodes,
+                    key=self._local_key,
+                )
+
+        root = self.root
+        param_str = ", ".join(
+            [f"{p['name']}={p['value']}" for p in root.params]
+        )
+        self.name = f"{root.sig}({param_str})"
+
+    @staticmethod
+    def from_trace(trace, strings=None):
+        """Create a flat tree from a paptrace trace entry."""
+        if not isinstance(trace, dict):
+            raise TypeError("The JSON object is not a dict.")
+        strings = StringTable() if strings is None else strings
+        type_codes = {}
+        ids, types, parents, strs = [], [], [], []
+        param_offsets, param_strs = [0], []
+        stack = [(trace, -1)]
+        while stack:
+            node, parent = stack.pop()
+            idx = len(ids)
+            type_ = node["type"]
+            ids.append(node["id"])
+            types.append(type_codes.setdefault(type_, len(type_codes)))
+            parents.append(parent)
+            desc = node["sig"] if "sig" in node else node.get("desc")
+            strs.append(-1 if desc is None else strings.intern(desc))
+            for param in node.get("params", ()):
+                param_strs.append(strings.intern(param["name"]))
+                param_strs.append(strings.intern(param["value"]))
+            param_offsets.append(len(param_strs) // 2)
+            for child in reversed(node["children"]):
+                stack.append((child, idx))
+        return FlatTree(
+            ids,
+            types,
+            parents,
+            strs,
+            param_offsets,
+            param_strs,
+            list(type_codes),
+            strings,
+        )
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __repr__(self):
+        return repr(self.root)
+
+    @property
+    def root(self):
+        return FlatNode(self, 0)
+
+    @property
+    def children(self):
+        return self.root.children
+
+    def _type_info(self, i):
+        return self._type_infos[self._types[i]]
+
+    def _str(self, i):
+        s = self._strs[i]
+        return None if s < 0 else self._strings[s]
+
+    def _params(self, i):
+        p0, p1 = self._param_offsets[i], self._param_offsets[i + 1]
+        return [
+            {
+                "name": self._strings[self._param_strs[2 * k]],
+                "value": self._strings[self._param_strs[2 * k + 1]],
+            }
+            for k in range(p0, p1)
+        ]
+
+    def _children(self, i):
+        child = self._first_child[i]
+        while child >= 0:
+            yield child
+            child = self._next_sibling[child]
+
+    def _subtree_end(self, i):
+        """Return one past the pre-order index of the last node under i."""
+        while i >= 0:
+            if self._next_sibling[i] >= 0:
+                return self._next_sibling[i]
+            i = self._parents[i]
+        return len(self._ids)
+
+    def _local_key(self, i):
+        """Key identifying the statement at node i, ignoring its children."""
+        return (
+            self._ids[i],
+            self._type_info(i).name,
+            self._str(i),
+            tuple(self._params_key(i)),
+        )
+
+    def _params_key(self, i):
+        p0, p1 = self._param_offsets[i], self._param_offsets[i + 1]
+        for k in range(2 * p0, 2 * p1):
+            yield self._strings[self._param_strs[k]]
+
+    def _subtree_key(self, i):
+        """Key that is equal for structurally identical subtrees."""
+        end = self._subtree_end(i)
+        return tuple(
+            (self._local_key(j), self._parents[j] - i if j > i else -1)
+            for j in range(i, end)
+        )
+
+    def get_cf_nodes(self):
+        """Return a tuple of control flow nodes."""
+        return self._get_cf_nodes(0)
+
+    def get_loop_nodes(self):
+        """Returns a list of loop nodes."""
+        return self._get_loop_nodes(0)
+
+    def has_loop(self):
+        """Returns True if the tree has at least one loop."""
+        return len(self._loops) > 0
+
+    def to_expr(self, known_exprs):
+        """Returns a symbolic expression of the tree."""
+        return self._to_expr(0, known_exprs)
+
+    def _cf_children(self, i):
+        """Children of node i that contribute to its control flow."""
+        loop = self._loops.get(i)
+        if loop is None:
+            return list(self._children(i))
+        iter_block, _, trailing_iter_block = loop
+        if trailing_iter_block is None:
+            return list(iter_block)
+        return list(iter_block) + list(trailing_iter_block)
+
+    def _get_cf_nodes(self, i):
+        cf_nodes = self._cf_cache.get(i)
+        if cf_nodes is None:
+            cf_nodes = []
+            stack = [i]
+            while stack:
+                j = stack.pop()
+                cached = self._cf_cache.get(j)
+                if cached is not None:
+                    # Splice in subtrees whose sequence is already known.
+                    cf_nodes.extend(cached)
+                    continue
+                if self._type_info(j).is_cf:
+                    cf_nodes.append(self._ids[j])
+                stack.extend(reversed(self._cf_children(j)))
+            cf_nodes = tuple(cf_nodes)
+            # Only whole trees and loops are cached; caching every node would
+            # cost more memory than the tree itself.
+            if i == 0 or i in self._loops:
+                self._cf_cache[i] = cf_nodes
+        return cf_nodes
+
+    def _get_loop_nodes(self, i):
+        # Loop nodes are listed after all loop nodes below them.
+        loop_nodes = []
+        stack = [(i, False)]
+        while stack:
+            j, visited = stack.pop()
+            if visited:
+                loop_nodes.append(FlatNode(self, j))
+                continue
+            if j in self._loops:
+                stack.append((j, True))
+            stack.extend(
+                (child, False) for child in reversed(list(self._children(j)))
+            )
+        return loop_nodes
+
+    def _to_expr(self, i, known_exprs):
+        # Each pending entry carries the list of terms it contributes to, so
+        # sums are built once per term list rather than one "+" at a time.
+        # Loop nodes collect their iteration block into a separate list, which
+        # is folded into the parent's terms by a ("loop", ...) entry.
+        result = []
+        stack = [("node", i, result)]
+        while stack:
+            kind, j, terms = stack.pop()
+            if kind == "loop":
+                loop_terms, trailing_terms = terms
+                expr = _sum(loop_terms)
+                loop_expr = self._loop_exprs.get(j)
+                if expr is not None and loop_expr is not None:
+                    expr = sympy.Mul(loop_expr, expr)
+                parent_terms = trailing_terms
+                if expr is not None:
+                    parent_terms.append(expr)
+                continue
+
+            info = self._type_info(j)
+            name = self._ids[j]
+            if info.is_call:
+                sig = self._str(j)
+                if info.name == "CallerExpr":
+                    if sig in known_exprs:
+                        terms.append(sympy.sympify(known_exprs[sig]))
+                    else:
+                        terms.append(cost_symbol("T", name))
+                    continue
+                terms.append(cost_symbol("C", name))
+                children = list(self._children(j))
+            elif info.is_loop:
+                iter_block, _, trailing_iter_block = self._loops[j]
+                if trailing_iter_block is not None:
+                    for child in reversed(trailing_iter_block):
+                        stack.append(("node", child, terms))
+                loop_terms = []
+                stack.append(("loop", j, (loop_terms, terms)))
+                for child in reversed(iter_block):
+                    stack.append(("node", child, loop_terms))
+                continue
+            else:
+                desc = self._str(j)
+                if desc in known_exprs:
+                    terms.append(sympy.sympify(known_exprs[desc]))
+                elif not info.is_cf:
+                    terms.append(cost_symbol("T", name))
+                children = list(self._children(j))
+            for child in reversed(children):
+                stack.append(("node", child, terms))
+        return _sum(result)
+
+
+def _sum(terms):
+    if len(terms) == 0:
+        return None
+    return sympy.Add(*terms)
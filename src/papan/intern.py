@@ -0,0 +1,98 @@
+"""Sharing of structurally identical subtrees across trees.
+
+Traces often repeat the same subtrees, e.g. every call to a leaf function
+that takes the same path. A SubtreeInterner passed to Tree.from_trace (or to
+the loaders in papan.utils) keeps the first copy of each such subtree and
+replaces later copies with an anytree.SymlinkNode to it, so the trees of a
+load form a DAG. The node traversals already look through symlinks, so the
+shared subtrees behave as if every tree had its own copy.
+
+Only subtrees without loops are shared, since loop nodes hold per-tree
+analysis state (their loop expression). Shared subtrees must not be modified
+afterwards. If one is anyway (CallIndex.link() replaces the children of
+recursive calls), the interner stops handing it out, so an interner can keep
+being used for later loads.
+"""
+
+import anytree
+
+from .node import LoopNode
+
+
+class SubtreeInterner:
+    """Table of the distinct subtrees seen while building trees."""
+
+    def __init__(self):
+        # Structural hash of a subtree when it was interned -> list of
+        # (canonical subtree, number of nodes it holds). Nodes are mutable, so
+        # they are not used as keys themselves.
+        self._table = {}
+        self._unique = 0
+        self.nodes = 0
+        self.shared = 0
+        self.nodes_saved = 0
+
+    def __len__(self):
+        return self._unique
+
+    def intern(self, node):
+        """Return node or a link to an identical subtree seen before.
+
+        node must be a newly built, parentless subtree whose children have
+        already been interned.
+        """
+        self.nodes += 1
+        if isinstance(node, LoopNode):
+            return node
+        size = 1
+        for child in node.children:
+            child_size = self._size(child)
+            if child_size is None:
+                # The subtree holds a loop.
+                return node
+            size += child_size
+        if size == 1:
+            # A link costs as much as a leaf.
+            return node
+        key = hash(node)
+        entries = self._lookup(key)
+        for canonical, _ in entries:
+            if canonical == node:
+                self.shared += 1
+                self.nodes_saved += size - 1
+                return anytree.SymlinkNode(canonical)
+        entries.append((node, size))
+        self._unique += 1
+        return node
+
+    def _lookup(self, key):
+        """Return the entries interned under key, without the subtrees that
+        were modified since."""
+        entries = self._table.setdefault(key, [])
+        live = [entry for entry in entries if hash(entry[0]) == key]
+        if len(live) != len(entries):
+            self._unique -= len(entries) - len(live)
+            entries[:] = live
+        return entries
+
+    def _size(self, child):
+        """Return the node count of a shareable child, or None."""
+        if isinstance(child, anytree.SymlinkNode):
+            return 1
+        if isinstance(child, LoopNode):
+            return None
+        if len(child.children) == 0:
+            return 1
+        for canonical, size in self._table.get(hash(child), ()):
+            if canonical is child:
+                return size
+        return None
+
+    def stats(self):
+        """Return a dict summarizing how much was deduplicated."""
+        return {
+            "nodes": self.nodes,
+            "unique_subtrees": self._unique,
+            "shared_subtrees": self.shared,
+            "nodes_saved": self.nodes_saved,
+        }
@@ -0,0 +1,115 @@
+"""Linking of recursive calls to the traces of their contexts.
+
+A call inside a trace whose (signature, parameters) context is also the
+context of a trace root is replaced with an anytree.SymlinkNode. A CallIndex
+records the trace roots and the positions of the callee nodes of trees as
+they are added, e.g. by the loaders in papan.utils, so that linking only
+visits callee nodes and compares integer signature ids and parameter tuples
+instead of formatting call strings.
+
+Linking is idempotent: callees are linked at most once, so the same index
+can be linked again after more trees were added, and analyze can be run
+repeatedly on the same trees.
+"""
+
+import anytree
+
+from .node import Node
+
+# States of the callee entries of a CallIndex.
+_PENDING = 0
+_LINKED = 1
+# Inside a linked callee, whose subtree is not linked any further.
+_SKIPPED = 2
+
+
+class CallIndex:
+    """Index of the trace roots and callee nodes of a set of trees."""
+
+    def __init__(self, trees=()):
+        self._sig_ids = {}
+        # (sig id, params) -> first trace root with that context.
+        self.roots = {}
+        # Callee entries in pre-order: (parent, position, key, ancestor),
+        # where ancestor is the entry of the closest enclosing callee.
+        self._callees = []
+        self._states = []
+        self._pending = []
+        for tree in trees:
+            self.add(tree)
+
+    def __len__(self):
+        return len(self.roots)
+
+    def key(self, node):
+        """Return the (sig id, params) context key of a call node."""
+        sig_id = self._sig_ids.setdefault(node.sig, len(self._sig_ids))
+        return sig_id, tuple(str(param["value"]) for param in node.params)
+
+    def add(self, tree):
+        """Add the root and the callee nodes of tree to the index.
+
+        Raises a RuntimeError if a root with the same context but a different
+        tree was added before.
+        """
+        root = tree.root
+        key = self.key(root)
+        other = self.roots.setdefault(key, root)
+        if other is not root and other != root:
+            raise RuntimeError(
+                "Unhandled scenario: 2 traces with the same context have"
+                " differing trees."
+            )
+        if not isinstance(root, Node):
+            # Flat trees have no per-node objects to replace with links.
+            return
+        # The children of the root itself are never linked.
+        stack = [(child, None) for child in reversed(root.children)]
+        while stack:
+            node, ancestor = stack.pop()
+            visit = []
+            for i, child in enumerate(node.children):
+                if isinstance(child, anytree.SymlinkNode):
+                    # Links (e.g. to subtrees shared by a SubtreeInterner)
+                    # are neither indexed nor followed.
+                    continue
+                if child.type == "CalleeExpr":
+                    entry = len(self._callees)
+                    self._callees.append((node, i, self.key(child), ancestor))
+                    self._states.append(_PENDING)
+                    self._pending.append(entry)
+                    visit.append((child, entry))
+                else:
+                    visit.append((child, ancestor))
+            stack.extend(reversed(visit))
+
+    def link(self):
+        """Link the callees whose context is the context of a trace root.
+
+        Callees without a matching root stay pending, so they are linked by a
+        later call once a tree with their context was added. Returns the
+        number of callees linked.
+        """
+        # Group the replacements by parent, so the children of each parent
+        # are set once. Entries are in pre-order, so an enclosing callee is
+        # always decided before the callees inside it.
+        replacements = {}
+        pending = []
+        for j in self._pending:
+            parent, i, key, ancestor = self._callees[j]
+            if ancestor is not None and self._states[ancestor] != _PENDING:
+                self._states[j] = _SKIPPED
+            elif key in self.roots:
+                self._states[j] = _LINKED
+                replacements.setdefault(id(parent), (parent, []))[1].append(i)
+            else:
+                pending.append(j)
+        self._pending = pending
+        n_linked = 0
+        for parent, positions in replacements.values():
+            children = list(parent.children)
+            for i in positions:
+                children[i] = anytree.SymlinkNode(children[i])
+            parent.children = tuple(children)
+            n_linked += len(positions)
+        return n_linked
@@ -0,0 +1,211 @@
+"""Asyncio ingestion of live paptrace output.
+
+Instead of a finished paptrace file, the traces are read as newline-delimited
+JSON records (one trace object per line) from a source given as an address:
+
+- "pipe:PATH" reads a pipe or FIFO, e.g. "pipe:/dev/stdin".
+- "unix:PATH" connects to a UNIX socket.
+- "tcp:HOST:PORT" connects to a TCP socket.
+
+Trees are built as the records arrive and handed to analysis through a
+bounded queue, so analysis overlaps the traced run. The queue provides the
+backpressure: once it is full no more records are read, the stream's buffer
+fills up and the source is paused, which in turn blocks the producer.
+
+Running this module writes the traces of a paptrace file to stdout as
+records, which makes it a stand-in producer for the pipe source, and
+serve_traces is one for the socket sources.
+"""
+
+import asyncio
+import contextlib
+import json
+import sys
+
+from .pipeline import StreamingAnalysis
+from .tree import Tree
+
+# Largest record accepted, in bytes. A stream also pauses its source once it
+# buffers twice as much.
+LINE_LIMIT = 1 << 24
+
+# Number of built trees waiting for analysis before reading pauses.
+QUEUE_SIZE = 16
+
+
+def _parse_address(address):
+    kind, _, location = address.partition(":")
+    if kind in ("pipe", "unix") and location:
+        return kind, location
+    if kind == "tcp":
+        host, _, port = location.rpartition(":")
+        if host and port.isdigit():
+            return kind, (host, int(port))
+    raise ValueError(
+        f"Invalid trace source {address!r}, expected pipe:PATH, unix:PATH or"
+        " tcp:HOST:PORT."
+    )
+
+
+@contextlib.asynccontextmanager
+async def open_source(address, limit=LINE_LIMIT):
+    """Open the trace source at address and yield an asyncio.StreamReader."""
+    kind, location = _parse_address(address)
+    loop = asyncio.get_running_loop()
+    if kind == "pipe":
+        # Opening a FIFO blocks until its writer opens it too.
+        f = await loop.run_in_executor(None, open, location, "rb", 0)
+        reader = asyncio.StreamReader(limit=limit)
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), f
+        )
+        try:
+            yield reader
+        finally:
+            transport.close()
+        return
+    if kind == "unix":
+        reader, writer = await asyncio.open_unix_connection(
+            location, limit=limit
+        )
+    else:
+        reader, writer = await asyncio.open_connection(*location, limit=limit)
+    try:
+        yield reader
+    finally:
+        writer.close()
+        with contextlib.suppress(ConnectionError):
+            await writer.wait_closed()
+
+
+async def iter_traces(reader):
+    """Yield the trace records read from an asyncio.StreamReader."""
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        if line.strip():
+            yield json.loads(line)
+
+
+async def iter_trees(
+    reader,
+    fold_iterations=False,
+    interner=None,
+    index=None,
+    queue_size=QUEUE_SIZE,
+):
+    """Yield the trees of the trace records read from reader.
+
+    The trees are built by a separate task, which reads ahead by up to
+    queue_size trees while the caller works on the yielded ones. See
+    Tree.from_trace and utils.from_file for the other arguments.
+    """
+    queue = asyncio.Queue(queue_size)
+    # Marks the end of the records.
+    done = object()
+
+    async def build():
+        try:
+            async for trace in iter_traces(reader):
+                tree = Tree.from_trace(trace, fold_iterations, interner)
+                if index is not None:
+                    index.add(tree)
+                await queue.put(tree)
+        except Exception as error:
+            # Raised by the consumer once it gets to it.
+            await queue.put(error)
+        else:
+            await queue.put(done)
+
+    builder = asyncio.ensure_future(build())
+    try:
+        while (item := await queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Stops reading if the caller stopped early.
+        builder.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await builder
+
+
+async def analyze_live(
+    address,
+    known,
+    workers=None,
+    cache=None,
+    fold_iterations=False,
+    queue_size=QUEUE_SIZE,
+    symreg_options=None,
+):
+    """Analyze the traces of a live source until it ends.
+
+    Every tree is put into its path bucket (see papan.pipeline) as soon as it
+    arrives; the paths are solved once the source ends. Returns the same
+    results as analyze() would for all the traces.
+    """
+    analysis = StreamingAnalysis(known, workers, cache, symreg_options)
+    async with open_source(address) as reader:
+        async for tree in iter_trees(
+            reader, fold_iterations, queue_size=queue_size
+        ):
+            analysis.add(tree)
+    stats = analysis.stats()
+    print(f"Streamed {stats['trees']} trees into {stats['paths']} paths.")
+    return analysis.results()
+
+
+async def write_traces(writer, traces, delay=0.0):
+    """Write traces as records to an asyncio.StreamWriter and close it.
+
+    The writer is drained after every record, so a slow reader slows the
+    writing down. delay is an extra pause in seconds between records.
+    """
+    try:
+        for trace in traces:
+            writer.write(json.dumps(trace).encode() + b"\n")
+            await writer.drain()
+            if delay:
+                await asyncio.sleep(delay)
+    finally:
+        writer.close()
+        with contextlib.suppress(ConnectionError):
+            await writer.wait_closed()
+
+
+async def serve_traces(address, traces, delay=0.0):
+    """Start a stand-in producer sending traces to every client of address.
+
+    address is a "unix:PATH" or "tcp:HOST:PORT" socket address. Returns the
+    asyncio.Server, which the caller closes.
+    """
+    kind, location = _parse_address(address)
+    traces = list(traces)
+
+    async def handle(_, writer):
+        await write_traces(writer, traces, delay)
+
+    if kind == "unix":
+        return await asyncio.start_unix_server(handle, location)
+    if kind == "tcp":
+        return await asyncio.start_server(handle, *location)
+    raise ValueError(f"Cannot serve traces on {address!r}.")
+
+
+def main(argv):
+    """Write the traces of a paptrace file to stdout as records."""
+    from .utils import iter_traces as iter_file_traces
+
+    if len(argv) != 1:
+        print("Usage: python -m papan.live PAPTRACE_FILE", file=sys.stderr)
+        return 2
+    for trace in iter_file_traces(argv[0]):
+        sys.stdout.write(json.dumps(trace) + "\n")
+        sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
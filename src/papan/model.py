@@ -0,0 +1,152 @@
+"""Cost prediction from analysis results.
+
+analyze() describes every function signature by a set of paths, the
+contexts each path was observed with and one expression per path in terms
+of the context parameters X0, X1, ... and the cost symbols of the statements
+(C_<id>) and callees (T_<id>) on the path. CostModel substitutes the costs,
+compiles the expressions to NumPy functions and evaluates them for new
+contexts, one at a time or in batches.
+"""
+
+import numpy as np
+import sympy
+
+
+class CostModel:
+    """Predicts the cost of calls from the results of analyze().
+
+    costs maps the names of cost symbols to their values. Symbols that are
+    not in costs are given default_cost; if that is None, every symbol must be
+    in costs. A context is mapped to the path it was observed on. A context
+    that was never observed is only accepted if its signature has a single
+    path.
+    """
+
+    def __init__(self, results, costs=None, default_cost=None):
+        costs = {} if costs is None else costs
+        self._sigs = {}
+        for sig, sig_id in results["sigs"].items():
+            path_ids = sorted(results["exprs"][sig_id])
+            ctxs = results["ctxs"].get(sig_id, {})
+            n_params = max((len(_parse_ctx(key)) for key in ctxs), default=0)
+            params = sympy.symbols(f"X0:{n_params}")
+            funcs = [
+                _compile(
+                    results["exprs"][sig_id][path_id],
+                    params,
+                    costs,
+                    default_cost,
+                )
+                for path_id in path_ids
+            ]
+            paths = {
+                _parse_ctx(key): path_ids.index(path_id)
+                for key, path_id in ctxs.items()
+            }
+            self._sigs[sig] = (n_params, funcs, paths)
+
+    @property
+    def sigs(self):
+        """The signatures the model predicts the cost of."""
+        return list(self._sigs)
+
+    def _sig(self, sig):
+        try:
+            return self._sigs[sig]
+        except KeyError:
+            raise KeyError(f"Unknown signature: {sig}") from None
+
+    @staticmethod
+    def _path(sig, funcs, paths, ctx):
+        path = paths.get(ctx)
+        if path is not None:
+            return path
+        if len(funcs) == 1:
+            return 0
+        raise KeyError(
+            f"Context ({', '.join(map(str, ctx))}) of {sig} was not observed"
+            " and the signature has several paths."
+        )
+
+    def predict(self, sig, params):
+        """Return the predicted cost of calling sig with params.
+
+        params is a sequence with one value per parameter of sig.
+        """
+        n_params, funcs, paths = self._sig(sig)
+        ctx = tuple(params)
+        if len(ctx) != n_params:
+            raise ValueError(
+                f"{sig} takes {n_params} parameters, got {len(ctx)}."
+            )
+        func = funcs[self._path(sig, funcs, paths, ctx)]
+        return float(func(*ctx))
+
+    def predict_batch(self, sig, X):
+        """Return the predicted costs of calling sig with every context of X.
+
+        X is a vector of contexts for single parameter signatures, or a matrix
+        with one row per context and one column per parameter. Each distinct
+        context is mapped to its path once, and the contexts of a path are
+        evaluated together.
+        """
+        n_params, funcs, paths = self._sig(sig)
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 1:
+            X = X.reshape(-1, 1)
+        if X.ndim != 2 or X.shape[1] != n_params:
+            raise ValueError(
+                f"{sig} takes {n_params} parameters, got contexts of shape"
+                f" {X.shape}."
+            )
+        result = np.empty(len(X))
+        if len(funcs) == 1:
+            groups = [(0, slice(None))]
+        else:
+            unique, inverse = _unique_rows(X)
+            path_of = np.array(
+                [
+                    self._path(sig, funcs, paths, tuple(ctx))
+                    for ctx in unique.tolist()
+                ]
+            )[inverse]
+            groups = [(path, path_of == path) for path in np.unique(path_of)]
+        for path, rows in groups:
+            with np.errstate(all="ignore"):
+                costs = funcs[path](*X[rows].T)
+            # Constant expressions evaluate to a single value.
+            result[rows] = np.broadcast_to(costs, result[rows].shape)
+        return result
+
+
+def _parse_ctx(key):
+    """Return the context of a ctxs key of the results, e.g. "3, 4"."""
+    return tuple(int(value) for value in key.split(", ")) if key else ()
+
+
+def _unique_rows(X):
+    """Return the distinct rows of X and the index of each row in them."""
+    if X.shape[1] == 1:
+        unique, inverse = np.unique(X[:, 0], return_inverse=True)
+        return unique.reshape(-1, 1), inverse.reshape(-1)
+    # Sorting whole rows as opaque byte strings is much faster than
+    # np.unique(X, axis=0).
+    X = np.ascontiguousarray(X)
+    rows = X.view(np.dtype((np.void, X.itemsize * X.shape[1]))).reshape(-1)
+    unique, inverse = np.unique(rows, return_inverse=True)
+    return unique.view(X.dtype).reshape(-1, X.shape[1]), inverse.reshape(-1)
+
+
+def _compile(expr, params, costs, default_cost):
+    """Return a NumPy function of params evaluating expr with the costs."""
+    expr = sympy.sympify(expr)
+    symbols = expr.free_symbols - set(params)
+    values = {}
+    for symbol in symbols:
+        if symbol.name in costs:
+            values[symbol] = costs[symbol.name]
+        elif default_cost is not None:
+            values[symbol] = default_cost
+        else:
+            raise ValueError(f"No cost given for {symbol.name} in {expr}.")
+    return sympy.lambdify(params, expr.subs(values), "numpy")
@@ -2,8 +2,34 @@ import anytree
 import sympy
 
 
+def _resolve(node):
+    """Return the node a symlink points to, or the node itself."""
+    while isinstance(node, anytree.SymlinkNode):
+        node = node.target
+    return node
+
+
+def cost_symbol(prefix, name):
+    """Return the symbol of the cost of node name, e.g. T_12 or C_3."""
+    return sympy.Symbol(f"{prefix}_{name}")
+
+
+def parse_known_exprs(known_exprs):
+    """Return known_exprs with every expression parsed by sympy.
+
+    to_expr accepts known expressions as strings, but parses them at every
+    use. Parsing them once with this function is much faster when many
+    traces are turned into expressions with the same known expressions.
+    """
+    return {key: sympy.sympify(expr) for key, expr in known_exprs.items()}
+
+
 class Node(anytree.AnyNode):
     def __init__(self, name, type_, parent=None, children=None, **kwargs):
+        # Structural hash and control flow sequence of the subtree, computed on
+        # demand and cleared whenever the subtree changes.
+        self._hash = None
+        self._cf_nodes = None
         super(Node, self).__init__(
             name=name, type=type_, parent=parent, children=children, **kwargs
         )
@@ -12,7 +38,87 @@ class Node(anytree.AnyNode):
         if not isinstance(other, Node):
             # don't attempt to compare against unrelated types
             return NotImplemented
-        return repr(self) == repr(other)
+        # Subtrees with different hashes always differ, so the deep comparison
+        # only runs for equal subtrees and hash collisions.
+        stack = [(self, other)]
+        while stack:
+            a, b = stack.pop()
+            if a is b:
+                continue
+            if hash(a) != hash(b) or a._structural_key() != b._structural_key():
+                return False
+            a_children = a.children
+            b_children = b.children
+            if len(a_children) != len(b_children):
+                return False
+            stack.extend(
+                zip(map(_resolve, a_children), map(_resolve, b_children))
+            )
+        return True
+
+    def __hash__(self):
+        """Return a structural hash of the subtree rooted at this node."""
+        if self._hash is None:
+            # Post-order walk over the nodes whose hash is not cached yet.
+            stack = [self]
+            while stack:
+                node = stack[-1]
+                if node._hash is not None:
+                    stack.pop()
+                    continue
+                children = [_resolve(child) for child in node.children]
+                pending = [child for child in children if child._hash is None]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                stack.pop()
+                node._hash = hash(
+                    (
+                        node._structural_key(),
+                        tuple(child._hash for child in children),
+                    )
+                )
+        return self._hash
+
+    def __getstate__(self):
+        # Hashes of strings are salted per process, so never carry them over.
+        state = self.__dict__.copy()
+        state["_hash"] = None
+        return state
+
+    def _local_key(self):
+        """Return a hashable key of this node's own attributes."""
+        return (type(self).__name__,) + tuple(
+            (key, repr(value))
+            for key, value in sorted(self.__dict__.items())
+            if not key.startswith("_")
+        )
+
+    def _structural_key(self):
+        """Return the key this node contributes to its subtree's hash."""
+        return self._local_key()
+
+    def _invalidate_caches(self):
+        """Drop cached subtree data of this node and its ancestors."""
+        node = self
+        while isinstance(node, Node):
+            node._hash = None
+            node._cf_nodes = None
+            node = node.parent
+
+    def _post_attach(self, parent):
+        if isinstance(parent, Node):
+            parent._invalidate_caches()
+
+    def _post_detach(self, parent):
+        if isinstance(parent, Node):
+            parent._invalidate_caches()
+
+    def _post_attach_children(self, children):
+        self._invalidate_caches()
+
+    def _post_detach_children(self, children):
+        self._invalidate_caches()
 
     # @property
     # def type(self):
@@ -54,29 +160,210 @@ class Node(anytree.AnyNode):
         return Node.is_iter_type(self.type)
 
     @staticmethod
-    def from_trace(trace):
-        if Node.is_call_type(trace["type"]):
-            return CallNode.from_trace(trace)
-        elif Node.is_loop_type(trace["type"]):
-            return LoopNode.from_trace(trace)
+    def node_class(type_):
+        """Return the Node subclass used for trace entries of the given type."""
+        if Node.is_call_type(type_):
+            return CallNode
+        elif Node.is_loop_type(type_):
+            return LoopNode
         else:
-            return StmtNode.from_trace(trace)
+            return StmtNode
+
+    @staticmethod
+    def from_trace(trace, fold_iterations=False, interner=None):
+        return Node.node_class(trace["type"]).from_trace(
+            trace, fold_iterations=fold_iterations, interner=interner
+        )
+
+    @staticmethod
+    def _build(trace, root_cls, fold_iterations=False, interner=None):
+        """Build the tree for a trace entry without recursing.
+
+        Entries are expanded in post-order so every node is created after its
+        children, with root_cls used for the top-level entry. With
+        fold_iterations, loop children are built one at a time and runs of
+        iterations with the same control flow are kept only once. Every node
+        but the top-level one is passed through interner, if given, to share
+        subtrees with previously built trees.
+        """
+        built = []
+        stack = [(trace, None)]
+        while stack:
+            entry, state = stack.pop()
+            cls = root_cls if entry is trace else Node.node_class(entry["type"])
+            if state is None:
+                if fold_iterations and issubclass(cls, LoopNode):
+                    state = _IterationFolder(entry["children"])
+                else:
+                    stack.append((entry, True))
+                    for child in reversed(entry["children"]):
+                        stack.append((child, None))
+                    continue
+            if state is True:
+                start = len(built) - len(entry["children"])
+                children = built[start:]
+                del built[start:]
+                node = cls._from_entry(entry, children)
+            else:
+                # Fold the loop's children as each one is built, so a repeated
+                # iteration is dropped before the next one is created.
+                folder = state
+                if folder.pending:
+                    folder.add(built.pop())
+                child = folder.next_entry()
+                if child is not None:
+                    stack.append((entry, folder))
+                    stack.append((child, None))
+                    continue
+                children, partition = folder.finish()
+                node = cls._from_entry(entry, children, partition=partition)
+            if interner is not None and entry is not trace:
+                node = interner.intern(node)
+            built.append(node)
+        return built[0]
 
     def get_cf_nodes(self):
-        raise NotImplementedError
+        """Return a tuple of control flow nodes."""
+        if self._cf_nodes is None:
+            cf_nodes = []
+            stack = [self]
+            while stack:
+                node = _resolve(stack.pop())
+                if node is not self and node._cf_nodes is not None:
+                    # Splice in subtrees whose sequence is already known.
+                    cf_nodes.extend(node._cf_nodes)
+                    continue
+                if node._is_cf_point():
+                    cf_nodes.append(node.name)
+                stack.extend(reversed(node._cf_children()))
+            self._cf_nodes = tuple(cf_nodes)
+        return self._cf_nodes
+
+    def _is_cf_point(self):
+        """Returns True if this node appears in control flow sequences."""
+        return self.is_cf_node()
+
+    def _cf_children(self):
+        """Returns the children that contribute to control flow."""
+        return self.children
 
     def to_expr(self, known_exprs):
+        """Returns a symbolic expression of the tree."""
+        # Each pending entry carries the list of terms it adds to, so sums are
+        # built once per list rather than one "+" at a time. A loop node
+        # gathers its iteration block in a list of its own, which a second
+        # entry for the loop folds into the enclosing terms.
+        result = []
+        stack = [(self, result, None)]
+        while stack:
+            node, terms, loop_terms = stack.pop()
+            if loop_terms is not None:
+                expr = _sum(loop_terms)
+                if expr is not None and node._loop_expr is not None:
+                    expr = sympy.Mul(node._loop_expr, expr)
+                if expr is not None:
+                    terms.append(expr)
+                continue
+            node = _resolve(node)
+            if isinstance(node, LoopNode):
+                if node.trailing_iter_block is not None:
+                    for child in reversed(node.trailing_iter_block):
+                        stack.append((child, terms, None))
+                block_terms = []
+                stack.append((node, terms, block_terms))
+                for child in reversed(node.iter_block):
+                    stack.append((child, block_terms, None))
+                continue
+            expr, children = node._expr_parts(known_exprs)
+            if expr is not None:
+                terms.append(expr)
+            for child in reversed(children):
+                stack.append((child, terms, None))
+        return _sum(result)
+
+    def _expr_parts(self, known_exprs):
+        """Return this node's own term and the children to add to it."""
         raise NotImplementedError
 
     def get_loop_nodes(self):
         """Returns a list of loop nodes."""
+        # Loop nodes are listed after all loop nodes below them.
         loop_nodes = []
-        for child in self.children:
-            loop_nodes.extend(child.get_loop_nodes())
-        if self.is_loop_node():
-            loop_nodes.append(self)
+        stack = [(self, False)]
+        while stack:
+            node, visited = stack.pop()
+            if visited:
+                loop_nodes.append(node)
+                continue
+            node = _resolve(node)
+            if node.is_loop_node():
+                stack.append((node, True))
+            for child in reversed(node.children):
+                stack.append((child, False))
         return loop_nodes
 
+    def _to_records(self):
+        """Return a compact, picklable encoding of the subtree.
+
+        Nodes are listed in pre-order as (cls, parent, record) tuples, where
+        parent is the distance back to the node's parent (0 for the top node)
+        and record holds the node's own data. Node._from_records rebuilds the
+        subtree from them.
+        """
+        records = []
+        stack = [(self, None)]
+        while stack:
+            node, parent = stack.pop()
+            if isinstance(node, anytree.SymlinkNode):
+                raise ValueError("Subtrees with links cannot be encoded.")
+            i = len(records)
+            distance = 0 if parent is None else i - parent
+            records.append((type(node), distance, node._record()))
+            for child in reversed(node.children):
+                stack.append((child, i))
+        return records
+
+    @staticmethod
+    def _from_records(records, interner=None):
+        """Rebuild a subtree encoded by Node._to_records.
+
+        Nodes below the top one are passed through interner, if given.
+        """
+        # Children come after their parent in pre-order, so building in
+        # reverse order creates every node after its children.
+        children = [[] for _ in range(len(records))]
+        for i in range(len(records) - 1, -1, -1):
+            cls, parent, record = records[i]
+            kids = children[i]
+            kids.reverse()
+            node = cls._restore(record, kids)
+            children[i] = None
+            if parent > 0:
+                if interner is not None:
+                    node = interner.intern(node)
+                children[i - parent].append(node)
+        return node
+
+    def _record(self):
+        """Return the data _restore needs to recreate this node."""
+        raise NotImplementedError
+
+    @classmethod
+    def _new(cls, children, **attrs):
+        """Create a node with the given attributes and children.
+
+        Unlike the constructor, this does not go through anytree's children
+        setter, whose checks and hooks are not needed for new, consistent
+        subtrees. attrs must match what the constructor sets.
+        """
+        node = cls.__new__(cls)
+        node.__dict__.update(_hash=None, _cf_nodes=None, **attrs)
+        if len(children) > 0:
+            node._NodeMixin__children = children
+            for child in children:
+                child._NodeMixin__parent = node
+        return node
+
 
 class StmtNode(Node):
     def __init__(self, name, type_, desc, parent=None, children=None):
@@ -87,54 +374,64 @@ class StmtNode(Node):
     def desc(self):
         return self._desc
 
+    def _local_key(self):
+        return (type(self).__name__, self.name, self.type, self._desc)
+
     @staticmethod
-    def from_trace(trace):
+    def from_trace(trace, fold_iterations=False, interner=None):
         if Node.is_call_type(type_ := trace["type"]):
             raise ValueError(f"Type '{type_}' is not a StmtNode type.")
-        children = [Node.from_trace(child) for child in trace["children"]]
+        return Node._build(trace, StmtNode, fold_iterations, interner)
+
+    @classmethod
+    def _from_entry(cls, trace, children, **kwargs):
         desc = (
             trace["sig"] if "sig" in trace else trace["desc"]
         )  # For op nodes.
-        return StmtNode(
+        return cls(
             name=trace["id"],
-            type_=type_,
+            type_=trace["type"],
             desc=desc,
             children=children,
+            **kwargs,
         )
 
-    def get_cf_nodes(self):
-        """Return a list of control flow nodes."""
-        cf_nodes = [self.name] if self.is_cf_node() else []
-        for child in self.children:
-            cf_nodes.extend(child.get_cf_nodes())
-        return cf_nodes
-
-    def to_expr(self, known_exprs):
-        """Returns a symbolic expression of the tree."""
+    def _expr_parts(self, known_exprs):
         if self.desc in known_exprs:
             expr = sympy.sympify(known_exprs[self.desc])
         else:
             expr = (
-                sympy.sympify(f"T_{self.name}")
-                if not self.is_cf_node()
-                else None
+                cost_symbol("T", self.name) if not self.is_cf_node() else None
             )
-        for child in self.children:
-            child_expr = child.to_expr(known_exprs)
-            if child_expr is None:
-                continue
-            expr = child_expr if expr is None else expr + child_expr
-        return expr
+        return expr, self.children
+
+    def _record(self):
+        return (self.name, self.type, self._desc)
+
+    @classmethod
+    def _restore(cls, record, children):
+        name, type_, desc = record
+        return cls._new(children, name=name, type=type_, desc=desc, _desc=desc)
 
 
 class LoopNode(StmtNode):
-    def __init__(self, name, type_, desc, parent=None, children=None):
+    def __init__(
+        self, name, type_, desc, parent=None, children=None, partition=None
+    ):
         super(LoopNode, self).__init__(name, type_, desc, parent, children)
         self._loop_expr = None
         self.iter_block = []
         self.iter_count = 0
         self.trailing_iter_block = None
-        self._partition_children()
+        if partition is None:
+            self._partition_children()
+        else:
+            # The children were already folded into distinct iterations.
+            (
+                self.iter_block,
+                self.iter_count,
+                self.trailing_iter_block,
+            ) = partition
 
     def set_loop_expr(self, loop_expr):
         """Set the loop expression."""
@@ -147,159 +444,71 @@ class LoopNode(StmtNode):
     #    return self._loop_expr
 
     @staticmethod
-    def from_trace(trace):
+    def from_trace(trace, fold_iterations=False, interner=None):
         if not Node.is_loop_type(type_ := trace["type"]):
             raise ValueError(f"Type '{type_}' is not a LoopNode type.")
-        children = [Node.from_trace(child) for child in trace["children"]]
-        desc = (
-            trace["sig"] if "sig" in trace else trace["desc"]
-        )  # For op nodes.
-        return LoopNode(
-            name=trace["id"],
-            type_=type_,
-            desc=desc,
-            children=children,
-        )
+        return Node._build(trace, LoopNode, fold_iterations, interner)
+
+    def _structural_key(self):
+        # Folded loops keep one copy of repeated iterations, so the count is
+        # needed to tell them apart.
+        return self._local_key() + (self.iter_count,)
 
     def _partition_children(self):
-        """Partition children into pre-body, body, and post-body nodes."""
-        if len(self.children) == 0:
-            return
-
-        # We need to walk through an entire iteration to determine the pre-body and
-        # post-body nodes if there are any.
-        # Note that pre-body nodes will be execcuted for each iteration, while post-body
-        # nodes will be executed if the loop does not exit early.
-        pre_body_nodes = []
-        post_body_nodes = []
-        in_pre_body = True
-        for child in self.children:
-            if child.is_iter_node():
-                if not in_pre_body:
-                    # We have walked an entire iteration.
-                    break
-                in_pre_body = False
-                continue
-            if in_pre_body:
-                pre_body_nodes.append(child)
-            else:
-                post_body_nodes.append(child)
-
-        # If we never left the pre-body, then all children are pre-body nodes and we
-        # can treat the loop as having no iterations.
-        if in_pre_body:
-            return
-
-        if len(pre_body_nodes) > 0 and len(post_body_nodes) > 0:
-            # When both pre-body and post-body nodes are present, the logic above will
-            # incorrectly assign pre-body nodes to post-body nodes.
-            post_body_nodes = [
-                x for x in post_body_nodes if x not in pre_body_nodes
-            ]
+        """Partition children into the iteration block and trailing block."""
+        (
+            self.iter_block,
+            self.iter_count,
+            self.trailing_iter_block,
+        ) = partition_iterations(
+            self.children,
+            is_iter=lambda child: child.is_iter_node(),
+            get_cf_nodes=lambda child: child.get_cf_nodes(),
+            key=lambda child: _resolve(child)._local_key(),
+        )
 
-        # For now we are only supporting no iterations, consistent iterations, and
-        # and an inconsistent trailing iteration.
-        # We want to assembly a list where each element is the list of nodes that
-        # constitute an iteration.
-        # If there are children, but no iterations, then we will just mark it as a
-        # single iteration.
-        # Once we have the list of iterations, we can determine the number of iterations
-        # for the main iter block and record a trailing iter block if there is one.
-        iter_blocks = []
-        curr_iter_block = []
-        in_pre_body = True
-        for child in self.children:
-            if not in_pre_body:
-                if child.is_iter_node() or child in pre_body_nodes:
-                    # An iteration has ended.
-                    iter_blocks.append(curr_iter_block)
-                    curr_iter_block = []
-                    in_pre_body = True
-            if child.is_iter_node():
-                in_pre_body = False
-            curr_iter_block.append(child)
-        if len(curr_iter_block) > 0:
-            iter_blocks.append(curr_iter_block)
-        self.iter_block = iter_blocks[0]
-
-        # if self.name == 264379:
-        #    print()
-        #    print()
-        #    for i, iter_block in enumerate(iter_blocks):
-        #        print(f"Iter block {i}")
-        #        for node in iter_block:
-        #            print(anytree.RenderTree(node))
-        #            print(f"CF points: {node.get_cf_nodes()}")
-
-        # Now we can determine the number of iterations. We need to compare iter blocks
-        # by cf nodes.
-        unique_iter_blocks = []
-        for iter_block in iter_blocks:
-            cf_nodes = []
-            for node in iter_block:
-                cf_nodes.extend(node.get_cf_nodes())
-            # Deduplicate adjacent control flow nodes.
-            cf_nodes = [
-                x
-                for i, x in enumerate(cf_nodes)
-                if i == 0 or x != cf_nodes[i - 1]
+    def _record(self):
+        positions = {id(child): i for i, child in enumerate(self.children)}
+        iter_block = [positions[id(child)] for child in self.iter_block]
+        trailing_iter_block = None
+        if self.trailing_iter_block is not None:
+            trailing_iter_block = [
+                positions[id(child)] for child in self.trailing_iter_block
             ]
-            if cf_nodes not in unique_iter_blocks:
-                unique_iter_blocks.append(cf_nodes)
-        if self.name == 264379:
-            print(f"Unique iter blocks: {unique_iter_blocks}")
-        if len(unique_iter_blocks) == 1:
-            # All iterations are consistent.
-            self.iter_count = len(iter_blocks)
-        else:
-            # We have an inconsistent trailing iteration.
-            self.iter_count = len(iter_blocks) - 1
-            self.trailing_iter_block = iter_blocks[-1]
-        if self.name == 264379:
-            print()
-            print(anytree.RenderTree(self.root))
-            print()
+        return (
+            self.name,
+            self.type,
+            self._desc,
+            self._loop_expr,
+            iter_block,
+            self.iter_count,
+            trailing_iter_block,
+        )
 
-    def get_cf_nodes(self):
-        """Return a list of control flow nodes."""
-        cf_nodes = [self.name]
-        if len(self.children) == 0:
-            return cf_nodes
-
-        for child in self.iter_block:
-            if self.name == 264379:
-                print(f"Getting cf nodes for {child}")
-            cf_nodes.extend(child.get_cf_nodes())
-        if self.name == 264379:
-            print()
-        if self.trailing_iter_block is not None:
-            for child in self.trailing_iter_block:
-                cf_nodes.extend(child.get_cf_nodes())
-        return cf_nodes
+    @classmethod
+    def _restore(cls, record, children):
+        name, type_, desc, loop_expr, iter_block, iter_count, trailing = record
+        return cls._new(
+            children,
+            name=name,
+            type=type_,
+            desc=desc,
+            _desc=desc,
+            _loop_expr=loop_expr,
+            iter_block=[children[i] for i in iter_block],
+            iter_count=iter_count,
+            trailing_iter_block=(
+                None if trailing is None else [children[i] for i in trailing]
+            ),
+        )
 
-    def to_expr(self, known_exprs):
-        """Returns a symbolic expression of the tree."""
-        expr = None
-        for child in self.iter_block:
-            child_expr = child.to_expr(known_exprs)
-            if child_expr is None:
-                continue
-            if expr is None:
-                expr = child_expr
-            else:
-                expr += child_expr
-        if self._loop_expr is not None:
-            expr = sympy.Mul(self._loop_expr, expr)
-        if self.trailing_iter_block is not None:
-            for child in self.trailing_iter_block:
-                child_expr = child.to_expr(known_exprs)
-                if child_expr is None:
-                    continue
-                if expr is None:
-                    expr = child_expr
-                else:
-                    expr += child_expr
-        return expr
+    def _is_cf_point(self):
+        return True
+
+    def _cf_children(self):
+        if self.trailing_iter_block is None:
+            return self.iter_block
+        return self.iter_block + self.trailing_iter_block
 
 
 class CallNode(Node):
@@ -318,38 +527,229 @@ class CallNode(Node):
     def params(self):
         return self._params
 
+    def _local_key(self):
+        params = tuple(tuple(sorted(param.items())) for param in self._params)
+        return (type(self).__name__, self.name, self.type, self._sig, params)
+
     @staticmethod
-    def from_trace(trace):
+    def from_trace(trace, fold_iterations=False, interner=None):
         if not Node.is_call_type(type_ := trace["type"]):
             raise ValueError(f"Type '{type_}' is not a CallNode type.")
-        children = [Node.from_trace(child) for child in trace["children"]]
-        return CallNode(
+        return Node._build(trace, CallNode, fold_iterations, interner)
+
+    @classmethod
+    def _from_entry(cls, trace, children):
+        return cls(
             name=trace["id"],
-            type_=type_,
+            type_=trace["type"],
             sig=trace["sig"],
             params=trace["params"],
             children=children,
         )
 
-    def get_cf_nodes(self):
-        """Return a list of control flow nodes."""
-        cf_nodes = [self.name] if self.is_cf_node() else []
-        for child in self.children:
-            cf_nodes.extend(child.get_cf_nodes())
-        return cf_nodes
+    def _record(self):
+        return (self.name, self.type, self._sig, self._params)
+
+    @classmethod
+    def _restore(cls, record, children):
+        name, type_, sig, params = record
+        return cls._new(
+            children,
+            name=name,
+            type=type_,
+            sig=sig,
+            params=params,
+            _sig=sig,
+            _params=params,
+        )
 
-    def to_expr(self, known_exprs):
-        """Returns a symbolic expression of the tree."""
+    def _expr_parts(self, known_exprs):
         if self.type == "CallerExpr":
             if self.sig in known_exprs:
-                expr = sympy.sympify(known_exprs[self.sig])
+                return sympy.sympify(known_exprs[self.sig]), ()
+            return cost_symbol("T", self.name), ()
+        return cost_symbol("C", self.name), self.children
+
+
+def _sum(terms):
+    if len(terms) == 0:
+        return None
+    return sympy.Add(*terms)
+
+
+def partition_iterations(children, is_iter, get_cf_nodes, key):
+    """Split the children of a loop into iterations.
+
+    Returns a tuple of (iter_block, iter_count, trailing_iter_block), where
+    iter_block is the list of children of the first iteration and
+    trailing_iter_block is the list of children of an inconsistent final
+    iteration (or None). Children are accessed only through the given
+    callbacks so that any tree representation can share this logic; key must
+    map two children to equal hashable values when they are the same
+    statement, regardless of what ran below them.
+    """
+    # For now we are only supporting no iterations, consistent iterations, and
+    # and an inconsistent trailing iteration. Iterations are compared by their
+    # control flow fingerprint, so a single pass with a set of fingerprints is
+    # enough to tell them apart; only the first and last blocks are kept.
+    first_block = None
+    last_block = None
+    iter_count = 0
+    fingerprints = set()
+    for iter_block in iter_blocks(children, is_iter, key):
+        if first_block is None:
+            first_block = iter_block
+        last_block = iter_block
+        iter_count += 1
+        fingerprints.add(iter_fingerprint(iter_block, get_cf_nodes))
+
+    # If there were no iterations, then all children are pre-body nodes and we
+    # can treat the loop as having no iterations.
+    if iter_count == 0:
+        return [], 0, None
+    if len(fingerprints) == 1:
+        # All iterations are consistent.
+        return first_block, iter_count, None
+    # We have an inconsistent trailing iteration.
+    return first_block, iter_count - 1, last_block
+
+
+def iter_blocks(children, is_iter, key):
+    """Yield the children of a loop grouped into one list per iteration.
+
+    Nothing is yielded if there is no iteration marker. children may be any
+    iterable and is consumed lazily.
+    """
+    splitter = _IterationSplitter(is_iter, key)
+    for child in children:
+        iter_block = splitter.add(child)
+        if iter_block is not None:
+            yield iter_block
+    iter_block = splitter.finish()
+    if iter_block is not None:
+        yield iter_block
+
+
+class _IterationSplitter:
+    """Groups the children of a loop into iterations as they are added.
+
+    Children before the first iteration marker are pre-body nodes, which are
+    executed at the start of every iteration, so each later occurrence of one
+    of them (or of an iteration marker) after an iteration body ends the
+    current iteration. Occurrences are matched by the key of the statement
+    alone, not by its subtree, as the anytree reprs compared by the original
+    partitioning were: a loop condition that calls a function runs a
+    different subtree in every iteration.
+    """
+
+    def __init__(self, is_iter, key):
+        self._is_iter = is_iter
+        self._key = key
+        self._pre_body_keys = set()
+        self._in_pre_body = True
+        self.started = False
+        self.curr_iter_block = []
+
+    def add(self, child):
+        """Add the next child. Returns the iteration it completed, if any."""
+        done = None
+        child_is_iter = self._is_iter(child)
+        if not self.started:
+            if child_is_iter:
+                self.started = True
             else:
-                expr = sympy.sympify(f"T_{self.name}")
+                self._pre_body_keys.add(self._key(child))
+        elif not self._in_pre_body and (
+            child_is_iter or self._key(child) in self._pre_body_keys
+        ):
+            # An iteration has ended.
+            done = self.curr_iter_block
+            self.curr_iter_block = []
+            self._in_pre_body = True
+        if child_is_iter:
+            self._in_pre_body = False
+        self.curr_iter_block.append(child)
+        return done
+
+    def finish(self):
+        """Return the final iteration, or None if there were no iterations."""
+        if self.started and len(self.curr_iter_block) > 0:
+            return self.curr_iter_block
+        return None
+
+
+class _IterationFolder:
+    """Run-length folds the iterations of a loop while it is being built.
+
+    Consecutive iterations with the same control flow fingerprint are kept
+    once, so memory grows with the number of distinct runs of iterations
+    rather than with the iteration count. The most recent iteration is always
+    kept as well, since it may become the loop's trailing iteration.
+    """
+
+    def __init__(self, entries):
+        self._entries = iter(entries)
+        self._splitter = _IterationSplitter(
+            is_iter=lambda child: child.is_iter_node(),
+            key=lambda child: child._local_key(),
+        )
+        self._runs = []
+        self._last_run_fingerprint = None
+        self._last_block = None
+        self._fingerprints = set()
+        self._iter_count = 0
+        self.pending = False
+
+    def next_entry(self):
+        """Return the next child trace entry to build, or None when done."""
+        self.pending = False
+        entry = next(self._entries, None)
+        if entry is not None:
+            self.pending = True
+        return entry
+
+    def add(self, child):
+        """Add the node built from the last entry returned by next_entry."""
+        iter_block = self._splitter.add(child)
+        if iter_block is not None:
+            self._add_block(iter_block)
+
+    def _add_block(self, iter_block):
+        fingerprint = iter_fingerprint(
+            iter_block, lambda child: child.get_cf_nodes()
+        )
+        self._iter_count += 1
+        self._fingerprints.add(fingerprint)
+        if fingerprint != self._last_run_fingerprint:
+            self._runs.append(iter_block)
+            self._last_run_fingerprint = fingerprint
+        self._last_block = iter_block
+
+    def finish(self):
+        """Return the children to keep and the loop's partition."""
+        iter_block = self._splitter.finish()
+        if iter_block is not None:
+            self._add_block(iter_block)
+        if self._iter_count == 0:
+            # Without iterations there is nothing to fold.
+            return self._splitter.curr_iter_block, ([], 0, None)
+        children = [child for run in self._runs for child in run]
+        if self._last_block is not self._runs[-1]:
+            children.extend(self._last_block)
+        first_block = self._runs[0]
+        if len(self._fingerprints) == 1:
+            partition = (first_block, self._iter_count, None)
         else:
-            expr = sympy.sympify(f"C_{self.name}")
-            for child in self.children:
-                child_expr = child.to_expr(known_exprs)
-                if child_expr is None:
-                    continue
-                expr += child_expr
-        return expr
+            partition = (first_block, self._iter_count - 1, self._last_block)
+        return children, partition
+
+
+def iter_fingerprint(iter_block, get_cf_nodes):
+    """Return the control flow nodes of an iteration as a hashable tuple."""
+    cf_nodes = []
+    for child in iter_block:
+        for x in get_cf_nodes(child):
+            # Deduplicate adjacent control flow nodes.
+            if len(cf_nodes) == 0 or x != cf_nodes[-1]:
+                cf_nodes.append(x)
+    return tuple(cf_nodes)
@@ -0,0 +1,135 @@
+"""Streaming analysis of trace sets too large to hold in memory.
+
+analyze() needs every tree of a trace set at once. A StreamingAnalysis
+instead consumes trees one at a time, e.g. from utils.iter_trees, and puts
+each into the bucket of its (signature, control flow path) right away. A
+bucket keeps only what solving the path needs: the first tree of the path,
+whose loop nodes receive the loop expressions, the contexts of the traces,
+the iteration count of every loop of every trace and, for paths without
+variable loops, the distinct trace expressions. All other trees are dropped
+once consumed, so each trace only leaves a few numbers behind, and memory
+is dominated by one tree per distinct path instead of by the whole trace
+set.
+
+Recursive calls are not linked, since links leave the expressions of the
+paths unchanged. Traces of the same context with differing trees are still
+reported, by comparing the structural hashes of their roots.
+"""
+
+from .analyze import (
+    add_result,
+    add_to_partitions,
+    path_contexts,
+    solve_paths,
+    to_ctx,
+    to_params_str,
+)
+from .node import Node, parse_known_exprs
+from .utils import iter_trees
+
+
+class StreamingAnalysis:
+    """Analysis of a stream of trees with per path buckets.
+
+    The buckets have the schema of the path entries of get_path_partitions,
+    except that "traces" only holds the first tree of the path, and they
+    hold the "contexts", "ctx_rows" and "loop_counts" of all traces of the
+    path, and the distinct "exprs" of paths without variable loops.
+    symreg_options is passed on to run_regressions().
+    """
+
+    def __init__(self, known, workers=None, cache=None, symreg_options=None):
+        self.known = parse_known_exprs(known)
+        self.workers = workers
+        self.cache = cache
+        self.symreg_options = symreg_options
+        self.path_dict = {}
+        self.n_trees = 0
+        # (sig, params) -> structural hash of the first root with them.
+        self._roots = {}
+
+    def add(self, tree):
+        """Put tree into the bucket of its path and drop the rest of it."""
+        root = tree.root
+        if isinstance(root, Node):
+            key = (root.sig, to_params_str(root.params))
+            if self._roots.setdefault(key, hash(root)) != hash(root):
+                raise RuntimeError(
+                    "Unhandled scenario: 2 traces with the same context have"
+                    " differing trees."
+                )
+        sig_paths = self.path_dict.setdefault(root.sig, {})
+        cf_tuple = tree.get_cf_nodes()
+        bucket = sig_paths.get(cf_tuple)
+        if bucket is None:
+            bucket = add_to_partitions(self.path_dict, tree)
+            bucket["contexts"] = {}
+            bucket["ctx_rows"] = []
+            loop_nodes = tree.get_loop_nodes()
+            bucket["loop_counts"] = [[] for _ in loop_nodes]
+            if all(node.iter_count == 0 for node in loop_nodes):
+                # Only paths without variable loops are solved from the
+                # expressions of their traces.
+                bucket["exprs"] = []
+        self.n_trees += 1
+        bucket["contexts"].setdefault(to_params_str(root.params))
+        bucket["ctx_rows"].append(to_ctx(root.params))
+        for counts, node in zip(bucket["loop_counts"], tree.get_loop_nodes()):
+            counts.append(node.iter_count)
+        if "exprs" in bucket:
+            expr = tree.to_expr(self.known)
+            if expr not in bucket["exprs"]:
+                bucket["exprs"].append(expr)
+
+    def consume(self, trees):
+        """Add every tree of an iterable of trees."""
+        for tree in trees:
+            self.add(tree)
+        return self
+
+    def stats(self):
+        """Return the number of trees consumed and of paths (buckets)."""
+        return {
+            "trees": self.n_trees,
+            "paths": sum(len(paths) for paths in self.path_dict.values()),
+        }
+
+    def results(self):
+        """Solve the paths and return the results of all consumed trees."""
+        paths = [
+            (sig, bucket)
+            for sig, sig_paths in self.path_dict.items()
+            for bucket in sig_paths.values()
+        ]
+        results = {"sigs": {}, "ctxs": {}, "exprs": {}}
+        for sig, bucket, expr in solve_paths(
+            paths,
+            self.known,
+            self.workers,
+            self.cache,
+            symreg_options=self.symreg_options,
+        ):
+            add_result(
+                results, sig, bucket["path_id"], expr, path_contexts(bucket)
+            )
+        return results
+
+
+def analyze_file(
+    path,
+    known,
+    workers=None,
+    cache=None,
+    fold_iterations=False,
+    symreg_options=None,
+):
+    """Analyze a paptrace output file one trace at a time.
+
+    Returns the same results as analyze(known, utils.from_file(path))
+    without holding more than one tree per distinct path in memory.
+    """
+    analysis = StreamingAnalysis(known, workers, cache, symreg_options)
+    analysis.consume(iter_trees(path, fold_iterations))
+    stats = analysis.stats()
+    print(f"Streamed {stats['trees']} trees into {stats['paths']} paths.")
+    return analysis.results()
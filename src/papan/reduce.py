@@ -0,0 +1,120 @@
+"""Reduction of the traces of a path before solving it.
+
+Trace sets often hold many traces of the same context, or far more distinct
+contexts than are needed to fit a loop expression. A ContextReducer picks the
+traces a path is solved with: one trace per distinct context and, with
+max_contexts, a subsample of the contexts spread over their range. The
+reduced traces are stored as the "sample" of the path entry, which
+solve_paths uses instead of all of the path's traces, while the results still
+list every context of the path.
+"""
+
+import numpy as np
+
+from .analyze import to_ctx, to_params_str
+
+SAMPLINGS = ("log", "stratified")
+
+
+class ContextReducer:
+    """Deduplicates and subsamples the contexts of paths.
+
+    dedup keeps only the first trace of each context. With max_contexts, at
+    most that many contexts are kept, chosen by sampling among the contexts
+    sorted by value: "log" picks log-spaced positions, which keeps most small
+    contexts and fewer large ones, and "stratified" picks evenly spaced
+    positions. The smallest and largest contexts are always kept. per_sig
+    maps signatures to dicts overriding any of these options.
+    """
+
+    def __init__(
+        self, dedup=True, max_contexts=None, sampling="log", per_sig=None
+    ):
+        self.options = {
+            "dedup": dedup,
+            "max_contexts": max_contexts,
+            "sampling": sampling,
+        }
+        self.per_sig = {} if per_sig is None else per_sig
+        for options in [self.options] + list(self.per_sig.values()):
+            _check_options(options)
+        # (sig, path_id) -> (traces, duplicates, sampled_out) counts.
+        self._counts = {}
+
+    def reduce(self, path_dict):
+        """Set the sample of every path of path_dict."""
+        for sig, sig_entry in path_dict.items():
+            for path_entry in sig_entry.values():
+                self.reduce_path(sig, path_entry)
+        return path_dict
+
+    def reduce_path(self, sig, path_entry):
+        """Set the sample of a path entry of sig and return it."""
+        options = dict(self.options, **self.per_sig.get(sig, {}))
+        traces = path_entry["traces"]
+        sample = traces
+        if options["dedup"]:
+            distinct = {}
+            for tree in traces:
+                distinct.setdefault(to_params_str(tree.root.params), tree)
+            sample = list(distinct.values())
+        duplicates = len(traces) - len(sample)
+        max_contexts = options["max_contexts"]
+        if max_contexts is not None and len(sample) > max_contexts:
+            sample = _subsample(sample, max_contexts, options["sampling"])
+        path_entry["sample"] = sample
+        self._counts[(sig, path_entry["path_id"])] = (
+            len(traces),
+            duplicates,
+            len(traces) - duplicates - len(sample),
+        )
+        return sample
+
+    def stats(self):
+        """Return a dict mapping each signature to a dict counting its traces,
+        the duplicates dropped, the traces sampled out and the traces kept."""
+        stats = {}
+        for (sig, _), (traces, duplicates, sampled_out) in self._counts.items():
+            entry = stats.setdefault(
+                sig, {"traces": 0, "duplicates": 0, "sampled_out": 0, "kept": 0}
+            )
+            entry["traces"] += traces
+            entry["duplicates"] += duplicates
+            entry["sampled_out"] += sampled_out
+            entry["kept"] += traces - duplicates - sampled_out
+        return stats
+
+
+def _check_options(options):
+    unknown = set(options) - {"dedup", "max_contexts", "sampling"}
+    if unknown:
+        raise ValueError(f"Unknown reduction options: {sorted(unknown)}")
+    max_contexts = options.get("max_contexts")
+    if max_contexts is not None and max_contexts < 2:
+        raise ValueError("max_contexts must be at least 2.")
+    sampling = options.get("sampling", "log")
+    if sampling not in SAMPLINGS:
+        raise ValueError(
+            f"Unknown sampling {sampling!r}, expected one of {SAMPLINGS}."
+        )
+
+
+def _subsample(traces, n, sampling):
+    """Return n of traces, picked among them sorted by context."""
+    order = sorted(
+        range(len(traces)), key=lambda i: to_ctx(traces[i].root.params)
+    )
+    k = len(order)
+    if sampling == "log":
+        positions = np.geomspace(1, k, n) - 1
+    else:
+        positions = np.linspace(0, k - 1, n)
+    picked = set(np.round(positions).astype(int).tolist())
+    # Log-spaced positions collide at small contexts; the free slots go to
+    # the positions left out, smallest first.
+    for i in range(k):
+        if len(picked) == n:
+            break
+        picked.add(i)
+    # The traces keep their original order.
+    return [traces[i] for i in sorted(order[j] for j in picked)]
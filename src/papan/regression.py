@@ -1,88 +1,335 @@
+"""Symbolic regression of loop iteration counts.
+
+The deap and gplearn backends are imported on first use, so that importing
+papan stays fast and free of their global side effects (creating the DEAP
+classes and seeding the global random number generators).
+"""
+
+import ast
+import collections
+import copy
+import functools
+import hashlib
 import operator
+import os
 import random
+import tempfile
+import threading
+import time
+import types
+import zlib
 
-from deap import algorithms
-from deap import base
-from deap import creator
-from deap import tools
-from deap import gp
-from gplearn.genetic import SymbolicRegressor
-import gplearn
 import numpy as np
 import sympy
-from sympy import oo
-
-# for reproduction
-s = 0
-random.seed(s)
-np.random.seed(s)
 
 x = sympy.Symbol("X0")
-X = None
-Y = None
+
+# Maximum number of fitness values kept in the fitness cache.
+FITNESS_CACHE_SIZE = 100000
+
+# Parameters of the evolution run by deap_symreg.
+DEAP_PARAMS = {
+    "population": 300,
+    "cxpb": 0.5,
+    "mutpb": 0.1,
+    "ngen": 40,
+}
+
+# Defaults of deap_symreg's early stopping: the run stops once the best error
+# is at most TARGET_ERROR, or after STALL_GENERATIONS generations without
+# improvement.
+TARGET_ERROR = 0.0
+STALL_GENERATIONS = 10
+
+# Part of every RegressionCache key. Bump it when a regressor changes in a way
+# that makes previously stored results stale.
+REGRESSION_CACHE_VERSION = 1
 
 
 def protected_log(x1):
-    if x1 < 0 or abs(x1) < 1e-6:
-        return 1
-    return np.log(x1)
+    """Elementwise log of x1 that is 1 where x1 is negative or near 0."""
+    invalid = (x1 < 0) | (np.abs(x1) < 1e-6)
+    # Substitute the invalid inputs before taking the log so no warnings are
+    # raised for values that are replaced anyway.
+    return np.where(invalid, 1, np.log(np.where(invalid, 1, x1)))
 
 
 def protected_sqrt(x1):
-    if x1 < 0:
-        return 1
-    return np.sqrt(x1)
-
-
-# DEAP Setup.
-pset = gp.PrimitiveSet("Main", 1)
-pset.addPrimitive(operator.add, 2)
-# pset.addPrimitive(operator.sub, 2)
-pset.addPrimitive(operator.mul, 2)
-# pset.addPrimitive(protectedDiv, 2)
-# pset.addPrimitive(operator.neg, 1)
-pset.addPrimitive(protected_log, 1, name="log")
-pset.addPrimitive(protected_sqrt, 1, name="sqrt")
-pset.addEphemeralConstant("rand101", lambda: random.randint(-10, 10))
-pset.renameArguments(ARG0="X0")
-
-creator.create("FitnessMin", base.Fitness, weights=(-1,))
-creator.create("Individual", gp.PrimitiveTree, fitness=creator.FitnessMin)
-
-toolbox = base.Toolbox()
-toolbox.register("expr", gp.genGrow, pset=pset, min_=1, max_=2)
-toolbox.register(
-    "individual", tools.initIterate, creator.Individual, toolbox.expr
-)
-toolbox.register("population", tools.initRepeat, list, toolbox.individual)
-toolbox.register("compile", gp.compile, pset=pset)
-
-
-def evaluate(individual):
-    """Evalute the fitness of an individual: MAE (mean absolute error)"""
-    func = toolbox.compile(individual)
-    Yp = np.array(list(map(func, X)))
-    return (np.mean(np.abs(Y - Yp)),)
-
-
-toolbox.register("evaluate", evaluate)
-# toolbox.register("select", tools.selTournament, tournsize=3)
-toolbox.register(
-    "select",
-    tools.selDoubleTournament,
-    fitness_size=10,
-    parsimony_size=1.9,
-    fitness_first=True,
-)
-# toolbox.register("select", tools.selLexicase)
-# ref_points = tools.uniform_reference_points(nobj=3, p=12)
-# toolbox.register("select", tools.selNSGA3WithMemory(ref_points))
-toolbox.register("mate", gp.cxOnePoint)
-toolbox.register("expr_mut", gp.genFull, min_=0, max_=1)
+    """Elementwise square root of x1 that is 1 where x1 is negative."""
+    invalid = x1 < 0
+    return np.where(invalid, 1, np.sqrt(np.where(invalid, 0, x1)))
+
+
+# The DEAP primitive sets and toolboxes by number of arguments, created by
+# _deap() on first use.
+_deap_setups = {}
+_deap_lock = threading.Lock()
+
+
+def _deap(n_args=1):
+    """Return the DEAP primitive set and toolbox for programs of n_args
+    arguments, creating them if needed."""
+    setup = _deap_setups.get(n_args)
+    if setup is None:
+        with _deap_lock:
+            setup = _deap_setups.get(n_args)
+            if setup is None:
+                setup = _deap_setups[n_args] = _create_deap(n_args)
+    return setup
+
+
+def num_params(X):
+    """Return the number of parameters of the contexts X.
+
+    X is either a vector of single parameter contexts or a matrix with one
+    row per context and one column per parameter.
+    """
+    X = np.asarray(X)
+    return 1 if X.ndim == 1 else X.shape[1]
+
+
+def __getattr__(name):
+    # pset and toolbox are created lazily, see _deap().
+    if name in ("pset", "toolbox"):
+        return getattr(_deap(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def evaluate(individual, X, Y):
+    """Evalute the fitness of an individual: MAE (mean absolute error)
+
+    The compiled program is applied to the whole input array X at once. X is
+    a vector, or a matrix whose columns are passed as X0, X1, ...
+    """
+    X = np.asarray(X)
+    func = _deap(num_params(X)).toolbox.compile(individual)
+    columns = (X,) if X.ndim == 1 else X.T
+    with np.errstate(over="ignore", invalid="ignore"):
+        # Programs that ignore the arguments evaluate to a single value.
+        Yp = np.broadcast_to(func(*columns), np.shape(Y))
+        return (np.mean(np.abs(Y - Yp)),)
+
+
+class FitnessCache:
+    """Thread-safe LRU cache of fitness values with hit/miss counts."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, compute, counts=None):
+        """Return the value cached for key, calling compute() on a miss.
+
+        If a counts dict is given, its "hits" or "misses" entry is
+        incremented too, e.g. to count the lookups of a single run.
+        """
+        with self._lock:
+            value = self._values.get(key)
+            if value is not None:
+                self.hits += 1
+                if counts is not None:
+                    counts["hits"] += 1
+                self._values.move_to_end(key)
+                return value
+            self.misses += 1
+            if counts is not None:
+                counts["misses"] += 1
+        value = compute()
+        with self._lock:
+            self._values[key] = value
+            if len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+fitness_cache = FitnessCache(FITNESS_CACHE_SIZE)
+
+
+def dataset_key(X, Y):
+    """Return a hashable key identifying the contents of a dataset."""
+    X = np.ascontiguousarray(X)
+    Y = np.ascontiguousarray(Y)
+    return (
+        X.dtype.str,
+        X.shape,
+        X.tobytes(),
+        Y.dtype.str,
+        Y.shape,
+        Y.tobytes(),
+    )
+
+
+def dataset_digest(X, Y):
+    """Return the sha256 digest of the dataset_key of a dataset."""
+    h = hashlib.sha256()
+    for part in dataset_key(X, Y):
+        if not isinstance(part, bytes):
+            part = repr(part).encode()
+        h.update(part)
+    return h.digest()
+
+
+class RegressionCache:
+    """Persistent store of regression results keyed by a hash of the inputs.
+
+    Each result is stored as the srepr of its expression in a file named
+    after its key below path. Files are replaced atomically, so a cache
+    directory can be shared by concurrent processes. Stored expressions are
+    read back with parse_srepr, which only calls sympy constructors, so the
+    contents of the directory cannot run code in the reading process.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def key(regressor, params, X, Y, seed=None):
+        """Return the key of a regression with the given inputs."""
+        h = hashlib.sha256()
+        config = (REGRESSION_CACHE_VERSION, regressor, sorted(params.items()))
+        h.update(repr(config + (seed,)).encode())
+        for part in dataset_key(X, Y):
+            if not isinstance(part, bytes):
+                part = repr(part).encode()
+            h.update(part)
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        """Return the expression stored under key, or None."""
+        try:
+            with open(self._file(key), "r") as f:
+                text = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return parse_srepr(text)
+
+    def put(self, key, expr):
+        """Store expr under key."""
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(sympy.srepr(expr))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+# sympy classes that srepr writes with string arguments. Other constructors
+# may sympify strings, which evaluates them.
+_SREPR_STRING_CLASSES = ("Symbol", "Dummy", "Float", "Function")
+
+
+def parse_srepr(text):
+    """Return the sympy expression of its srepr text.
+
+    Unlike sympy.sympify, the text is not evaluated: only calls of sympy
+    classes and the sympy singletons (pi, oo, ...) are allowed, with string
+    arguments only for the classes that need them. Raises ValueError for
+    anything else.
+    """
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+    except (SyntaxError, RecursionError, MemoryError) as e:
+        raise ValueError(f"Invalid srepr text: {e}") from None
+    return _srepr_value(tree.body, strings=False)
+
+
+def _srepr_value(node, strings):
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if isinstance(value, (int, float)):
+            return value
+        if isinstance(value, str) and strings:
+            return value
+    elif (
+        isinstance(node, ast.UnaryOp)
+        and isinstance(node.op, ast.USub)
+        and isinstance(node.operand, ast.Constant)
+        and isinstance(node.operand.value, (int, float))
+    ):
+        return -node.operand.value
+    elif isinstance(node, ast.Name):
+        value = getattr(sympy, node.id, None)
+        if isinstance(value, sympy.Basic):
+            return value
+    elif isinstance(node, ast.Call):
+        if isinstance(node.func, ast.Name):
+            name = node.func.id
+            func = getattr(sympy, name, None)
+            if not isinstance(func, type) or not issubclass(func, sympy.Basic):
+                raise ValueError(f"Invalid srepr constructor: {name}")
+            strings = name in _SREPR_STRING_CLASSES
+        else:
+            # An applied undefined function, e.g. Function('f')(x).
+            func = _srepr_value(node.func, strings=False)
+            if not isinstance(func, sympy.FunctionClass):
+                raise ValueError("Invalid srepr call.")
+            strings = False
+        args = [_srepr_value(arg, strings) for arg in node.args]
+        kwargs = {
+            kw.arg: _srepr_value(kw.value, strings=False)
+            for kw in node.keywords
+            if kw.arg is not None
+        }
+        if len(kwargs) != len(node.keywords):
+            raise ValueError("Invalid srepr keyword arguments.")
+        return func(*args, **kwargs)
+    raise ValueError(f"Invalid srepr expression: {ast.dump(node)}")
+
+
+def data_seed(X, Y):
+    """Return a random seed derived from the contents of a dataset."""
+    seed = 0
+    for part in dataset_key(X, Y):
+        if not isinstance(part, bytes):
+            part = repr(part).encode()
+        seed = zlib.crc32(part, seed)
+    return seed
+
+
+def cached_evaluate(
+    individual, X, Y, data_key, cache=fitness_cache, counts=None
+):
+    """Evaluate an individual, reusing the fitness of identical individuals.
+
+    Individuals are identified by their string form, which lists every
+    primitive, argument and constant of the program, together with data_key
+    (see dataset_key). See FitnessCache.get for counts.
+    """
+    return cache.get(
+        (data_key, str(individual)),
+        lambda: evaluate(individual, X, Y),
+        counts,
+    )
 
 
 def customMut(individual, expr, pset):
     """To handle multiple mutation operators"""
+    from deap import gp
+
     r = random.random()
     if r < 0.5:
         individual = gp.mutUniform(individual, expr, pset)
@@ -92,25 +339,207 @@ def customMut(individual, expr, pset):
     return individual
 
 
-# toolbox.register("mutate", gp.mutUniform, expr=toolbox.expr_mut, pset=pset)
-toolbox.register("mutate", customMut, expr=toolbox.expr_mut, pset=pset)
-# toolbox.register("migrate", tools.migRing, k=5, selection=tools.selBest,
-#    replacement=tools.selRandom)
-
-toolbox.decorate(
-    "mate", gp.staticLimit(key=operator.attrgetter("height"), max_value=6)
-)
-toolbox.decorate(
-    "mutate", gp.staticLimit(key=operator.attrgetter("height"), max_value=6)
-)
+def _create_deap(n_args):
+    from deap import base
+    from deap import creator
+    from deap import tools
+    from deap import gp
+
+    if not hasattr(creator, "Individual"):
+        # for reproduction
+        s = 0
+        random.seed(s)
+        np.random.seed(s)
+
+        creator.create("FitnessMin", base.Fitness, weights=(-1,))
+        creator.create(
+            "Individual", gp.PrimitiveTree, fitness=creator.FitnessMin
+        )
+
+    # DEAP Setup.
+    pset = gp.PrimitiveSet("Main", n_args)
+    pset.addPrimitive(operator.add, 2)
+    # pset.addPrimitive(operator.sub, 2)
+    pset.addPrimitive(operator.mul, 2)
+    # pset.addPrimitive(protectedDiv, 2)
+    # pset.addPrimitive(operator.neg, 1)
+    pset.addPrimitive(protected_log, 1, name="log")
+    pset.addPrimitive(protected_sqrt, 1, name="sqrt")
+    pset.addEphemeralConstant(
+        "rand101", functools.partial(random.randint, -10, 10)
+    )
+    pset.renameArguments(**{f"ARG{i}": f"X{i}" for i in range(n_args)})
 
+    toolbox = base.Toolbox()
+    toolbox.register("expr", gp.genGrow, pset=pset, min_=1, max_=2)
+    toolbox.register(
+        "individual", tools.initIterate, creator.Individual, toolbox.expr
+    )
+    toolbox.register("population", tools.initRepeat, list, toolbox.individual)
+    toolbox.register("compile", gp.compile, pset=pset)
+
+    # toolbox.register("select", tools.selTournament, tournsize=3)
+    toolbox.register(
+        "select",
+        tools.selDoubleTournament,
+        fitness_size=10,
+        parsimony_size=1.9,
+        fitness_first=True,
+    )
+    # toolbox.register("select", tools.selLexicase)
+    # ref_points = tools.uniform_reference_points(nobj=3, p=12)
+    # toolbox.register("select", tools.selNSGA3WithMemory(ref_points))
+    toolbox.register("mate", gp.cxOnePoint)
+    toolbox.register("expr_mut", gp.genFull, min_=0, max_=1)
+
+    # toolbox.register(
+    #     "mutate", gp.mutUniform, expr=toolbox.expr_mut, pset=pset
+    # )
+    toolbox.register("mutate", customMut, expr=toolbox.expr_mut, pset=pset)
+    # toolbox.register("migrate", tools.migRing, k=5, selection=tools.selBest,
+    #    replacement=tools.selRandom)
 
-def deap_symreg(x, y):
-    global X, Y
-    X = x
-    Y = y
+    toolbox.decorate(
+        "mate", gp.staticLimit(key=operator.attrgetter("height"), max_value=6)
+    )
+    toolbox.decorate(
+        "mutate", gp.staticLimit(key=operator.attrgetter("height"), max_value=6)
+    )
+    return types.SimpleNamespace(pset=pset, toolbox=toolbox)
+
+
+def evolve(
+    population,
+    toolbox,
+    cxpb,
+    mutpb,
+    ngen,
+    stats=None,
+    halloffame=None,
+    target_error=None,
+    stall_generations=None,
+    time_budget=None,
+):
+    """Run the generational loop of DEAP's eaSimple with early stopping.
+
+    The loop stops after ngen generations, once the best fitness seen is at
+    most target_error, after stall_generations generations without an
+    improvement of the best fitness, or once time_budget seconds have
+    passed, whichever comes first. Until then it makes exactly the same
+    calls as eaSimple. Returns the final population, the logbook and the
+    reason the loop stopped ("ngen", "target_error", "stalled" or
+    "time_budget").
+    """
+    from deap import algorithms
+    from deap import tools
+
+    start = time.perf_counter()
+    # The hall of fame tracks the best individual even if none is given.
+    halloffame = tools.HallOfFame(1) if halloffame is None else halloffame
+    logbook = tools.Logbook()
+    logbook.header = ["gen", "nevals"] + (stats.fields if stats else [])
+
+    def evaluate_invalid(individuals):
+        invalid_ind = [ind for ind in individuals if not ind.fitness.valid]
+        fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)
+        for ind, fit in zip(invalid_ind, fitnesses):
+            ind.fitness.values = fit
+        halloffame.update(individuals)
+        record = stats.compile(individuals) if stats else {}
+        logbook.record(gen=gen, nevals=len(invalid_ind), **record)
+
+    gen = 0
+    evaluate_invalid(population)
+    best = halloffame[0].fitness.values[0]
+    stalled = 0
+    while True:
+        if target_error is not None and best <= target_error:
+            return population, logbook, "target_error"
+        if stall_generations is not None and stalled >= stall_generations:
+            return population, logbook, "stalled"
+        if (
+            time_budget is not None
+            and time.perf_counter() - start >= time_budget
+        ):
+            return population, logbook, "time_budget"
+        if gen == ngen:
+            return population, logbook, "ngen"
+
+        gen += 1
+        offspring = toolbox.select(population, len(population))
+        offspring = algorithms.varAnd(offspring, toolbox, cxpb, mutpb)
+        evaluate_invalid(offspring)
+        population[:] = offspring
+
+        if halloffame[0].fitness.values[0] < best:
+            best = halloffame[0].fitness.values[0]
+            stalled = 0
+        else:
+            stalled += 1
+
+
+def deap_symreg(
+    x,
+    y,
+    seed=None,
+    cache=None,
+    time_budget=None,
+    target_error=TARGET_ERROR,
+    stall_generations=STALL_GENERATIONS,
+    return_stats=False,
+):
+    """Find an expression of y in terms of x by genetic programming.
+
+    x is a vector of contexts, or a matrix with one column per parameter
+    whose columns are named X0, X1, ... in the expression.
+
+    The evolution follows DEAP_PARAMS and stops early once the best error is
+    at most target_error, after stall_generations generations without
+    improvement (either may be None to disable it), or after time_budget
+    seconds. If a RegressionCache is given, a result stored for the same data,
+    seed, DEAP_PARAMS and stopping criteria is returned without running the
+    evolution; results of runs cut short by the time budget are not stored.
+    With return_stats, a (expr, stats) tuple is returned, where stats is a
+    dict describing the run (None for cached results).
+    """
+    if cache is not None:
+        params = dict(
+            DEAP_PARAMS,
+            target_error=target_error,
+            stall_generations=stall_generations,
+        )
+        key = RegressionCache.key("deap", params, x, y, seed)
+        expr = cache.get(key)
+        if expr is not None:
+            return (expr, None) if return_stats else expr
+    from deap import tools
+
+    # Set up DEAP before reseeding, since the setup seeds the generators too.
+    toolbox = _deap(num_params(x)).toolbox
+    if seed is not None:
+        # Reseed so the run depends only on the seed, even in a worker
+        # process running several regressions.
+        random.seed(seed)
+        np.random.seed(seed)
+    # The data is bound to a copy of the toolbox, so that several regressions
+    # can run at the same time.
+    x = np.asarray(x)
+    y = np.asarray(y)
+    run_toolbox = copy.copy(toolbox)
+    # The lookups of this run, which the shared cache's counts would mix
+    # with those of concurrent runs.
+    counts = collections.Counter()
+    run_toolbox.register(
+        "evaluate",
+        cached_evaluate,
+        X=x,
+        Y=y,
+        data_key=dataset_key(x, y),
+        counts=counts,
+    )
+    start = time.perf_counter()
 
-    pop = toolbox.population(n=300)
+    pop = run_toolbox.population(n=DEAP_PARAMS["population"])
     hof = tools.HallOfFame(1)
 
     stats_fit = tools.Statistics(lambda ind: ind.fitness.values)
@@ -121,20 +550,50 @@ def deap_symreg(x, y):
     mstats.register("min", np.min)
     mstats.register("max", np.max)
 
-    pop, log = algorithms.eaSimple(
-        pop, toolbox, 0.5, 0.1, 40, stats=mstats, halloffame=hof, verbose=True
+    pop, log, stop_reason = evolve(
+        pop,
+        run_toolbox,
+        DEAP_PARAMS["cxpb"],
+        DEAP_PARAMS["mutpb"],
+        DEAP_PARAMS["ngen"],
+        stats=mstats,
+        halloffame=hof,
+        target_error=target_error,
+        stall_generations=stall_generations,
+        time_budget=time_budget,
+    )
+    hits, misses = counts["hits"], counts["misses"]
+    print(
+        f"Fitness cache: {hits} hits, {misses} misses"
+        f" ({hits / max(hits + misses, 1):.0%} hit rate)"
     )
-    # print log
     result = hof[0]
     result = str(result).replace("add", "Add").replace("mul", "Mul")
-    return sympy.simplify(result)
+    result = sympy.simplify(result)
+    if cache is not None and stop_reason != "time_budget":
+        cache.put(key, result)
+    if not return_stats:
+        return result
+    stats = {
+        "generations": log[-1]["gen"],
+        "evaluations": sum(log.select("nevals")),
+        "stop_reason": stop_reason,
+        "best_error": float(hof[0].fitness.values[0]),
+        "seconds": time.perf_counter() - start,
+        "fitness_cache_hits": hits,
+        "fitness_cache_misses": misses,
+        "logbook": log,
+    }
+    return result, stats
+
+
+def gplearn_symreg(data, cache=None):
+    from gplearn.genetic import SymbolicRegressor
 
-
-def gplearn_symreg(data):
     np.random.seed(0)  # for reproduction
 
     # Extract x and y from the data
-    x = np.array([item[0] for item in data]).reshape(-1, 1)
+    x = np.array([item[0] for item in data]).reshape(len(data), -1)
     y = np.array([item[1] for item in data])
 
     # Create symbolic regressor
@@ -177,6 +636,12 @@ def gplearn_symreg(data):
         init_method="grow",
     )
 
+    if cache is not None:
+        key = RegressionCache.key("gplearn", sr.get_params(), x, y)
+        expr = cache.get(key)
+        if expr is not None:
+            return expr
+
     # Fit the data
     sr.fit(x, y)
 
@@ -194,4 +659,7 @@ def gplearn_symreg(data):
         }
         return sympy.simplify(sympy.sympify(str(prog), locals=locals))
 
-    return to_sympy_expr(sr._program)
+    result = to_sympy_expr(sr._program)
+    if cache is not None:
+        cache.put(key, result)
+    return result
@@ -14,11 +14,25 @@ class Tree:
         return self.root.children if self.root else ()
 
     @staticmethod
-    def from_trace(trace):
-        """Create a tree from a paptrace trace entry."""
+    def from_trace(trace, fold_iterations=False, interner=None):
+        """Create a tree from a paptrace trace entry.
+
+        With fold_iterations, consecutive loop iterations with the same
+        control flow are kept only once while the tree is built. If an
+        interner (see papan.intern) is given, subtrees identical to ones of
+        previously built trees are shared with them.
+        """
         if not isinstance(trace, dict):
             raise TypeError("The JSON object is not a dict.")
-        root = CallNode.from_trace(trace)
+        return Tree.from_root(
+            CallNode.from_trace(
+                trace, fold_iterations=fold_iterations, interner=interner
+            )
+        )
+
+    @staticmethod
+    def from_root(root):
+        """Create a tree named after the call context of the given root."""
         param_str = ", ".join(
             [f"{p['name']}={p['value']}" for p in root.params]
         )
@@ -26,7 +40,7 @@ class Tree:
         return Tree(name, root)
 
     def get_cf_nodes(self):
-        """Return a list of control flow nodes."""
+        """Return a tuple of control flow nodes."""
         return self.root.get_cf_nodes()
 
     def to_expr(self, known_exprs):
@@ -1,20 +1,527 @@
+import concurrent.futures
+import contextlib
+import gc
+import itertools
 import json
+import mmap
+import re
 
+import numpy as np
+
+from .node import Node
 from .tree import Tree
 
+# Number of characters read from the trace file per refill of the stream
+# buffer.
+_CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = " \t\n\r"
+_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+
+_DECODER = json.JSONDecoder()
+
+# Constants accepted by json.loads, for decoding deeply nested documents.
+_CONSTANTS = {
+    "null": None,
+    "true": True,
+    "false": False,
+    "NaN": float("nan"),
+    "Infinity": float("inf"),
+    "-Infinity": float("-inf"),
+}
+_CONSTANT_RE = re.compile("|".join(sorted(_CONSTANTS, key=len, reverse=True)))
+
+# Largest number of bytes of the trace file scanned for trace boundaries at
+# a time.
+_SCAN_SIZE = 1 << 24
+
+# Number of runs of traces per worker process of from_file, so that workers
+# finishing early pick up more work.
+_RUNS_PER_WORKER = 4
+
+# Kinds of the bytes looked at by the scan for the traces of a file.
+_QUOTE, _BACKSLASH, _OPEN, _CLOSE = 1, 2, 3, 4
+_SCAN_KINDS = np.zeros(256, dtype=np.int8)
+_SCAN_KINDS[ord('"')] = _QUOTE
+_SCAN_KINDS[ord("\\")] = _BACKSLASH
+_SCAN_KINDS[[ord("{"), ord("[")]] = _OPEN
+_SCAN_KINDS[[ord("}"), ord("]")]] = _CLOSE
+
+# Matches the end of the text before the array of the "traces" entry. The
+# key's opening quote follows a "{" or ",", so it is not an escaped quote.
+_TRACES_KEY_RE = re.compile(rb'[{,][ \t\n\r]*"traces"[ \t\n\r]*:[ \t\n\r]*\Z')
 
-def from_file(path):
-    """Return a list of trees build from the given paptrace output file."""
+
+def from_file(
+    path, fold_iterations=False, interner=None, index=None, workers=None
+):
+    """Return a list of trees build from the given paptrace output file.
+
+    If a CallIndex (see papan.link) is given, every tree is added to it.
+
+    With workers > 1, that many worker processes locate the byte spans of the
+    traces in the file (see _trace_spans), then decode and build runs of
+    consecutive traces from their spans and send the trees back in the
+    compact form of Node._to_records. The parent rebuilds the trees from them,
+    so the result equals a serial load, in file order.
+    """
+    if workers is not None and workers > 1:
+        trees = _from_file_parallel(path, workers, fold_iterations, interner)
+        if trees is not None:
+            if index is not None:
+                for tree in trees:
+                    index.add(tree)
+            return trees
+        # The serial load reports what is wrong with the file.
     with open(path, "r") as f:
-        return from_json(json.load(f))
+        return from_json(loads(f.read()), fold_iterations, interner, index)
+
+
+def loads(s):
+    """Return the value of the JSON document s, however deeply it nests.
+
+    Like json.loads, but documents nested deeper than the C decoder's
+    recursion limit (i.e. traces of deep recursions) are decoded without
+    recursion.
+    """
+    value, end = _raw_decode(s, _WHITESPACE_RE.match(s).end())
+    end = _WHITESPACE_RE.match(s, end).end()
+    if end != len(s):
+        raise json.JSONDecodeError("Extra data", s, end)
+    return value
+
+
+def _raw_decode(s, idx):
+    """Decode the JSON value starting at s[idx], see JSONDecoder.raw_decode."""
+    try:
+        return _DECODER.raw_decode(s, idx)
+    except RecursionError:
+        return _raw_decode_deep(s, idx)
 
 
-def from_json(json):
+def _raw_decode_deep(s, idx):
+    """Decode the JSON value starting at s[idx] with an explicit stack."""
+    ws = _WHITESPACE_RE.match
+    # The open containers, each with the key its next value is stored under
+    # (None for arrays).
+    stack = []
+    while True:
+        # Decode a value, or open a container and decode its first value.
+        c = s[idx : idx + 1]
+        if c == '"':
+            value, idx = json.decoder.scanstring(s, idx + 1)
+        elif c == "{" or c == "[":
+            idx = ws(s, idx + 1).end()
+            if s[idx : idx + 1] == ("}" if c == "{" else "]"):
+                value = {} if c == "{" else []
+                idx += 1
+            else:
+                if c == "{":
+                    key, idx = _decode_key(s, idx)
+                    stack.append([{}, key])
+                else:
+                    stack.append([[], None])
+                idx = ws(s, idx).end()
+                continue
+        elif match := json.scanner.NUMBER_RE.match(s, idx):
+            integer, frac, exp = match.groups()
+            if frac or exp:
+                value = float(integer + (frac or "") + (exp or ""))
+            else:
+                value = int(integer)
+            idx = match.end()
+        elif match := _CONSTANT_RE.match(s, idx):
+            value = _CONSTANTS[match.group()]
+            idx = match.end()
+        else:
+            raise json.JSONDecodeError("Expecting value", s, idx)
+        # Store the value and close every container it completes.
+        while stack:
+            entry = stack[-1]
+            container, key = entry
+            if key is None:
+                container.append(value)
+            else:
+                container[key] = value
+            idx = ws(s, idx).end()
+            c = s[idx : idx + 1]
+            if c == ",":
+                idx = ws(s, idx + 1).end()
+                if key is not None:
+                    entry[1], idx = _decode_key(s, idx)
+                    idx = ws(s, idx).end()
+                break
+            if c != ("]" if key is None else "}"):
+                raise json.JSONDecodeError("Expecting ',' delimiter", s, idx)
+            idx += 1
+            stack.pop()
+            value = container
+        else:
+            return value, idx
+
+
+def _decode_key(s, idx):
+    """Decode an object key and its colon, returning the key and the end."""
+    if s[idx : idx + 1] != '"':
+        raise json.JSONDecodeError(
+            "Expecting property name enclosed in double quotes", s, idx
+        )
+    key, idx = json.decoder.scanstring(s, idx + 1)
+    idx = _WHITESPACE_RE.match(s, idx).end()
+    if s[idx : idx + 1] != ":":
+        raise json.JSONDecodeError("Expecting ':' delimiter", s, idx)
+    return key, idx + 1
+
+
+def from_json(json, fold_iterations=False, interner=None, index=None):
     """Return a list of trees build from the given paptrace output json."""
     traces = json["traces"]
     if not isinstance(traces, list):
         raise TypeError("The traces entry is not a list.")
     trees = []
     for trace in traces:
-        trees.append(Tree.from_trace(trace))
+        tree = Tree.from_trace(trace, fold_iterations, interner)
+        if index is not None:
+            index.add(tree)
+        trees.append(tree)
     return trees
+
+
+def _from_file_parallel(path, workers, fold_iterations, interner):
+    """Load the trees of a file on a process pool, see from_file.
+
+    Returns None if no traces array is found.
+    """
+    n_runs = workers * _RUNS_PER_WORKER
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        spans = _trace_spans(path, pool, n_runs)
+        if spans is None:
+            return None
+        trees = []
+        # map() yields the results in submission order.
+        runs = pool.map(
+            _build_records,
+            itertools.repeat(str(path)),
+            _split_spans(spans, n_runs),
+            itertools.repeat(fold_iterations),
+        )
+        # Every rebuilt node is kept, so the collections the allocations
+        # trigger would only walk the growing trees again and again.
+        with _gc_paused():
+            for run in runs:
+                for records in run:
+                    root = Node._from_records(records, interner)
+                    trees.append(Tree.from_root(root))
+        return trees
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Disable the cyclic garbage collector within the block."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _build_records(path, spans, fold_iterations):
+    """Build the trees of a run of trace spans in a worker process."""
+    start, end = spans[0][0], spans[-1][1]
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return [
+        Tree.from_trace(
+            loads(data[i - start : j - start].decode("utf-8")), fold_iterations
+        ).root._to_records()
+        for i, j in spans
+    ]
+
+
+def _split_spans(spans, n):
+    """Split spans into up to n runs of consecutive spans of similar size."""
+    total = sum(end - start for start, end in spans)
+    runs = []
+    run, size = [], 0
+    for span in spans:
+        run.append(span)
+        size += span[1] - span[0]
+        if size * n >= total:
+            runs.append(run)
+            run, size = [], 0
+    if run:
+        runs.append(run)
+    return runs
+
+
+def _trace_spans(path, pool=None, n_blocks=1):
+    """Return the (start, end) byte offsets of the traces of a paptrace file.
+
+    The file is scanned in at least n_blocks blocks without decoding it, on
+    pool if given. The unescaped quotes tell which brackets are outside of
+    strings, and the nesting depth of those tells which of them delimit the
+    elements of the "traces" array. A first pass counts the quotes of every
+    block and its change of depth both for starting inside and outside of a
+    string, which gives the state at the start of every block. A second pass
+    lists the brackets of every block up to the depth of the elements.
+    Returns None if no traces array is found.
+    """
+    path = str(path)
+    map_ = map if pool is None else pool.map
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file.
+            return None
+    with mm:
+        bounds = _block_bounds(mm, n_blocks)
+        starts, ends = bounds[:-1], bounds[1:]
+        in_string, depth = 0, 0
+        states = []
+        for n_quotes, steps in map_(
+            _scan_block, itertools.repeat(path), starts, ends
+        ):
+            states.append((in_string, depth))
+            depth += steps[in_string]
+            in_string = (in_string + n_quotes) % 2
+        brackets = list(
+            map_(
+                _block_brackets,
+                itertools.repeat(path),
+                starts,
+                ends,
+                [state[0] for state in states],
+                [state[1] for state in states],
+            )
+        )
+        return _element_spans(
+            mm,
+            np.concatenate([b[0] for b in brackets]),
+            np.concatenate([b[1] for b in brackets]),
+            np.concatenate([b[2] for b in brackets]),
+        )
+
+
+def _block_bounds(mm, n_blocks):
+    """Return the bounds of the blocks of the file scanned by _trace_spans.
+
+    Blocks never start right after a backslash, so escapes do not cross
+    blocks.
+    """
+    size = min(_SCAN_SIZE, -(-len(mm) // n_blocks))
+    bounds = [0]
+    for lo in range(size, len(mm), size):
+        while lo < len(mm) and mm[lo - 1] == ord("\\"):
+            lo += 1
+        if bounds[-1] < lo < len(mm):
+            bounds.append(lo)
+    bounds.append(len(mm))
+    return bounds
+
+
+def _read_block(path, lo, hi):
+    with open(path, "rb") as f:
+        f.seek(lo)
+        return np.frombuffer(f.read(hi - lo), dtype=np.uint8)
+
+
+def _scan_block(path, lo, hi):
+    """Return the number of quotes of a block and its change of depth when
+    starting outside and inside of a string."""
+    _, steps, parities, n_quotes = _brackets(_read_block(path, lo, hi))
+    return n_quotes, (
+        int(steps[parities == 0].sum()),
+        int(steps[parities == 1].sum()),
+    )
+
+
+def _block_brackets(path, lo, hi, in_string, depth):
+    """Return the positions, depth steps and depths of the brackets of a
+    block that are outside of strings and reach at most depth 3."""
+    pos, steps, parities, _ = _brackets(_read_block(path, lo, hi))
+    outside = parities == in_string
+    pos, steps = pos[outside], steps[outside]
+    depths = depth + np.cumsum(steps)
+    shallow = depths <= 3
+    return lo + pos[shallow], steps[shallow], depths[shallow]
+
+
+def _brackets(block):
+    """Return the positions and depth steps of the brackets of a block, the
+    parities of the number of quotes before them and the number of quotes,
+    ignoring escaped quotes."""
+    pos = np.flatnonzero(
+        (block == ord('"'))
+        | (block == ord("\\"))
+        | (block == ord("{"))
+        | (block == ord("}"))
+        | (block == ord("["))
+        | (block == ord("]"))
+    )
+    kinds = _SCAN_KINDS[block[pos]]
+    escapes = kinds == _BACKSLASH
+    if escapes.any():
+        quotes = np.flatnonzero(kinds == _QUOTE)
+        escaped = _escaped(pos[quotes], pos[escapes])
+        kinds[quotes[escaped]] = 0
+    quote_counts = np.cumsum(kinds == _QUOTE)
+    brackets = np.flatnonzero(kinds >= _OPEN)
+    steps = np.where(kinds[brackets] == _OPEN, 1, -1)
+    n_quotes = int(quote_counts[-1]) if len(quote_counts) > 0 else 0
+    return pos[brackets], steps, quote_counts[brackets] % 2, n_quotes
+
+
+def _escaped(quotes, escapes):
+    """Return which quotes follow an odd run of backslashes."""
+    # Start of the run of backslashes that each backslash belongs to.
+    new_run = np.ones(len(escapes), dtype=bool)
+    new_run[1:] = escapes[1:] != escapes[:-1] + 1
+    run_starts = np.maximum.accumulate(np.where(new_run, escapes, 0))
+    k = np.maximum(np.searchsorted(escapes, quotes) - 1, 0)
+    preceded = escapes[k] == quotes - 1
+    runs = np.where(preceded, quotes - run_starts[k], 0)
+    return runs % 2 == 1
+
+
+def _element_spans(mm, pos, steps, depths):
+    """Return the spans of the elements of the traces array, given the
+    brackets of the file up to depth 3, or None if there is no single traces
+    array or its elements are not separated by single commas."""
+    # Arrays opened directly in the top-level object.
+    found = [
+        k
+        for k in np.flatnonzero((steps == 1) & (depths == 2))
+        if mm[int(pos[k])] == ord("[")
+        and _TRACES_KEY_RE.search(mm, max(0, int(pos[k]) - 256), int(pos[k]))
+    ]
+    if len(found) != 1:
+        return None
+    (k,) = found
+    start = int(pos[k])
+    closed = np.flatnonzero(depths[k:] < 2)
+    if len(closed) == 0 or mm[int(pos[k + closed[0]])] != ord("]"):
+        return None
+    end = int(pos[k + closed[0]])
+    pos, steps, depths = (
+        a[k + 1 : k + closed[0]] for a in (pos, steps, depths)
+    )
+    starts = pos[(steps == 1) & (depths == 3)].tolist()
+    ends = (pos[(steps == -1) & (depths == 2)] + 1).tolist()
+    bounds = [start + 1] + [i for span in zip(starts, ends) for i in span]
+    bounds.append(end)
+    for i in range(0, len(bounds), 2):
+        gap = mm[bounds[i] : bounds[i + 1]].strip()
+        if gap != (b"," if 0 < i < len(bounds) - 2 else b""):
+            return None
+    return list(zip(starts, ends))
+
+
+def iter_trees(path, fold_iterations=False, interner=None, index=None):
+    """Yield the trees of the given paptrace output file one at a time.
+
+    Unlike from_file, the "traces" array is decoded one element at a time, so
+    peak memory is bounded by the largest single trace rather than the whole
+    file. If a CallIndex is given, every tree is added to it.
+    """
+    for trace in iter_traces(path):
+        tree = Tree.from_trace(trace, fold_iterations, interner)
+        if index is not None:
+            index.add(tree)
+        yield tree
+
+
+def iter_traces(path):
+    """Yield the raw trace entries of the given paptrace output file."""
+    with open(path, "r") as f:
+        yield from _TraceStream(f).iter_array("traces")
+
+
+class _TraceStream:
+    """Incremental reader for the top-level object of a paptrace file."""
+
+    def __init__(self, f):
+        self._f = f
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Read another chunk into the buffer. Returns False at EOF."""
+        if self._eof:
+            return False
+        # Grow the read size with the pending text so that decoding a single
+        # large trace stays linear in its size.
+        pending = len(self._buf) - self._pos
+        chunk = self._f.read(max(_CHUNK_SIZE, pending))
+        if not chunk:
+            self._eof = True
+            return False
+        # Drop the consumed prefix so the buffer only holds pending text.
+        self._buf = self._buf[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self._pos < len(self._buf):
+                if self._buf[self._pos] not in _WHITESPACE:
+                    return self._buf[self._pos]
+                self._pos += 1
+            if not self._fill():
+                return ""
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c == "" or c not in chars:
+            raise json.JSONDecodeError(
+                f"Expecting one of {chars!r}", self._buf, self._pos
+            )
+        self._pos += 1
+        return c
+
+    def _decode(self):
+        """Decode the next complete JSON value from the stream."""
+        self._peek()
+        while True:
+            try:
+                value, end = _raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A scalar at the very end of the buffer may have been cut short
+            # (e.g. a number), so only accept it once more text is available.
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def iter_array(self, key):
+        """Yield the elements of the top-level array stored under key."""
+        self._expect("{")
+        if self._peek() == "}":
+            raise KeyError(key)
+        while True:
+            name = self._decode()
+            self._expect(":")
+            if name != key:
+                # Skip over entries we are not interested in.
+                self._decode()
+            else:
+                if self._peek() != "[":
+                    raise TypeError(f"The {key} entry is not a list.")
+                self._expect("[")
+                if self._peek() == "]":
+                    self._pos += 1
+                    return
+                while True:
+                    yield self._decode()
+                    if self._expect(",]") == "]":
+                        return
+            if self._expect(",}") == "}":
+                raise KeyError(key)
@@ -0,0 +1,60 @@
+"""Trace factories shared by the tests."""
+
+import copy
+
+from papan import Tree
+
+
+def stmt(id_, type_="DeclStmt", children=()):
+    return {
+        "id": id_,
+        "type": type_,
+        "desc": f"stmt {id_}",
+        "children": list(children),
+    }
+
+
+def loop_stmt(n_iters, body=None, exit_id=None):
+    """Return a for loop trace of n_iters iterations.
+
+    Every iteration runs the statements of body (a DeclStmt 12 by default)
+    between a LoopIter 11 and the IfThenStmt 10 loop condition. With exit_id,
+    the loop ends with one more LoopIter followed by a ReturnStmt exit_id.
+    """
+    body = [stmt(12)] if body is None else body
+    children = [stmt(10, "IfThenStmt")]
+    for _ in range(n_iters):
+        children.append(stmt(11, "LoopIter"))
+        children.extend(copy.deepcopy(body))
+        children.append(stmt(10, "IfThenStmt"))
+    if exit_id is not None:
+        children.append(stmt(11, "LoopIter"))
+        children.append(stmt(exit_id, "ReturnStmt"))
+    return {"id": 3, "type": "ForStmt", "desc": "for", "children": children}
+
+
+def loop_trace(ctx, n_iters, name="foo", before=(), after=(), **kwargs):
+    """Return the trace of a call of void name(int...) running a loop.
+
+    ctx is the value of the single parameter n, or a tuple of the values of
+    the parameters n0, n1, ... The loop (see loop_stmt, which takes kwargs)
+    runs between the statements of before and after.
+    """
+    if isinstance(ctx, tuple):
+        params = [(f"n{i}", value) for i, value in enumerate(ctx)]
+    else:
+        params = [("n", ctx)]
+    return {
+        "id": 1,
+        "type": "CalleeExpr",
+        "sig": f"void {name}({', '.join(['int'] * len(params))})",
+        "params": [
+            {"name": param, "value": str(value)} for param, value in params
+        ],
+        "children": [*before, loop_stmt(n_iters, **kwargs), *after],
+    }
+
+
+def loop_tree(ctx, n_iters, name="foo", **kwargs):
+    """Return the Tree of loop_trace(ctx, n_iters, name, **kwargs)."""
+    return Tree.from_trace(loop_trace(ctx, n_iters, name, **kwargs))
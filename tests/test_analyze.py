@@ -0,0 +1,117 @@
+import numpy as np
+
+from papan import ContextReducer, analyze
+
+from helpers import loop_tree
+
+
+class TestGroupRunRegressions:
+    x = np.arange(1, 9)
+
+    def test_workers_match_serial(self, capsys):
+        data = [(self.x, self.x * self.x + 3), (self.x, 2 * self.x * self.x)]
+        serial = analyze.run_regressions(data)
+        parallel = analyze.run_regressions(data[::-1], workers=2)
+        assert serial == parallel[::-1]
+
+    def test_identical_data_regressed_once(self, capsys, monkeypatch):
+        calls = []
+
+        def deap_symreg(x, y, seed=None, cache=None, **kwargs):
+            calls.append(seed)
+            return len(calls)
+
+        monkeypatch.setattr(analyze, "deap_symreg", deap_symreg)
+        y = self.x * self.x
+        exprs = analyze.run_regressions(
+            [(self.x, y), (self.x, y + 1), (self.x.copy(), y.copy())]
+        )
+        assert exprs == [1, 2, 1]
+        assert len(calls) == 2
+        assert calls[0] != calls[1]
+
+    def test_symreg_options(self, capsys, monkeypatch):
+        calls = []
+
+        def deap_symreg(x, y, seed=None, cache=None, **kwargs):
+            calls.append(kwargs)
+            return len(calls)
+
+        monkeypatch.setattr(analyze, "deap_symreg", deap_symreg)
+        options = {"time_budget": 1.0, "stall_generations": 3}
+        analyze.run_regressions(
+            [(self.x, self.x * self.x)], None, None, options
+        )
+        assert calls == [options]
+
+
+class TestGroupAnalyze:
+    def test_closed_form_loop(self, capsys):
+        trees = [loop_tree(n, n * n) for n in range(1, 7)]
+        results = analyze.analyze({}, trees)
+        assert "Queueing symbolic regression" not in capsys.readouterr().out
+        assert results["exprs"] == {"sig_0": {"path_0": "C_1 + T_12*X0**2"}}
+        assert len(results["ctxs"]["sig_0"]) == 6
+
+    def test_multi_parameter_loop(self, capsys):
+        ctxs = [(rows, cols) for rows in range(1, 4) for cols in (2, 5)]
+        trees = [loop_tree(ctx, ctx[0] * ctx[1]) for ctx in ctxs]
+        results = analyze.analyze({}, trees)
+        assert "Queueing symbolic regression" not in capsys.readouterr().out
+        assert results["exprs"] == {"sig_0": {"path_0": "C_1 + T_12*X0*X1"}}
+        assert results["ctxs"]["sig_0"]["3, 5"] == "path_0"
+
+
+class TestGroupAnalysisSession:
+    def test_matches_analyze(self, capsys):
+        session = analyze.AnalysisSession({})
+        session.add([loop_tree(n, n * n) for n in range(1, 5)])
+        results = session.add([loop_tree(n, n * n) for n in range(5, 8)])
+        trees = [loop_tree(n, n * n) for n in range(1, 8)]
+        assert results == analyze.analyze({}, trees)
+        assert session.results() == results
+
+    def test_only_touched_paths(self, capsys, monkeypatch):
+        calls = []
+        fit_complexity = analyze.fit_complexity
+
+        def counting_fit_complexity(x, y):
+            calls.append(len(y))
+            return fit_complexity(x, y)
+
+        monkeypatch.setattr(analyze, "fit_complexity", counting_fit_complexity)
+        session = analyze.AnalysisSession({})
+        session.add([loop_tree(n, 2 * n * n) for n in range(1, 6)])
+        assert calls == [5]
+        # Traces of another function leave the first one's path alone.
+        ctxs = [(rows, cols) for rows in range(1, 4) for cols in (2, 5)]
+        results = session.add([loop_tree(ctx, ctx[0] * ctx[1]) for ctx in ctxs])
+        assert calls == [5, 6]
+        assert results["exprs"] == {
+            "sig_0": {"path_0": "C_1 + 2*T_12*X0**2"},
+            "sig_1": {"path_0": "C_1 + T_12*X0*X1"},
+        }
+        # A new context changes the loop data of the first path.
+        results = session.add([loop_tree(6, 72)])
+        assert calls == [5, 6, 6]
+        assert results["ctxs"]["sig_0"]["6"] == "path_0"
+
+    def test_unchanged_loop_data(self, capsys, monkeypatch):
+        session = analyze.AnalysisSession({}, reducer=ContextReducer())
+        session.add([loop_tree(n, 2 * n * n) for n in range(1, 6)])
+        monkeypatch.setattr(analyze, "fit_complexity", None)
+        # Duplicate contexts leave the reduced loop data unchanged, so the
+        # loop is not fitted again.
+        results = session.add([loop_tree(n, 2 * n * n) for n in range(1, 3)])
+        assert results["exprs"]["sig_0"] == {"path_0": "C_1 + 2*T_12*X0**2"}
+
+    def test_loop_exprs_bounded(self, capsys):
+        session = analyze.AnalysisSession({})
+        session.add([loop_tree(n, 2 * n * n) for n in range(1, 6)])
+        for n in range(6, 12):
+            session.add([loop_tree(n, 2 * n * n)])
+        # Only the latest data of the loop is kept, as a fixed-size digest.
+        ((loop, (digest, expr)),) = session._loop_exprs.items()
+        assert loop == ("void foo(int)", 0, 0)
+        assert len(digest) == 32
+        assert str(expr) == "2*X0**2"
@@ -0,0 +1,94 @@
+import json
+import pathlib
+
+import anytree
+import pytest
+
+from papan import columnar, utils
+
+DATA_PATH = pathlib.Path(__file__).parent / "data" / "paptrace.json"
+
+
+def render(tree):
+    return str(anytree.RenderTree(tree.root))
+
+
+class TestGroupWrite:
+    def test_non_dict_trace(self, tmp_path):
+        with pytest.raises(TypeError, match="The JSON object is not a dict."):
+            columnar.write([[]], tmp_path / "trace.pap")
+
+    def test_incomplete_entry(self, tmp_path):
+        with pytest.raises(KeyError, match="'type'"):
+            columnar.write([{"id": 1}], tmp_path / "trace.pap")
+
+    def test_empty(self, tmp_path):
+        path = tmp_path / "trace.pap"
+        columnar.write([], path)
+        assert columnar.from_file(path) == []
+
+
+class TestGroupTraceFile:
+    def test_not_a_trace_file(self, tmp_path):
+        path = tmp_path / "trace.json"
+        path.write_bytes(b"not a columnar trace file")
+        with pytest.raises(ValueError, match="is not a columnar trace file."):
+            columnar.TraceFile(path)
+
+    def test_round_trip(self, tmp_path):
+        trace = {
+            "id": 123,
+            "type": "CallerExpr",
+            "sig": "int foo(int, int)",
+            "params": [
+                {"name": "a", "value": "-1"},
+                {"name": "b", "value": "1"},
+            ],
+            "children": [
+                {
+                    "id": 456,
+                    "type": "ForStmt",
+                    "desc": "i < n",
+                    "children": [
+                        {
+                            "id": 789,
+                            "type": "ReturnStmt",
+                            "desc": "return 1",
+                            "children": [],
+                        }
+                    ],
+                },
+                {
+                    "id": 1011,
+                    "type": "CalleeExpr",
+                    "sig": "int bar()",
+                    "params": [],
+                    "children": [],
+                },
+            ],
+        }
+        path = tmp_path / "trace.pap"
+        columnar.write([trace], path)
+        with columnar.TraceFile(path) as trace_file:
+            assert len(trace_file) == 1
+            tree = trace_file[0]
+        assert tree.name == "int foo(int, int)(a=-1, b=1)"
+        assert tree.root.params == trace["params"]
+        loop, callee = tree.root.children
+        assert type(loop).__name__ == "LoopNode"
+        assert loop.desc == "i < n"
+        assert loop.children[0].name == 789
+        assert callee.sig == "int bar()"
+        assert callee.params == []
+
+    def test_actual_data(self, tmp_path):
+        path = tmp_path / "paptrace.pap"
+        columnar.convert(DATA_PATH, path)
+        expected = utils.from_file(DATA_PATH)
+        with columnar.TraceFile(path) as trace_file:
+            assert len(trace_file) == len(expected)
+            assert render(trace_file[-1]) == render(expected[-1])
+        trees = columnar.from_file(path)
+        for tree, expected_tree in zip(trees, expected):
+            assert tree.name == expected_tree.name
+            assert render(tree) == render(expected_tree)
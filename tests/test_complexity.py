@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import sympy
+
+from papan.complexity import fit_complexity, x
+
+N = np.arange(1, 13)
+
+
+def fib(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+
+
+class TestGroupFitComplexity:
+    @pytest.mark.parametrize(
+        "counts,expected",
+        [
+            (3 * N + 2, 3 * x + 2),
+            (N**2 + 3, x**2 + 3),
+            (N**3 + N, x**3 + x),
+            (4 * np.sqrt(N), 4 * sympy.sqrt(x)),
+            (2**N - 1, 2**x - 1),
+        ],
+    )
+    def test_exact(self, counts, expected):
+        assert fit_complexity(N, counts) == expected
+
+    def test_n_log_n(self):
+        expr = fit_complexity(N, N * np.log2(N))
+        assert expr.free_symbols == {x}
+        assert expr.has(sympy.log)
+        values = [float(expr.subs(x, n)) for n in N]
+        assert np.allclose(values, N * np.log2(N))
+
+    def test_fibonacci(self):
+        counts = [fib(n) for n in N]
+        expr = fit_complexity(N, counts)
+        assert expr.has(sympy.GoldenRatio)
+        values = [float(expr.subs(x, n)) for n in N]
+        assert np.allclose(values, counts)
+
+    def test_triangular_large_contexts(self):
+        n = np.array([10, 100, 1000, 3000, 10000])
+        counts = n * (n - 1) // 2
+        expr = fit_complexity(n, counts)
+        assert expr.free_symbols == {x}
+        assert expr.has(x**2)
+        values = [float(expr.subs(x, int(v))) for v in n]
+        assert np.allclose(values, counts, rtol=1e-9)
+
+    def test_small_terms_of_large_counts(self):
+        # 500 * x is far below the tolerance of the largest counts, but not
+        # of the smallest ones.
+        n = np.array([10, 100, 1000, 3000, 10000])
+        assert fit_complexity(n, 500 * n + n**3) == x**3 + 500 * x
+
+    def test_no_fit(self):
+        counts = [7, 3, 9, 1, 12, 5, 8, 2, 11, 4, 6, 10]
+        assert fit_complexity(N, counts) is None
+
+    def test_multi_parameter(self):
+        rows, cols = np.meshgrid(np.arange(1, 5), np.arange(1, 4))
+        ctxs = np.column_stack([rows.ravel(), cols.ravel()])
+        x0, x1 = sympy.symbols("X0 X1")
+        assert fit_complexity(ctxs, rows.ravel() * cols.ravel()) == x0 * x1
+        assert fit_complexity(ctxs, 2 * cols.ravel() + 1) == 2 * x1 + 1
+        assert fit_complexity(ctxs, rows.ravel() ** 2 + cols.ravel()) == (
+            x0**2 + x1
+        )
+
+    def test_too_few_samples(self):
+        # Three points determine any single basis function plus a constant.
+        assert fit_complexity([1, 2, 3], [1, 4, 9]) is None
+        assert fit_complexity([1, 2, 3, 4], [1, 4, 9, 16]) == x**2
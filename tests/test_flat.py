@@ -0,0 +1,107 @@
+import pathlib
+import tracemalloc
+
+import pytest
+
+from papan import FlatTree, Tree, columnar, utils
+from papan.flat import StringTable
+
+from helpers import loop_trace, stmt
+
+DATA_PATH = pathlib.Path(__file__).parent / "data" / "paptrace.json"
+
+
+# A loop over two statements between a statement and a call.
+LOOP = {
+    "body": [stmt(12), stmt(13, "IfThenStmt", [stmt(14)])],
+    "before": [stmt(2)],
+    "after": [
+        {
+            "id": 4,
+            "type": "CallerExpr",
+            "sig": "int bar()",
+            "params": [],
+            "children": [stmt(5)],
+        }
+    ],
+}
+
+
+def assert_same(flat, tree, known):
+    assert flat.name == tree.name
+    assert flat.get_cf_nodes() == tree.get_cf_nodes()
+    assert flat.has_loop() == tree.has_loop()
+    flat_loops = flat.get_loop_nodes()
+    tree_loops = tree.get_loop_nodes()
+    assert [n.name for n in flat_loops] == [n.name for n in tree_loops]
+    assert [n.iter_count for n in flat_loops] == [
+        n.iter_count for n in tree_loops
+    ]
+    assert flat.to_expr(known) == tree.to_expr(known)
+
+
+class TestGroupFlatTree:
+    def test_from_trace_invalid(self):
+        with pytest.raises(TypeError, match="The JSON object is not a dict."):
+            FlatTree.from_trace([])
+
+    def test_from_trace_non_call_root(self):
+        with pytest.raises(ValueError, match="must be a call node"):
+            FlatTree.from_trace(stmt(1))
+
+    def test_root(self):
+        flat = FlatTree.from_trace(loop_trace(2, 2, **LOOP))
+        assert flat.name == "void foo(int)(n=2)"
+        assert flat.root.sig == "void foo(int)"
+        assert flat.root.params == [{"name": "n", "value": "2"}]
+        assert [child.name for child in flat.children] == [2, 3, 4]
+        assert flat.children[1].parent.name == 1
+
+    @pytest.mark.parametrize("trailing", [False, True])
+    def test_loops(self, trailing):
+        trace = loop_trace(5, 5, exit_id=15 if trailing else None, **LOOP)
+        flat = FlatTree.from_trace(trace)
+        tree = Tree.from_trace(trace)
+        assert_same(flat, tree, {})
+        assert flat.get_loop_nodes()[0].iter_count == 5
+
+    def test_loop_expr(self):
+        trace = loop_trace(5, 5, **LOOP)
+        flat = FlatTree.from_trace(trace)
+        tree = Tree.from_trace(trace)
+        flat.get_loop_nodes()[0].set_loop_expr(5)
+        tree.get_loop_nodes()[0].set_loop_expr(5)
+        known = {"int bar()": "B", "stmt 2": "D"}
+        assert_same(flat, tree, known)
+
+    def test_equality(self):
+        strings = StringTable()
+        a = FlatTree.from_trace(loop_trace(2, 2, **LOOP), strings)
+        b = FlatTree.from_trace(loop_trace(2, 2, **LOOP), strings)
+        c = FlatTree.from_trace(loop_trace(3, 3, **LOOP), strings)
+        assert a.root == b.root
+        assert a.root != c.root
+        assert a.children[0] == c.children[0]
+
+    def test_actual_data(self, tmp_path):
+        path = tmp_path / "paptrace.pap"
+        columnar.convert(DATA_PATH, path)
+        trees = utils.from_file(DATA_PATH)
+        with columnar.TraceFile(path) as trace_file:
+            flats = list(trace_file.iter_flat_trees())
+        assert len(flats) == len(trees)
+        for flat, tree in zip(flats, trees):
+            assert_same(flat, tree, {})
+
+    def test_memory(self):
+        trace = loop_trace(2000, 2000, **LOOP)
+        tracemalloc.start()
+        tree = Tree.from_trace(trace)
+        tree_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del tree
+        tracemalloc.start()
+        flat = FlatTree.from_trace(trace)
+        flat_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert flat_size * 4 < tree_size
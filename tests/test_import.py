@@ -0,0 +1,31 @@
+import subprocess
+import sys
+
+BACKENDS = ("deap", "gplearn", "sklearn")
+
+
+def run_python(code):
+    proc = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True
+    )
+    assert proc.returncode == 0, proc.stderr
+    return proc.stdout
+
+
+def test_backends_not_imported():
+    out = run_python("import sys, papan; print(' '.join(sys.modules))")
+    modules = {name.split(".")[0] for name in out.split()}
+    assert modules.isdisjoint(BACKENDS)
+
+
+def test_backends_imported_on_use():
+    out = run_python(
+        "import sys\n"
+        "import numpy as np\n"
+        "from papan import regression\n"
+        "x = np.arange(5)\n"
+        "individual = regression.toolbox.individual()\n"
+        "regression.evaluate(individual, x, x)\n"
+        "print('deap' in sys.modules)\n"
+    )
+    assert out.strip() == "True"
@@ -0,0 +1,117 @@
+import pathlib
+
+import anytree
+
+from papan import SubtreeInterner, Tree, analyze, utils
+
+from helpers import stmt
+
+DATA_PATH = pathlib.Path(__file__).parent / "data" / "paptrace.json"
+
+
+def call_trace(n, body):
+    return {
+        "id": 1,
+        "type": "CalleeExpr",
+        "sig": "void foo(int)",
+        "params": [{"name": "n", "value": str(n)}],
+        "children": (
+            [
+                stmt(2, "IfThenStmt", [stmt(3), stmt(4)]),
+                {
+                    "id": 5,
+                    "type": "CallerExpr",
+                    "sig": "int bar()",
+                    "params": [],
+                    "children": [stmt(6, children=[stmt(7)])],
+                },
+            ]
+            + body
+        ),
+    }
+
+
+def loop(n_iters):
+    children = [stmt(10, "IfThenStmt")]
+    for _ in range(n_iters):
+        children += [stmt(11, "LoopIter"), stmt(12), stmt(10, "IfThenStmt")]
+    return {"id": 8, "type": "ForStmt", "desc": "for", "children": children}
+
+
+class TestGroupSubtreeInterner:
+    def test_shares_identical_subtrees(self):
+        interner = SubtreeInterner()
+        a = Tree.from_trace(call_trace(1, []), interner=interner)
+        b = Tree.from_trace(call_trace(2, []), interner=interner)
+        assert not any(
+            isinstance(child, anytree.SymlinkNode) for child in a.children
+        )
+        assert all(
+            isinstance(child, anytree.SymlinkNode) for child in b.children
+        )
+        assert b.children[0].target is a.children[0]
+        assert b.get_cf_nodes() == a.get_cf_nodes()
+        assert b.to_expr({}) == a.to_expr({})
+        assert interner.stats() == {
+            "nodes": 12,
+            "unique_subtrees": 3,
+            "shared_subtrees": 3,
+            "nodes_saved": 4,
+        }
+
+    def test_same_result_as_unshared(self):
+        interner = SubtreeInterner()
+        for n in range(3):
+            trace = call_trace(n, [])
+            shared = Tree.from_trace(trace, interner=interner)
+            tree = Tree.from_trace(trace)
+            assert shared.root == tree.root
+            assert shared.get_cf_nodes() == tree.get_cf_nodes()
+            assert shared.to_expr({}) == tree.to_expr({})
+
+    def test_loops_not_shared(self):
+        interner = SubtreeInterner()
+        a = Tree.from_trace(call_trace(1, [loop(2)]), interner=interner)
+        b = Tree.from_trace(call_trace(2, [loop(2)]), interner=interner)
+        assert a.get_loop_nodes()[0] is not b.get_loop_nodes()[0]
+        assert not isinstance(b.children[2], anytree.SymlinkNode)
+
+    def test_leaves_not_shared(self):
+        interner = SubtreeInterner()
+        Tree.from_trace(call_trace(1, [stmt(9)]), interner=interner)
+        b = Tree.from_trace(call_trace(2, [stmt(9)]), interner=interner)
+        assert not isinstance(b.children[2], anytree.SymlinkNode)
+
+    def test_analyze(self, capsys):
+        interner = SubtreeInterner()
+        shared = utils.from_file(DATA_PATH, interner=interner)
+        trees = utils.from_file(DATA_PATH)
+        assert interner.stats()["nodes_saved"] > 0
+        assert analyze.analyze({}, shared) == analyze.analyze({}, trees)
+
+    def test_reused_after_modification(self):
+        interner = SubtreeInterner()
+        a = Tree.from_trace(call_trace(1, []), interner=interner)
+        # Replace children inside a canonical subtree, as CallIndex.link()
+        # does for recursive calls.
+        call = a.children[1]
+        call.children[0].children = [anytree.SymlinkNode(a.children[0])]
+        b = Tree.from_trace(call_trace(2, []), interner=interner)
+        assert b.children[0].target is a.children[0]
+        # The modified subtree is not handed out any more.
+        assert not isinstance(b.children[1], anytree.SymlinkNode)
+        assert b.root == Tree.from_trace(call_trace(2, [])).root
+        c = Tree.from_trace(call_trace(3, []), interner=interner)
+        assert c.children[1].target is b.children[1]
+        assert c.root == Tree.from_trace(call_trace(3, [])).root
+        # The two modified subtrees were replaced by those of b.
+        assert len(interner) == interner.stats()["unique_subtrees"] == 3
+
+    def test_reused_after_link(self, capsys):
+        interner = SubtreeInterner()
+        first = utils.from_file(DATA_PATH, interner=interner)
+        analyze.link_recursive_nodes(first)
+        shared = utils.from_file(DATA_PATH, interner=interner)
+        trees = utils.from_file(DATA_PATH)
+        assert [tree.root for tree in shared] == [tree.root for tree in trees]
+        assert analyze.analyze({}, shared) == analyze.analyze({}, trees)
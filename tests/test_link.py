@@ -0,0 +1,107 @@
+import anytree
+import pytest
+
+from papan import CallIndex, Tree, analyze, utils
+
+SIG = "int fib(int)"
+
+
+def call(n, children=()):
+    return {
+        "id": 1,
+        "type": "CalleeExpr",
+        "sig": SIG,
+        "params": [{"name": "n", "value": str(n)}],
+        "children": list(children),
+    }
+
+
+def fib_trace(n):
+    """Return the trace of a naive recursive fibonacci call."""
+    if n < 2:
+        return call(
+            n, [{"id": 2, "type": "ReturnStmt", "desc": "n", "children": []}]
+        )
+    return call(
+        n,
+        [
+            {
+                "id": 3,
+                "type": "ReturnStmt",
+                "desc": "fib(n - 1) + fib(n - 2)",
+                "children": [fib_trace(n - 1), fib_trace(n - 2)],
+            }
+        ],
+    )
+
+
+def links(tree):
+    """Return the contexts of the linked calls of tree in pre-order."""
+    found = []
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, anytree.SymlinkNode):
+            assert not isinstance(node.target, anytree.SymlinkNode)
+            found.append(node.params[0]["value"])
+            continue
+        stack.extend(reversed(node.children))
+    return found
+
+
+class TestGroupCallIndex:
+    def test_link(self):
+        trees = [Tree.from_trace(fib_trace(n)) for n in (4, 2)]
+        index = CallIndex(trees)
+        assert len(index) == 2
+        # fib(4) calls fib(3) and fib(2); fib(2) is a trace, and fib(3) is
+        # not, so the fib(2) inside fib(3) is linked too.
+        assert index.link() == 2
+        assert links(trees[0]) == ["2", "2"]
+        # fib(1) and fib(0) have no traces.
+        assert links(trees[1]) == []
+
+    def test_nested_links(self):
+        trees = [Tree.from_trace(fib_trace(n)) for n in (4, 3)]
+        CallIndex(trees).link()
+        # Calls inside a linked call are not linked themselves.
+        assert links(trees[0]) == ["3"]
+
+    def test_idempotent(self):
+        trees = [Tree.from_trace(fib_trace(n)) for n in (4, 2)]
+        index = CallIndex(trees)
+        index.link()
+        assert index.link() == 0
+        assert CallIndex(trees).link() == 0
+        assert links(trees[0]) == ["2", "2"]
+
+    def test_incremental(self):
+        trees = [Tree.from_trace(fib_trace(5))]
+        index = CallIndex(trees)
+        assert index.link() == 0
+        trees.append(Tree.from_trace(fib_trace(3)))
+        index.add(trees[-1])
+        assert index.link() == 2
+        assert links(trees[0]) == ["3", "3"]
+
+    def test_differing_trees(self):
+        index = CallIndex([Tree.from_trace(fib_trace(3))])
+        with pytest.raises(RuntimeError):
+            index.add(Tree.from_trace(call(3)))
+
+    def test_loader(self, tmp_path):
+        index = CallIndex()
+        trees = utils.from_json(
+            {"traces": [fib_trace(n) for n in (4, 3, 2)]}, index=index
+        )
+        assert len(index) == 3
+        assert index.link() == 3
+        assert links(trees[0]) == ["3", "2"]
+        assert links(trees[1]) == ["2"]
+
+    def test_analyze_twice(self, capsys):
+        trees = [Tree.from_trace(fib_trace(n)) for n in range(2, 7)]
+        index = CallIndex(trees)
+        results = analyze.analyze({}, trees, index=index)
+        assert analyze.analyze({}, trees, index=index) == results
+        assert analyze.analyze({}, trees) == results
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+from papan import Tree, analyze, utils
+from papan.live import (
+    analyze_live,
+    iter_trees,
+    open_source,
+    serve_traces,
+    write_traces,
+)
+
+from helpers import loop_trace
+
+DATA_PATH = pathlib.Path(__file__).parent / "data" / "paptrace.json"
+SRC_PATH = pathlib.Path(__file__).parents[1] / "src"
+
+
+def run_served(address, traces, **kwargs):
+    async def run():
+        server = await serve_traces(address, traces)
+        if address.startswith("tcp:"):
+            port = server.sockets[0].getsockname()[1]
+            address_ = f"tcp:127.0.0.1:{port}"
+        else:
+            address_ = address
+        try:
+            return await analyze_live(address_, {}, **kwargs)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    return asyncio.run(run())
+
+
+class TestGroupLive:
+    def test_unix(self, tmp_path, capsys):
+        traces = list(utils.iter_traces(DATA_PATH))
+        results = run_served(f"unix:{tmp_path / 'papan.sock'}", traces)
+        assert results == analyze.analyze({}, utils.from_file(DATA_PATH))
+
+    def test_tcp(self, capsys):
+        traces = [loop_trace(n, n * n, body=()) for n in range(1, 8)]
+        results = run_served("tcp:127.0.0.1:0", traces, queue_size=1)
+        trees = [Tree.from_trace(trace) for trace in traces]
+        assert results == analyze.analyze({}, trees)
+        assert "Streamed 7 trees into 1 paths." in capsys.readouterr().out
+
+    def test_pipe(self, tmp_path, capsys):
+        fifo = tmp_path / "paptrace.fifo"
+        os.mkfifo(fifo)
+        env = dict(os.environ, PYTHONPATH=str(SRC_PATH))
+        # The stand-in producer writes into the FIFO like a traced run.
+        producer = subprocess.Popen(
+            f'"{sys.executable}" -m papan.live "{DATA_PATH}" > "{fifo}"',
+            shell=True,
+            env=env,
+        )
+        results = asyncio.run(analyze_live(f"pipe:{fifo}", {}))
+        assert producer.wait() == 0
+        assert results == analyze.analyze({}, utils.from_file(DATA_PATH))
+
+    def test_backpressure(self, tmp_path):
+        address = f"unix:{tmp_path / 'papan.sock'}"
+        # About 25kB per record, far more than the socket buffers hold.
+        traces = [loop_trace(n, 200, body=()) for n in range(200)]
+
+        async def run():
+            written = []
+
+            async def handle(_, writer):
+                class Counting:
+                    def __iter__(self):
+                        for trace in traces:
+                            written.append(trace)
+                            yield trace
+
+                await write_traces(writer, Counting())
+
+            server = await asyncio.start_unix_server(
+                handle, address[len("unix:") :]
+            )
+            # The stream pauses the socket once it buffers 128kB.
+            async with open_source(address, limit=1 << 16) as reader:
+                trees = iter_trees(reader, queue_size=1)
+                first = await trees.__anext__()
+                await asyncio.sleep(0.2)
+                assert len(written) < len(traces)
+                rest = [tree async for tree in trees]
+            server.close()
+            await server.wait_closed()
+            return [first] + rest, written
+
+        trees, written = asyncio.run(run())
+        assert len(written) == len(trees) == len(traces)
+        assert [tree.root.params[0]["value"] for tree in trees] == [
+            str(n) for n in range(200)
+        ]
+
+    def test_stopped_early(self):
+        async def run():
+            reader = asyncio.StreamReader()
+            for n in range(1, 8):
+                reader.feed_data(json.dumps(loop_trace(n, n)).encode() + b"\n")
+            reader.feed_eof()
+            trees = iter_trees(reader, queue_size=1)
+            first = await trees.__anext__()
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            await trees.aclose()
+            # The reader task is finished, not merely cancelled.
+            assert tasks and all(task.done() for task in tasks)
+            return first
+
+        tree = asyncio.run(run())
+        assert tree.root.params[0]["value"] == "1"
+
+    def test_invalid_record(self, tmp_path):
+        address = f"unix:{tmp_path / 'papan.sock'}"
+
+        async def run():
+            async def handle(_, writer):
+                writer.write(json.dumps(loop_trace(1, 1, body=())).encode())
+                writer.write(b"\nnot json\n")
+                await writer.drain()
+                writer.close()
+
+            server = await asyncio.start_unix_server(
+                handle, address[len("unix:") :]
+            )
+            try:
+                async with open_source(address) as reader:
+                    return [tree async for tree in iter_trees(reader)]
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        with pytest.raises(json.JSONDecodeError):
+            asyncio.run(run())
+
+    @pytest.mark.parametrize(
+        "address", ["foo", "pipe:", "tcp:localhost", "tcp::80", "file:x"]
+    )
+    def test_invalid_address(self, address):
+        with pytest.raises(ValueError):
+            asyncio.run(analyze_live(address, {}))
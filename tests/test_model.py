@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from papan import CostModel
+
+RESULTS = {
+    "sigs": {"void foo(int)": "sig_0", "void bar(int, int)": "sig_1"},
+    "ctxs": {
+        "sig_0": {"1": "path_0", "2": "path_1", "3": "path_0"},
+        "sig_1": {"1, 2": "path_0", "4, 3": "path_0"},
+    },
+    "exprs": {
+        "sig_0": {"path_0": "C_1 + T_12*X0**2", "path_1": "C_3"},
+        "sig_1": {"path_0": "C_1*X0*X1 + 2"},
+    },
+}
+COSTS = {"C_1": 1, "C_3": 5, "T_12": 2}
+
+
+class TestGroupCostModel:
+    def test_predict(self):
+        model = CostModel(RESULTS, COSTS)
+        assert model.sigs == ["void foo(int)", "void bar(int, int)"]
+        assert model.predict("void foo(int)", [3]) == 19
+        assert model.predict("void foo(int)", [2]) == 5
+        assert model.predict("void bar(int, int)", (5, 7)) == 37
+
+    def test_predict_batch(self):
+        model = CostModel(RESULTS, COSTS)
+        assert np.array_equal(
+            model.predict_batch("void foo(int)", [1, 2, 3, 2, 1]),
+            [3, 5, 19, 5, 3],
+        )
+        X = np.random.default_rng(0).integers(1, 100, (1000, 2))
+        costs = model.predict_batch("void bar(int, int)", X)
+        assert np.array_equal(costs, X[:, 0] * X[:, 1] + 2)
+        assert np.array_equal(
+            costs, [model.predict("void bar(int, int)", ctx) for ctx in X]
+        )
+
+    def test_default_cost(self):
+        with pytest.raises(ValueError, match="T_12"):
+            CostModel(RESULTS, {"C_1": 1, "C_3": 5})
+        model = CostModel(RESULTS, default_cost=1)
+        assert model.predict("void foo(int)", [3]) == 10
+
+    def test_unknown_context(self):
+        model = CostModel(RESULTS, COSTS)
+        # bar has a single path, so any context is accepted.
+        assert model.predict("void bar(int, int)", (10, 10)) == 102
+        with pytest.raises(KeyError, match="not observed"):
+            model.predict("void foo(int)", [4])
+        with pytest.raises(KeyError, match="not observed"):
+            model.predict_batch("void foo(int)", [1, 4])
+        with pytest.raises(KeyError, match="Unknown signature"):
+            model.predict("void baz()", [])
+
+    def test_wrong_number_of_params(self):
+        model = CostModel(RESULTS, COSTS)
+        with pytest.raises(ValueError):
+            model.predict("void bar(int, int)", [1])
+        with pytest.raises(ValueError):
+            model.predict_batch("void bar(int, int)", [1, 2])
+
+    def test_predict_batch_paths_of_matrix(self):
+        results = {
+            "sigs": {"void baz(int, int)": "sig_0"},
+            "ctxs": {"sig_0": {"1, 2": "path_0", "2, 1": "path_1"}},
+            "exprs": {"sig_0": {"path_0": "X0 + X1", "path_1": "X0 * X1"}},
+        }
+        model = CostModel(results)
+        X = [[2, 1], [1, 2], [2, 1], [1, 2]]
+        assert np.array_equal(
+            model.predict_batch("void baz(int, int)", X), [2, 3, 2, 3]
+        )
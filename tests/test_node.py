@@ -1,6 +1,13 @@
+import pickle
+
+import anytree
 import pytest
+import sympy
 
 from papan import Node, StmtNode, CallNode
+from papan.node import LoopNode, cost_symbol, parse_known_exprs
+
+from helpers import loop_stmt, stmt
 
 
 class TestGroupNode:
@@ -227,3 +234,329 @@ class TestGroupCallNode:
             == "CallNode(name='C', params=[{'name': 'c', 'value': 'a'}],"
             " sig='char Baz::baz(char)', type='CalleeExpr')"
         )
+
+
+class TestGroupStructuralHash:
+    trace = {
+        "id": 123,
+        "type": "CalleeExpr",
+        "sig": "int foo(int)",
+        "params": [{"name": "a", "value": "1"}],
+        "children": [
+            {
+                "id": 456,
+                "type": "IfThenStmt",
+                "desc": "a > 0",
+                "children": [
+                    {
+                        "id": 789,
+                        "type": "ReturnStmt",
+                        "desc": "return 1",
+                        "children": [],
+                    }
+                ],
+            }
+        ],
+    }
+
+    def test_equal_subtrees(self):
+        a = Node.from_trace(self.trace)
+        b = Node.from_trace(self.trace)
+        assert a is not b
+        assert a == b
+        assert hash(a) == hash(b)
+        assert len({a, b}) == 1
+
+    def test_differing_descendant(self):
+        a = Node.from_trace(self.trace)
+        b = Node.from_trace(self.trace)
+        leaf = b.children[0].children[0]
+        leaf.parent = None
+        assert a != b
+        assert a.children[0] != b.children[0]
+
+    def test_hash_invalidated_on_attach(self):
+        a = Node.from_trace(self.trace)
+        b = Node.from_trace(self.trace)
+        assert hash(a) == hash(b)
+        StmtNode(1011, "ReturnStmt", "return 0", parent=b.children[0])
+        assert hash(a) != hash(b)
+        assert a != b
+
+    def test_differing_params(self):
+        a = Node.from_trace(self.trace)
+        other = dict(self.trace, params=[{"name": "a", "value": "2"}])
+        b = Node.from_trace(other)
+        assert a != b
+        assert a.children[0] == b.children[0]
+
+    def test_pickle(self):
+        a = Node.from_trace(self.trace)
+        hash(a)
+        b = pickle.loads(pickle.dumps(a))
+        assert b._hash is None
+        assert a == b
+
+
+class TestGroupCfNodes:
+    trace = TestGroupStructuralHash.trace
+
+    def test_cf_nodes(self):
+        node = Node.from_trace(self.trace)
+        assert node.get_cf_nodes() == (456, 789)
+        assert node.children[0].get_cf_nodes() == (456, 789)
+
+    def test_cached(self):
+        node = Node.from_trace(self.trace)
+        assert node.get_cf_nodes() is node.get_cf_nodes()
+
+    def test_invalidated_on_attach(self):
+        node = Node.from_trace(self.trace)
+        child = node.children[0]
+        assert node.get_cf_nodes() == (456, 789)
+        assert child.get_cf_nodes() == (456, 789)
+        StmtNode(1011, "ReturnStmt", "return 0", parent=child)
+        assert child.get_cf_nodes() == (456, 789, 1011)
+        assert node.get_cf_nodes() == (456, 789, 1011)
+
+    def test_invalidated_on_replace(self):
+        node = Node.from_trace(self.trace)
+        child = node.children[0]
+        assert node.get_cf_nodes() == (456, 789)
+        child.children = [anytree.SymlinkNode(child.children[0])]
+        assert node.get_cf_nodes() == (456, 789)
+        child.children = []
+        assert node.get_cf_nodes() == (456,)
+
+
+class TestGroupLoopNode:
+    def test_no_children(self):
+        node = LoopNode.from_trace(loop_stmt(0))
+        assert node.iter_count == 0
+        assert node.iter_block == []
+        assert node.trailing_iter_block is None
+
+    def test_no_iterations(self):
+        trace = {
+            "id": 3,
+            "type": "ForStmt",
+            "desc": "for",
+            "children": [stmt(10, "IfThenStmt"), stmt(12)],
+        }
+        node = LoopNode.from_trace(trace)
+        assert node.iter_count == 0
+        assert node.iter_block == []
+        assert node.get_cf_nodes() == (3,)
+
+    def test_consistent_iterations(self):
+        trace = loop_stmt(5)
+        # Drop the final failing loop condition check.
+        trace["children"].pop()
+        node = LoopNode.from_trace(trace)
+        assert node.iter_count == 5
+        assert [child.name for child in node.iter_block] == [10, 11, 12]
+        assert node.trailing_iter_block is None
+        assert node.get_cf_nodes() == (3, 10, 11)
+
+    def test_final_condition_check(self):
+        node = LoopNode.from_trace(loop_stmt(5))
+        assert node.iter_count == 5
+        assert [child.name for child in node.trailing_iter_block] == [10]
+        assert node.get_cf_nodes() == (3, 10, 11, 10)
+
+    def test_trailing_iteration(self):
+        node = LoopNode.from_trace(loop_stmt(5, exit_id=13))
+        assert node.iter_count == 5
+        assert [child.name for child in node.iter_block] == [10, 11, 12]
+        assert [child.name for child in node.trailing_iter_block] == [
+            10,
+            11,
+            13,
+        ]
+        assert node.get_cf_nodes() == (3, 10, 11, 10, 11, 13)
+
+    def test_pre_body_matched_by_statement(self):
+        # A pre-body statement ends the iteration even when the nodes below it
+        # differ from its first occurrence.
+        trace = loop_stmt(3)
+        trace["children"][-1] = stmt(10, "IfThenStmt", [stmt(13, "ReturnStmt")])
+        node = LoopNode.from_trace(trace)
+        assert node.iter_count == 3
+        assert [child.name for child in node.trailing_iter_block] == [10]
+
+    def test_pre_body_call_in_condition(self):
+        def condition(i):
+            call = {
+                "id": 20,
+                "type": "CallerExpr",
+                "sig": "bool more(int)",
+                "params": [{"name": "i", "value": str(i)}],
+                "children": [stmt(21)],
+            }
+            return stmt(10, "IfThenStmt", [call])
+
+        children = [condition(0)]
+        for i in range(1, 4):
+            children += [stmt(11, "LoopIter"), stmt(12), condition(i)]
+        trace = {
+            "id": 3,
+            "type": "ForStmt",
+            "desc": "for",
+            "children": children,
+        }
+        node = LoopNode.from_trace(trace)
+        # Every condition check ends an iteration, although each one calls
+        # more() with another argument.
+        assert node.iter_count == 3
+        assert [child.name for child in node.iter_block] == [10, 11, 12]
+        assert [child.name for child in node.trailing_iter_block] == [10]
+        assert node.get_cf_nodes() == (3, 10, 11, 10)
+
+
+class TestGroupFoldIterations:
+    def assert_same_loop(self, trace):
+        node = LoopNode.from_trace(trace)
+        folded = LoopNode.from_trace(trace, fold_iterations=True)
+        assert folded.iter_count == node.iter_count
+        assert folded.iter_block == node.iter_block
+        assert folded.trailing_iter_block == node.trailing_iter_block
+        assert folded.get_cf_nodes() == node.get_cf_nodes()
+        assert folded.to_expr({}) == node.to_expr({})
+        return folded
+
+    def test_consistent_iterations(self):
+        trace = loop_stmt(100)
+        trace["children"].pop()
+        folded = self.assert_same_loop(trace)
+        assert folded.iter_count == 100
+        # The first iteration, plus the last one.
+        assert len(folded.children) == 2 * 3
+
+    def test_trailing_iteration(self):
+        folded = self.assert_same_loop(loop_stmt(100, exit_id=13))
+        assert len(folded.children) < 10
+
+    def test_no_iterations(self):
+        folded = self.assert_same_loop(loop_stmt(0))
+        assert [child.name for child in folded.children] == [10]
+
+    def test_alternating_runs(self):
+        trace = loop_stmt(6)
+        # Every other iteration takes a branch.
+        for i in range(0, 6, 2):
+            trace["children"][2 + 3 * i]["children"] = [stmt(14, "ReturnStmt")]
+        self.assert_same_loop(trace)
+
+    def test_nested_loops(self):
+        inner = loop_stmt(50)
+        inner["id"] = 20
+        outer = loop_stmt(20)
+        for i in range(20):
+            outer["children"][2 + 3 * i] = dict(inner)
+        node = Node.from_trace(outer)
+        folded = Node.from_trace(outer, fold_iterations=True)
+        assert folded.iter_count == node.iter_count
+        assert folded.get_cf_nodes() == node.get_cf_nodes()
+        assert folded.to_expr({}) == node.to_expr({})
+        assert len(folded.iter_block[1].children) < 10
+
+    def test_count_distinguishes_folded_loops(self):
+        a = LoopNode.from_trace(loop_stmt(5), fold_iterations=True)
+        b = LoopNode.from_trace(loop_stmt(6), fold_iterations=True)
+        assert a != b
+        assert a == LoopNode.from_trace(loop_stmt(5), fold_iterations=True)
+
+
+class TestGroupToExpr:
+    trace = {
+        "id": 1,
+        "type": "CalleeExpr",
+        "sig": "void foo(int)",
+        "params": [{"name": "n", "value": "3"}],
+        "children": [
+            stmt(2),
+            stmt(3, "IfThenStmt", [stmt(4)]),
+            {
+                "id": 5,
+                "type": "CallerExpr",
+                "sig": "int bar(int)",
+                "params": [{"name": "n", "value": "3"}],
+                "children": [],
+            },
+        ],
+    }
+
+    def test_symbols(self):
+        node = Node.from_trace(self.trace)
+        assert node.to_expr({}) == sympy.sympify("C_1 + T_2 + T_4 + T_5")
+        assert cost_symbol("T", 2) == sympy.Symbol("T_2")
+        assert cost_symbol("C", 1) == sympy.Symbol("C_1")
+
+    def test_parsed_known_exprs(self):
+        node = Node.from_trace(self.trace)
+        known = {"int bar(int)": "2*X0 + 1", "stmt 4": "D"}
+        parsed = parse_known_exprs(known)
+        assert parsed["stmt 4"] == sympy.Symbol("D")
+        assert node.to_expr(parsed) == node.to_expr(known)
+        assert node.to_expr(parsed) == sympy.sympify("C_1 + T_2 + D + 2*X0 + 1")
+
+
+class TestGroupRecords:
+    trace = {
+        "id": 1,
+        "type": "CalleeExpr",
+        "sig": "void foo(int)",
+        "params": [{"name": "n", "value": "5"}],
+        "children": [
+            stmt(2, "IfThenStmt", [stmt(4)]),
+            loop_stmt(5, exit_id=13),
+            {
+                "id": 5,
+                "type": "CallerExpr",
+                "sig": "int bar()",
+                "params": [],
+                "children": [],
+            },
+        ],
+    }
+
+    def assert_same_nodes(self, node, expected):
+        # Links are compared below, and caches may not be filled in yet.
+        skip = (
+            "_NodeMixin__parent",
+            "_NodeMixin__children",
+            "_cf_nodes",
+            "_hash",
+        )
+        nodes = list(anytree.PreOrderIter(node))
+        expected_nodes = list(anytree.PreOrderIter(expected))
+        assert len(nodes) == len(expected_nodes)
+        for a, b in zip(nodes, expected_nodes):
+            assert type(a) is type(b)
+            a_vars = {k: v for k, v in vars(a).items() if k not in skip}
+            b_vars = {k: v for k, v in vars(b).items() if k not in skip}
+            assert a_vars == b_vars
+            if a.parent is None:
+                assert b.parent is None
+            else:
+                assert a.parent.name == b.parent.name
+
+    def test_round_trip(self):
+        node = Node.from_trace(self.trace)
+        restored = Node._from_records(node._to_records())
+        self.assert_same_nodes(restored, node)
+        assert restored == node
+        loop = restored.children[1]
+        assert all(child.parent is loop for child in loop.iter_block)
+        assert all(child.parent is loop for child in loop.trailing_iter_block)
+
+    def test_pickle(self):
+        node = Node.from_trace(self.trace, fold_iterations=True)
+        records = pickle.loads(pickle.dumps(node._to_records()))
+        self.assert_same_nodes(Node._from_records(records), node)
+
+    def test_links(self):
+        node = Node.from_trace(self.trace)
+        node.children = [anytree.SymlinkNode(node.children[0])]
+        with pytest.raises(ValueError):
+            node._to_records()
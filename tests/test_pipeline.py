@@ -0,0 +1,40 @@
+import json
+import pathlib
+
+import pytest
+
+from papan import Tree, analyze, utils
+from papan.pipeline import StreamingAnalysis, analyze_file
+
+from helpers import loop_trace
+
+DATA_PATH = pathlib.Path(__file__).parent / "data" / "paptrace.json"
+
+
+class TestGroupStreamingAnalysis:
+    def test_matches_analyze(self, capsys):
+        expected = analyze.analyze({}, utils.from_file(DATA_PATH))
+        assert analyze_file(DATA_PATH, {}) == expected
+
+    def test_loop_buckets(self, tmp_path, capsys):
+        traces = [loop_trace(n, n * n) for n in range(1, 8)]
+        traces += [loop_trace(n, n * n) for n in range(1, 4)]
+        path = tmp_path / "paptrace.json"
+        path.write_text(json.dumps({"traces": traces}))
+        analysis = StreamingAnalysis({}).consume(utils.iter_trees(path))
+        assert analysis.stats() == {"trees": 10, "paths": 1}
+        (bucket,) = analysis.path_dict["void foo(int)"].values()
+        # Only the first tree of the path is kept.
+        assert len(bucket["traces"]) == 1
+        assert bucket["loop_counts"] == [
+            [n * n for n in range(1, 8)] + [1, 4, 9]
+        ]
+        assert len(bucket["contexts"]) == 7
+        trees = [Tree.from_trace(trace) for trace in traces]
+        assert analysis.results() == analyze.analyze({}, trees)
+
+    def test_differing_trees(self):
+        analysis = StreamingAnalysis({})
+        analysis.add(Tree.from_trace(loop_trace(3, 9)))
+        with pytest.raises(RuntimeError):
+            analysis.add(Tree.from_trace(loop_trace(3, 4)))
@@ -0,0 +1,79 @@
+import pytest
+
+from papan import ContextReducer, analyze
+
+from helpers import loop_tree
+
+
+def sample_ctxs(path_dict, sig="void foo(int)"):
+    (path_entry,) = path_dict[sig].values()
+    return [int(tree.root.params[0]["value"]) for tree in path_entry["sample"]]
+
+
+class TestGroupContextReducer:
+    def test_dedup(self):
+        trees = [loop_tree(n, n) for n in (1, 2, 1, 3, 2, 1)]
+        path_dict = analyze.get_path_partitions(trees)
+        reducer = ContextReducer()
+        reducer.reduce(path_dict)
+        assert sample_ctxs(path_dict) == [1, 2, 3]
+        assert reducer.stats() == {
+            "void foo(int)": {
+                "traces": 6,
+                "duplicates": 3,
+                "sampled_out": 0,
+                "kept": 3,
+            }
+        }
+
+    @pytest.mark.parametrize(
+        "sampling,expected",
+        [
+            ("log", [1, 2, 3, 4, 6, 9, 14, 21, 32, 50]),
+            ("stratified", [1, 6, 12, 17, 23, 28, 34, 39, 45, 50]),
+        ],
+    )
+    def test_sampling(self, sampling, expected):
+        trees = [loop_tree(n, n) for n in range(50, 0, -1)]
+        path_dict = analyze.get_path_partitions(trees)
+        reducer = ContextReducer(max_contexts=10, sampling=sampling)
+        reducer.reduce(path_dict)
+        # The sample keeps the order of the traces.
+        assert sample_ctxs(path_dict) == expected[::-1]
+        assert reducer.stats()["void foo(int)"]["sampled_out"] == 40
+
+    def test_per_sig(self):
+        trees = [loop_tree(n, n) for n in range(1, 21)]
+        trees += [loop_tree(n, n, "bar") for n in range(1, 21)]
+        path_dict = analyze.get_path_partitions(trees)
+        reducer = ContextReducer(
+            max_contexts=5, per_sig={"void bar(int)": {"max_contexts": None}}
+        )
+        reducer.reduce(path_dict)
+        assert len(sample_ctxs(path_dict)) == 5
+        assert len(sample_ctxs(path_dict, "void bar(int)")) == 20
+
+    def test_invalid_options(self):
+        with pytest.raises(ValueError):
+            ContextReducer(max_contexts=1)
+        with pytest.raises(ValueError):
+            ContextReducer(sampling="random")
+        with pytest.raises(ValueError):
+            ContextReducer(per_sig={"void foo(int)": {"max_context": 3}})
+
+    def test_analyze(self, capsys):
+        trees = [loop_tree(n, n * n) for n in range(1, 21) for _ in range(3)]
+        reducer = ContextReducer(max_contexts=8)
+        results = analyze.analyze({}, trees, reducer=reducer)
+        assert results["exprs"] == {"sig_0": {"path_0": "C_1 + T_12*X0**2"}}
+        # Every context is still mapped to the path.
+        assert len(results["ctxs"]["sig_0"]) == 20
+        assert "8 of 60 traces kept" in capsys.readouterr().out
+
+    def test_session(self, capsys):
+        reducer = ContextReducer(max_contexts=6)
+        session = analyze.AnalysisSession({}, reducer=reducer)
+        session.add([loop_tree(n, n * n) for n in range(1, 11)])
+        results = session.add([loop_tree(n, n * n) for n in range(11, 21)])
+        assert results["exprs"] == {"sig_0": {"path_0": "C_1 + T_12*X0**2"}}
+        assert reducer.stats()["void foo(int)"]["kept"] == 6
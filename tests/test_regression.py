@@ -0,0 +1,331 @@
+import collections
+import copy
+import random
+import threading
+
+import numpy as np
+import pytest
+import sympy
+from deap import algorithms, gp, tools
+
+from papan import regression
+
+
+class TestGroupProtectedFunctions:
+    def test_log(self):
+        x = np.array([-2.0, 0.0, 1e-7, 1.0, np.e])
+        assert np.allclose(
+            regression.protected_log(x), [1.0, 1.0, 1.0, 0.0, 1.0]
+        )
+
+    def test_sqrt(self):
+        x = np.array([-4.0, 0.0, 4.0])
+        assert np.allclose(regression.protected_sqrt(x), [1.0, 0.0, 2.0])
+
+    def test_scalar(self):
+        assert regression.protected_log(-1) == 1
+        assert regression.protected_sqrt(9) == 3
+
+
+class TestGroupEvaluate:
+    def individual(self, expr):
+        return gp.PrimitiveTree.from_string(expr, regression.pset)
+
+    def test_matches_per_sample(self):
+        x = np.arange(1, 20)
+        y = 3 * x + 1
+        individual = self.individual("add(mul(X0, X0), log(sqrt(X0)))")
+        func = regression.toolbox.compile(individual)
+        expected = np.mean(np.abs(y - np.array([func(v) for v in x])))
+        (fitness,) = regression.evaluate(individual, x, y)
+        assert np.isclose(fitness, expected)
+
+    def test_constant_program(self):
+        x = np.arange(5)
+        (fitness,) = regression.evaluate(self.individual("3"), x, x)
+        assert fitness == np.mean(np.abs(x - 3))
+
+    def test_matrix(self):
+        X = np.column_stack([np.arange(1, 6), np.arange(6, 11)])
+        individual = gp.PrimitiveTree.from_string(
+            "add(X0, mul(X1, X1))", regression._deap(2).pset
+        )
+        (fitness,) = regression.evaluate(individual, X, X[:, 0] + X[:, 1] ** 2)
+        assert fitness == 0.0
+
+    def test_concurrent(self):
+        individual = self.individual("mul(X0, X0)")
+        results = {}
+
+        def run(i):
+            x = np.arange(100) + i
+            results[i] = regression.evaluate(individual, x, x * x)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(results[i] == (0.0,) for i in range(4))
+
+
+class TestGroupFitnessCache:
+    def test_lru(self):
+        cache = regression.FitnessCache(2)
+        assert cache.get("a", lambda: (1.0,)) == (1.0,)
+        assert cache.get("b", lambda: (2.0,)) == (2.0,)
+        assert cache.get("a", lambda: (0.0,)) == (1.0,)
+        cache.get("c", lambda: (3.0,))
+        # "b" was the least recently used entry.
+        assert cache.get("b", lambda: (4.0,)) == (4.0,)
+        assert (cache.hits, cache.misses) == (1, 4)
+        assert len(cache) == 2
+
+    def test_cached_evaluate(self):
+        cache = regression.FitnessCache(10)
+        individual = gp.PrimitiveTree.from_string("add(X0, 1)", regression.pset)
+        x = np.arange(10)
+        key = regression.dataset_key(x, x)
+        expected = regression.evaluate(individual, x, x)
+        for _ in range(3):
+            fitness = regression.cached_evaluate(individual, x, x, key, cache)
+            assert fitness == expected
+        assert (cache.hits, cache.misses) == (2, 1)
+        counts = collections.Counter()
+        regression.cached_evaluate(individual, x, x, key, cache, counts)
+        assert counts == {"hits": 1}
+        # Different data with the same program is evaluated again.
+        y = x * 2
+        regression.cached_evaluate(
+            individual, x, y, regression.dataset_key(x, y), cache
+        )
+        assert cache.misses == 2
+
+
+class TestGroupRegressionCache:
+    x = np.arange(1, 9)
+    y = x * x + 3
+
+    def test_round_trip(self, tmp_path):
+        cache = regression.RegressionCache(tmp_path / "cache")
+        key = cache.key("deap", regression.DEAP_PARAMS, self.x, self.y, 1)
+        assert cache.get(key) is None
+        expr = 3 * regression.x**2 + sympy.log(regression.x) / 2
+        cache.put(key, expr)
+        assert regression.RegressionCache(tmp_path / "cache").get(key) == expr
+        assert (cache.hits, cache.misses) == (0, 1)
+
+    def test_parse_srepr(self):
+        X0, x = sympy.Symbol("X0"), sympy.Symbol("x", positive=True)
+        exprs = [
+            3 * regression.x**2 + sympy.log(regression.x) / 2,
+            sympy.Function("protected_log")(X0) * sympy.Rational(3, 2),
+            sympy.sqrt(X0) - sympy.Float(0.5) * x**2 + sympy.pi,
+            sympy.Integer(-3),
+            sympy.oo,
+        ]
+        for expr in exprs:
+            assert regression.parse_srepr(sympy.srepr(expr)) == expr
+
+    @pytest.mark.parametrize(
+        "text",
+        [
+            "__import__('pathlib').Path('pwned').touch()",
+            "Add(\"__import__('pathlib').Path('pwned').touch()\")",
+            "Symbol.__init__",
+            "Symbol('x')(1)",
+            "Add(*[1])",
+            "print('pwned')",
+        ],
+    )
+    def test_untrusted_entry(self, tmp_path, monkeypatch, text):
+        monkeypatch.chdir(tmp_path)
+        cache = regression.RegressionCache(tmp_path / "cache")
+        key = cache.key("deap", regression.DEAP_PARAMS, self.x, self.y)
+        cache.put(key, regression.x)
+        with open(cache._file(key), "w") as f:
+            f.write(text)
+        with pytest.raises(ValueError):
+            cache.get(key)
+        assert not (tmp_path / "pwned").exists()
+
+    def test_key(self):
+        key = regression.RegressionCache.key
+        params = regression.DEAP_PARAMS
+        assert key("deap", params, self.x, self.y) == key(
+            "deap", dict(params), self.x.copy(), self.y.copy()
+        )
+        assert key("deap", params, self.x, self.y) != key(
+            "gplearn", params, self.x, self.y
+        )
+        assert key("deap", params, self.x, self.y, 1) != key(
+            "deap", params, self.x, self.y, 2
+        )
+        assert key("deap", params, self.x, self.y) != key(
+            "deap", dict(params, ngen=1), self.x, self.y
+        )
+        assert key("deap", params, self.x, self.y) != key(
+            "deap", params, self.x, self.y + 1
+        )
+
+    def test_deap_symreg(self, tmp_path, monkeypatch):
+        cache = regression.RegressionCache(tmp_path)
+        expr = regression.deap_symreg(self.x, self.y, seed=1, cache=cache)
+
+        def evolve(*args, **kwargs):
+            raise AssertionError("The regression was run again.")
+
+        monkeypatch.setattr(regression, "evolve", evolve)
+        assert regression.deap_symreg(self.x, self.y, 1, cache) == expr
+        assert cache.hits == 1
+
+    def test_deap_symreg_stopping_criteria(self, tmp_path):
+        cache = regression.RegressionCache(tmp_path)
+        regression.deap_symreg(self.x, self.y, seed=1, cache=cache)
+        # Runs with other stopping criteria are not served from the cache.
+        _, stats = regression.deap_symreg(
+            self.x,
+            self.y,
+            seed=1,
+            cache=cache,
+            stall_generations=1,
+            return_stats=True,
+        )
+        assert stats is not None
+        assert cache.misses == 2
+
+
+class TestGroupEvolve:
+    x = np.arange(1, 9)
+    y = x * x
+
+    def run(self, seed=3, **kwargs):
+        toolbox = copy.copy(regression.toolbox)
+        toolbox.register("evaluate", regression.evaluate, X=self.x, Y=self.y)
+        random.seed(seed)
+        population = toolbox.population(n=50)
+        hof = tools.HallOfFame(1)
+        return toolbox, population, hof
+
+    def test_matches_ea_simple(self):
+        toolbox, population, hof = self.run()
+        _, log, reason = regression.evolve(
+            population, toolbox, 0.5, 0.1, 5, halloffame=hof
+        )
+        assert reason == "ngen"
+        toolbox, population, expected = self.run()
+        _, expected_log = algorithms.eaSimple(
+            population,
+            toolbox,
+            0.5,
+            0.1,
+            5,
+            halloffame=expected,
+            verbose=False,
+        )
+        assert str(hof[0]) == str(expected[0])
+        assert log.select("nevals") == expected_log.select("nevals")
+
+    def test_target_error(self):
+        toolbox, population, hof = self.run()
+        _, log, reason = regression.evolve(
+            population,
+            toolbox,
+            0.5,
+            0.1,
+            40,
+            halloffame=hof,
+            target_error=1e9,
+        )
+        assert reason == "target_error"
+        assert len(log) == 1
+
+    def test_stalled(self):
+        toolbox, population, hof = self.run()
+        _, log, reason = regression.evolve(
+            population,
+            toolbox,
+            0.0,
+            0.0,
+            40,
+            halloffame=hof,
+            stall_generations=3,
+        )
+        # Without variation the best fitness can never improve.
+        assert reason == "stalled"
+        assert log[-1]["gen"] == 3
+
+    def test_time_budget(self):
+        toolbox, population, _ = self.run()
+        _, log, reason = regression.evolve(
+            population, toolbox, 0.5, 0.1, 40, time_budget=0
+        )
+        assert reason == "time_budget"
+        assert len(log) == 1
+
+    def test_deap_symreg_stats(self, tmp_path, capsys):
+        cache = regression.RegressionCache(tmp_path)
+        expr, stats = regression.deap_symreg(
+            self.x, self.y, seed=1, cache=cache, return_stats=True
+        )
+        hits, misses = (
+            stats["fitness_cache_hits"],
+            stats["fitness_cache_misses"],
+        )
+        assert (
+            f"Fitness cache: {hits} hits, {misses} misses"
+            in capsys.readouterr().out
+        )
+        assert stats["stop_reason"] in ("ngen", "target_error", "stalled")
+        assert stats["generations"] == len(stats["logbook"]) - 1
+        assert stats["evaluations"] >= regression.DEAP_PARAMS["population"]
+        assert regression.deap_symreg(
+            self.x, self.y, seed=1, cache=cache, return_stats=True
+        ) == (expr, None)
+
+    def test_deap_symreg_target_error(self):
+        _, stats = regression.deap_symreg(
+            self.x, self.y, seed=1, target_error=np.inf, return_stats=True
+        )
+        assert stats["stop_reason"] == "target_error"
+        assert stats["generations"] == 0
+
+    def test_deap_symreg_concurrent_stats(self):
+        stats = [None] * 3
+
+        def run(i):
+            _, stats[i] = regression.deap_symreg(
+                self.x, self.y + i, seed=i, return_stats=True
+            )
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for run_stats in stats:
+            # Only the run's own lookups are counted.
+            assert (
+                run_stats["fitness_cache_hits"]
+                + run_stats["fitness_cache_misses"]
+                == run_stats["evaluations"]
+            )
+
+    def test_deap_symreg_matrix(self):
+        X = np.column_stack([self.x, self.x[::-1] + 2])
+        expr = regression.deap_symreg(X, X[:, 0] * X[:, 1], seed=1)
+        assert expr == sympy.Symbol("X0") * sympy.Symbol("X1")
+
+    def test_deap_symreg_time_budget_not_cached(self, tmp_path):
+        cache = regression.RegressionCache(tmp_path)
+        _, stats = regression.deap_symreg(
+            self.x,
+            self.y + 3,
+            seed=1,
+            cache=cache,
+            time_budget=0,
+            return_stats=True,
+        )
+        assert stats["stop_reason"] == "time_budget"
+        assert stats["generations"] == 0
+        assert list(tmp_path.iterdir()) == []
@@ -1,9 +1,12 @@
+import json
 import re
+import sys
 
 import anytree
 import pytest
+import sympy
 
-from papan import Node, Tree
+from papan import Node, Tree, utils
 
 
 class TestGroupTree:
@@ -42,3 +45,96 @@ class TestGroupTree:
         rendered_tree = anytree.RenderTree(tree)
         expected = "Node(name='root', val=1)\n└── Node(name='child', val=2)"
         assert rendered_tree.__str__() == expected
+
+
+class TestGroupDeepTree:
+    # Deeper than the default recursion limit allows for recursive walks.
+    depth = 2 * sys.getrecursionlimit()
+
+    def make_trace(self, depth):
+        node = {
+            "id": 3,
+            "type": "ReturnStmt",
+            "desc": "return 0",
+            "children": [],
+        }
+        for n in range(depth):
+            node = {
+                "id": 1,
+                "type": "CalleeExpr",
+                "sig": "int foo(int)",
+                "params": [{"name": "n", "value": str(n)}],
+                "children": [
+                    {
+                        "id": 2,
+                        "type": "IfThenStmt",
+                        "desc": "n > 0",
+                        "children": [node],
+                    }
+                ],
+            }
+        return node
+
+    def write_trace_file(self, path, depth):
+        # json.dump recurses as deep as the trace, so the nesting is written
+        # out directly.
+        with open(path, "w") as f:
+            f.write('{"traces": [')
+            for n in reversed(range(depth)):
+                f.write(
+                    '{"id": 1, "type": "CalleeExpr", "sig": "int foo(int)",'
+                    f' "params": [{{"name": "n", "value": "{n}"}}],'
+                    ' "children": [{"id": 2, "type": "IfThenStmt", "desc":'
+                    ' "n > 0", "children": ['
+                )
+            f.write(
+                json.dumps(
+                    {
+                        "id": 3,
+                        "type": "ReturnStmt",
+                        "desc": "return 0",
+                        "children": [],
+                    }
+                )
+            )
+            f.write("]}]}" * depth)
+            f.write("]}")
+
+    def test_from_trace(self):
+        tree = Tree.from_trace(self.make_trace(self.depth))
+        assert tree.name == f"int foo(int)(n={self.depth - 1})"
+        assert tree.root.children[0].children[0].params == [
+            {"name": "n", "value": str(self.depth - 2)}
+        ]
+
+    def test_traversals(self):
+        tree = Tree.from_trace(self.make_trace(self.depth))
+        assert tree.get_cf_nodes() == (2,) * self.depth + (3,)
+        assert tree.get_loop_nodes() == []
+        assert not tree.has_loop()
+        assert tree.to_expr({}) == sympy.sympify(f"{self.depth} * C_1")
+
+    def test_equality(self):
+        a = Tree.from_trace(self.make_trace(self.depth))
+        b = Tree.from_trace(self.make_trace(self.depth))
+        c = Tree.from_trace(self.make_trace(self.depth - 1))
+        assert hash(a.root) == hash(b.root)
+        assert a.root == b.root
+        assert a.root != c.root
+
+    def test_from_file(self, tmp_path):
+        path = tmp_path / "paptrace.json"
+        self.write_trace_file(path, self.depth)
+        (tree,) = utils.from_file(path)
+        expected = Tree.from_trace(self.make_trace(self.depth))
+        assert tree.name == expected.name
+        assert tree.root == expected.root
+
+    def test_iter_trees(self, tmp_path, monkeypatch):
+        # The trace straddles many buffer refills.
+        monkeypatch.setattr(utils, "_CHUNK_SIZE", 1024)
+        path = tmp_path / "paptrace.json"
+        self.write_trace_file(path, self.depth)
+        (tree,) = utils.iter_trees(path)
+        expected = Tree.from_trace(self.make_trace(self.depth))
+        assert tree.root == expected.root
@@ -1,8 +1,9 @@
 import json
 import pathlib
+import random
 import pytest
 
-from papan import utils
+from papan import CallIndex, SubtreeInterner, analyze, utils
 
 
 class TestGroupFromFile:
@@ -137,3 +138,232 @@ class TestGroupFromJson:
         bar_tree = trees[1]
         assert bar_tree.name == "int bar(long, char)(b=-1, c=1)"
         assert bar_tree.root.name == 456
+
+
+class TestGroupIterTrees:
+    def test_file_not_found(self):
+        path = pathlib.Path("does_not_exist")
+        with pytest.raises(FileNotFoundError):
+            list(utils.iter_trees(path))
+
+    def test_file_not_json(self, tmp_path):
+        path = tmp_path / "not_json.txt"
+        with open(path, "w") as f:
+            f.write("not json")
+        with pytest.raises(json.decoder.JSONDecodeError):
+            list(utils.iter_trees(path))
+
+    def test_no_traces_entry(self, tmp_path):
+        path = tmp_path / "trace.json"
+        with open(path, "w") as f:
+            json.dump({"version": "0.1.0"}, f)
+        with pytest.raises(KeyError, match="'traces'"):
+            list(utils.iter_trees(path))
+
+    def test_non_list_traces_entry(self, tmp_path):
+        path = tmp_path / "trace.json"
+        with open(path, "w") as f:
+            json.dump({"version": "0.1.0", "traces": {}}, f)
+        with pytest.raises(TypeError, match="The traces entry is not a list."):
+            list(utils.iter_trees(path))
+
+    def test_empty_traces_list(self, tmp_path):
+        path = tmp_path / "trace.json"
+        with open(path, "w") as f:
+            json.dump({"traces": [], "version": "0.1.0"}, f)
+        assert list(utils.iter_trees(path)) == []
+
+    def test_is_lazy(self, tmp_path):
+        path = tmp_path / "trace.json"
+        with open(path, "w") as f:
+            f.write(
+                '{"traces": [{"id": 123, "type": "CallerExpr", "sig": "int'
+                ' foo(int)", "params": [{"name": "a", "value": "1"}],'
+                ' "children": []}, not json'
+            )
+        trees = utils.iter_trees(path)
+        tree = next(trees)
+        assert tree.name == "int foo(int)(a=1)"
+        with pytest.raises(json.decoder.JSONDecodeError):
+            next(trees)
+
+    def test_actual_data(self, monkeypatch):
+        # Use a tiny read size so traces straddle many buffer refills.
+        monkeypatch.setattr(utils, "_CHUNK_SIZE", 7)
+        path = pathlib.Path(__file__).parent / "data" / "paptrace.json"
+        expected = utils.from_file(path)
+        trees = list(utils.iter_trees(path))
+        assert len(trees) == len(expected)
+        for tree, expected_tree in zip(trees, expected):
+            assert tree.name == expected_tree.name
+            assert tree.get_cf_nodes() == expected_tree.get_cf_nodes()
+
+
+def random_string(rng):
+    """Return a short string full of JSON syntax, quotes and backslashes."""
+    alphabet = [
+        '"',
+        "\\",
+        "{",
+        "}",
+        "[",
+        "]",
+        ",",
+        ":",
+        " ",
+        "a",
+        "\u00e9",
+        "\n",
+    ]
+    return "".join(rng.choice(alphabet) for _ in range(rng.randrange(12)))
+
+
+def random_value(rng, depth=0):
+    kind = rng.randrange(6 if depth < 3 else 3)
+    if kind == 0:
+        return random_string(rng)
+    if kind == 1:
+        return rng.randrange(-100, 100)
+    if kind == 2:
+        return rng.choice([None, True, False, 1.5])
+    if kind == 3:
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(3))]
+    return {
+        random_string(rng): random_value(rng, depth + 1)
+        for _ in range(rng.randrange(3))
+    }
+
+
+def random_trace(rng):
+    return {
+        "id": rng.randrange(100),
+        "desc": random_string(rng),
+        random_string(rng): random_value(rng, 1),
+        "children": [random_value(rng, 1) for _ in range(rng.randrange(3))],
+    }
+
+
+def assert_same_trees(trees, expected):
+    assert [tree.name for tree in trees] == [tree.name for tree in expected]
+    for tree, expected_tree in zip(trees, expected):
+        assert tree.root == expected_tree.root
+        loops = tree.get_loop_nodes()
+        expected_loops = expected_tree.get_loop_nodes()
+        assert [loop.iter_count for loop in loops] == [
+            loop.iter_count for loop in expected_loops
+        ]
+        assert [[n.name for n in loop.iter_block] for loop in loops] == [
+            [n.name for n in loop.iter_block] for loop in expected_loops
+        ]
+
+
+class TestGroupFromFileWorkers:
+    path = pathlib.Path(__file__).parent / "data" / "paptrace.json"
+
+    def test_actual_data(self, monkeypatch):
+        # Use a small scan size so the traces straddle many scanned blocks.
+        monkeypatch.setattr(utils, "_SCAN_SIZE", 4096)
+        expected = utils.from_file(self.path)
+        trees = utils.from_file(self.path, workers=2)
+        assert_same_trees(trees, expected)
+        for tree, expected_tree in zip(trees, expected):
+            assert tree.get_cf_nodes() == expected_tree.get_cf_nodes()
+            assert tree.to_expr({}) == expected_tree.to_expr({})
+
+    def test_fold_iterations(self):
+        expected = utils.from_file(self.path, fold_iterations=True)
+        trees = utils.from_file(self.path, fold_iterations=True, workers=2)
+        assert_same_trees(trees, expected)
+
+    def test_interner(self):
+        interner = SubtreeInterner()
+        trees = utils.from_file(self.path, interner=interner, workers=2)
+        expected_interner = SubtreeInterner()
+        expected = utils.from_file(self.path, interner=expected_interner)
+        assert_same_trees(trees, expected)
+        assert interner.stats() == expected_interner.stats()
+
+    def test_index(self, capsys):
+        index = CallIndex()
+        trees = utils.from_file(self.path, index=index, workers=2)
+        results = analyze.analyze({}, trees, index=index)
+        expected = analyze.analyze({}, utils.from_file(self.path))
+        assert results == expected
+
+    def test_trace_spans(self, tmp_path, monkeypatch):
+        traces = [
+            {"id": 1, "desc": 'a "quoted" {bracket}, [list]', "children": []},
+            {"id": 2, "desc": "ends with \\", "children": [{"id": 3}]},
+            {"id": 4, "desc": '\\"]}', "children": []},
+            {"id": 5, "desc": "\\\\\\", "children": []},
+        ]
+        data = {
+            "other": [[1, 2], {"traces": [3]}],
+            'x"traces': [4],
+            "desc": ', "traces": [',
+            "traces": traces,
+        }
+        path = tmp_path / "trace.json"
+        text = json.dumps(data, indent=2)
+        path.write_text(text)
+        for scan_size in range(1, 40):
+            monkeypatch.setattr(utils, "_SCAN_SIZE", scan_size)
+            spans = utils._trace_spans(path)
+            assert [json.loads(text[i:j]) for i, j in spans] == traces
+
+    def test_trace_spans_random(self, tmp_path, monkeypatch):
+        rng = random.Random(0)
+        path = tmp_path / "trace.json"
+        for _ in range(200):
+            traces = [random_trace(rng) for _ in range(rng.randrange(5))]
+            entries = [
+                (random_string(rng), random_value(rng)) for _ in range(3)
+            ]
+            entries.insert(rng.randrange(4), ("traces", traces))
+            data = dict(entries)
+            text = json.dumps(
+                data,
+                ensure_ascii=rng.random() < 0.5,
+                indent=rng.choice([None, 0, 2]),
+            )
+            path.write_text(text, encoding="utf-8")
+            raw = text.encode("utf-8")
+            for scan_size in (
+                rng.randrange(1, 8),
+                rng.randrange(8, 64),
+                1 << 16,
+            ):
+                monkeypatch.setattr(utils, "_SCAN_SIZE", scan_size)
+                spans = utils._trace_spans(path)
+                assert [json.loads(raw[i:j]) for i, j in spans] == traces
+
+    def test_no_single_traces_array(self, tmp_path):
+        path = tmp_path / "trace.json"
+        path.write_text('{"x\\"traces": [{"id": 1}]}')
+        assert utils._trace_spans(path) is None
+        path.write_text('{"traces": [{"id": 1}], "traces": [{"id": 2}]}')
+        assert utils._trace_spans(path) is None
+        # Scalar elements are not located; the serial load rejects them.
+        path.write_text('{"traces": [{"id": 1}, 2]}')
+        assert utils._trace_spans(path) is None
+
+    def test_empty_traces_list(self, tmp_path):
+        path = tmp_path / "trace.json"
+        with open(path, "w") as f:
+            json.dump({"traces": [], "version": "0.1.0"}, f)
+        assert utils._trace_spans(path) == []
+        assert utils.from_file(path, workers=2) == []
+
+    def test_no_traces_entry(self, tmp_path):
+        path = tmp_path / "trace.json"
+        with open(path, "w") as f:
+            json.dump({"version": "0.1.0"}, f)
+        with pytest.raises(KeyError, match="'traces'"):
+            utils.from_file(path, workers=2)
+
+    def test_non_list_traces_entry(self, tmp_path):
+        path = tmp_path / "trace.json"
+        with open(path, "w") as f:
+            json.dump({"traces": {}}, f)
+        with pytest.raises(TypeError):
+            utils.from_file(path, workers=2)